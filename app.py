@@ -7,16 +7,46 @@ Dify智能助手Web应用
 
 import os
 import json
+import logging
+import re
 import uuid
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for, stream_template
+import mimetypes
+import hashlib
+from collections import OrderedDict
+from flask import Flask, render_template, request, jsonify, session, redirect, url_for, stream_template, g, send_from_directory
 from werkzeug.utils import secure_filename
+from werkzeug.security import safe_join
+from werkzeug.wsgi import get_input_stream
+from werkzeug.sansio.multipart import MultipartDecoder, Field, File, Data, Epilogue, NeedData
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from datetime import datetime
+from contextlib import contextmanager
 import threading
 import time
+import asyncio
+import itertools
+import functools
+import heapq
+import random
+import shutil
+import tempfile
+import zipfile
+import queue
+import sqlite3
+import zlib
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+import metrics
+import app_logging
+import keyword_index
+import extraction
 
 # 导入配置
-from config import AppConfig, DifyAPIConfig, DefaultSettings
+from config import AppConfig, DifyAPIConfig, DefaultSettings, HTTPPoolConfig, StreamConfig, CacheConfig, AdmissionConfig, DocumentConfig, IngestConfig, IndexingConfig, SyncConfig, KeywordIndexConfig, FederatedRetrievalConfig, ExtractionConfig, UpstreamConfig, AssetConfig
 
 app = Flask(__name__)
 app.secret_key = AppConfig.SECRET_KEY
@@ -25,18 +55,856 @@ app.secret_key = AppConfig.SECRET_KEY
 app.config['UPLOAD_FOLDER'] = AppConfig.UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = AppConfig.MAX_CONTENT_LENGTH
 
+app_logging.setup_logging()
+logger = app_logging.get_logger('app')
+
+class UpstreamSessionPool:
+    """上游HTTP连接池
+    
+    每个API密钥对应一个共享的HTTPAdapter（持有urllib3连接池，负责keep-alive与重试），
+    每个工作线程持有自己的Session并挂载该Adapter：连接在线程之间复用，
+    而Session自身的Cookie等状态不会在线程之间共享。
+    """
+    
+    def __init__(self, pool_connections=None, pool_maxsize=None, max_retries=None, backoff_factor=None):
+        self.pool_connections = pool_connections or HTTPPoolConfig.POOL_CONNECTIONS
+        self.pool_maxsize = pool_maxsize or HTTPPoolConfig.POOL_MAXSIZE
+        self.max_retries = HTTPPoolConfig.MAX_RETRIES if max_retries is None else max_retries
+        self.backoff_factor = HTTPPoolConfig.BACKOFF_FACTOR if backoff_factor is None else backoff_factor
+        self._adapters = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+    
+    def _build_adapter(self):
+        """创建带重试策略的连接池Adapter"""
+        retry = Retry(
+            total=self.max_retries,
+            backoff_factor=self.backoff_factor,
+            status_forcelist=HTTPPoolConfig.RETRY_STATUS_FORCELIST,
+            raise_on_status=False
+        )
+        return HTTPAdapter(
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize,
+            max_retries=retry,
+            pool_block=HTTPPoolConfig.POOL_BLOCK
+        )
+    
+    def _get_adapter(self, api_key):
+        with self._lock:
+            adapter = self._adapters.get(api_key)
+            if adapter is None:
+                adapter = self._build_adapter()
+                self._adapters[api_key] = adapter
+            return adapter
+    
+    def get_session(self, api_key):
+        """获取当前线程、指定API密钥对应的Session"""
+        sessions = getattr(self._local, 'sessions', None)
+        if sessions is None:
+            sessions = self._local.sessions = {}
+        
+        session = sessions.get(api_key)
+        if session is None:
+            adapter = self._get_adapter(api_key)
+            session = requests.Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            sessions[api_key] = session
+        return session
+    
+    def stats(self):
+        """连接复用统计
+        
+        hits: 复用已有keep-alive连接完成的请求数
+        misses: 需要新建TCP连接的次数
+        """
+        with self._lock:
+            adapters = list(self._adapters.items())
+        
+        result = {'hits': 0, 'misses': 0, 'requests': 0, 'keys': {}}
+        for api_key, adapter in adapters:
+            total_requests = 0
+            new_connections = 0
+            pools = adapter.poolmanager.pools
+            for pool_key in pools.keys():
+                pool = pools.get(pool_key)
+                if pool is None:
+                    continue
+                total_requests += pool.num_requests
+                new_connections += pool.num_connections
+            
+            hits = max(total_requests - new_connections, 0)
+            result['keys'][mask_secret(api_key)] = {
+                'requests': total_requests,
+                'hits': hits,
+                'misses': new_connections
+            }
+            result['requests'] += total_requests
+            result['hits'] += hits
+            result['misses'] += new_connections
+        
+        result['hit_ratio'] = round(result['hits'] / result['requests'], 4) if result['requests'] else 0.0
+        return result
+    
+    def close(self):
+        """关闭所有连接池"""
+        with self._lock:
+            adapters = list(self._adapters.values())
+            self._adapters = {}
+        for adapter in adapters:
+            adapter.close()
+
+class UpstreamBusy(Exception):
+    """上游并发已满且等待队列已满或等待超时"""
+    
+    def __init__(self, endpoint_class, retry_after):
+        super().__init__(f'上游服务繁忙({endpoint_class})，请稍后重试')
+        self.endpoint_class = endpoint_class
+        self.retry_after = retry_after
+
+class AdmissionTicket:
+    """准入凭证，release可重复调用"""
+    
+    def __init__(self, gate):
+        self._gate = gate
+        self._released = False
+        self._lock = threading.Lock()
+    
+    def release(self):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        self._gate.release()
+
+class AdmissionGate:
+    """单个调用类别的并发闸门：固定并发上限 + 有界等待队列"""
+    
+    def __init__(self, name, concurrency, queue_size, max_wait):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.max_wait = max_wait
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+        self._cond = threading.Condition()
+        self._async_waiters = []  # 协程等待者的唤醒回调
+    
+    def _admit(self):
+        """调用方需持有self._cond"""
+        self.active += 1
+        self.admitted += 1
+        return AdmissionTicket(self)
+    
+    def _record_wait(self, start):
+        """调用方需持有self._cond"""
+        waited = time.monotonic() - start
+        self.wait_time_total += waited
+        self.wait_time_max = max(self.wait_time_max, waited)
+    
+    def acquire(self):
+        with self._cond:
+            if self.active < self.concurrency:
+                return self._admit()
+            
+            if self.waiting >= self.queue_size:
+                self.rejected += 1
+                raise UpstreamBusy(self.name, AdmissionConfig.RETRY_AFTER)
+            
+            self.waiting += 1
+            start = time.monotonic()
+            try:
+                admitted = self._cond.wait_for(lambda: self.active < self.concurrency, timeout=self.max_wait)
+            finally:
+                self.waiting -= 1
+            self._record_wait(start)
+            
+            if not admitted:
+                self.timeouts += 1
+                raise UpstreamBusy(self.name, AdmissionConfig.RETRY_AFTER)
+            return self._admit()
+    
+    async def acquire_async(self):
+        """acquire的协程版本（ASGI模式使用）
+        
+        与线程共用并发名额、等待队列和统计；排队时在事件循环中等待，不占用线程。
+        """
+        loop = asyncio.get_running_loop()
+        wakeup = asyncio.Event()
+        notify = functools.partial(loop.call_soon_threadsafe, wakeup.set)
+        with self._cond:
+            if self.active < self.concurrency:
+                return self._admit()
+            
+            if self.waiting >= self.queue_size:
+                self.rejected += 1
+                raise UpstreamBusy(self.name, AdmissionConfig.RETRY_AFTER)
+            
+            self.waiting += 1
+            self._async_waiters.append(notify)
+        
+        start = time.monotonic()
+        deadline = start + self.max_wait
+        ticket = None
+        try:
+            while True:
+                with self._cond:
+                    if self.active < self.concurrency:
+                        ticket = self._admit()
+                        break
+                    # 在锁内清除，release在之后调用的唤醒不会丢失
+                    wakeup.clear()
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    await asyncio.wait_for(wakeup.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            with self._cond:
+                self.waiting -= 1
+                self._async_waiters.remove(notify)
+                self._record_wait(start)
+        
+        if ticket is None:
+            with self._cond:
+                self.timeouts += 1
+            raise UpstreamBusy(self.name, AdmissionConfig.RETRY_AFTER)
+        return ticket
+    
+    def release(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify()
+            for notify in self._async_waiters:
+                notify()
+    
+    def stats(self):
+        with self._cond:
+            return {
+                'concurrency': self.concurrency,
+                'queue_size': self.queue_size,
+                'active': self.active,
+                'waiting': self.waiting,
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'timeouts': self.timeouts,
+                'wait_time_total': round(self.wait_time_total, 4),
+                'wait_time_max': round(self.wait_time_max, 4),
+                'wait_time_avg': round(self.wait_time_total / self.admitted, 4) if self.admitted else 0.0
+            }
+
+class AdmissionController:
+    """上游请求准入控制
+    
+    按调用类别（chat、completion、history、dataset、upload）分别限制同时发往Dify的请求数，
+    超出部分在有界队列中等待，队列已满或等待超时立即抛出UpstreamBusy（路由返回503）。
+    """
+    
+    def __init__(self, limits=None, queue_sizes=None, max_wait=None):
+        limits = limits or AdmissionConfig.CONCURRENCY_LIMITS
+        queue_sizes = queue_sizes or AdmissionConfig.QUEUE_SIZES
+        max_wait = AdmissionConfig.MAX_WAIT if max_wait is None else max_wait
+        self.gates = {
+            name: AdmissionGate(name, limit, queue_sizes.get(name, 0), max_wait)
+            for name, limit in limits.items()
+        }
+    
+    def acquire(self, endpoint_class):
+        """获取准入凭证，使用完毕后必须调用ticket.release()"""
+        return self.gates[endpoint_class].acquire()
+    
+    async def acquire_async(self, endpoint_class):
+        """在事件循环中获取准入凭证，使用完毕后必须调用ticket.release()"""
+        return await self.gates[endpoint_class].acquire_async()
+    
+    @contextmanager
+    def admit(self, endpoint_class):
+        ticket = self.acquire(endpoint_class)
+        try:
+            yield ticket
+        finally:
+            ticket.release()
+    
+    def stats(self):
+        return {name: gate.stats() for name, gate in self.gates.items()}
+
+def release_on_close(response, ticket):
+    """流式响应关闭时释放凭证（准入凭证或上游节点租约）"""
+    close = response.close
+    
+    def close_and_release():
+        try:
+            close()
+        finally:
+            ticket.release()
+    
+    response.close = close_and_release
+    return response
+
+def mask_secret(value):
+    """隐藏密钥，仅保留前缀"""
+    if not value:
+        return ''
+    return f"{value[:8]}***"
+
+class TTLCache:
+    """线程安全的LRU+TTL缓存"""
+    
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            value, expires_at = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+    
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+    
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._data.pop(key, None)
+        return default if item is None else item[0]
+    
+    def invalidate(self, predicate):
+        """删除所有键满足predicate的条目，返回删除数量"""
+        with self._lock:
+            keys = [key for key in self._data if predicate(key)]
+            for key in keys:
+                del self._data[key]
+        return len(keys)
+    
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+    
+    def stats(self):
+        with self._lock:
+            size = len(self._data)
+        lookups = self.hits + self.misses
+        return {
+            'size': size,
+            'max_entries': self.max_entries,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+class SingleFlightCall:
+    __slots__ = ('done', 'result', 'error')
+    
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """相同的并发请求只执行一次，其余调用者等待并共享其结果（或异常）
+    
+    只合并同时在途的调用，不缓存结果；写操作之后调用forget，使之后的读取不再加入写操作之前发出的请求。
+    """
+    
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._stats = {}
+    
+    def do(self, key, fn, label=None):
+        """以key合并对fn()的并发调用，label用于按类别统计"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = SingleFlightCall()
+            counts = self._stats.setdefault(label, [0, 0])
+            counts[0 if leader else 1] += 1
+        metrics.UPSTREAM_COALESCED.inc(endpoint=label, role='leader' if leader else 'follower')
+        
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+            call.done.set()
+    
+    def forget(self, predicate):
+        """之后相同key的调用重新执行，不再加入当前在途的调用"""
+        with self._lock:
+            for key in [key for key in self._calls if predicate(key)]:
+                del self._calls[key]
+    
+    def stats(self):
+        """各类别的 leaders / followers / 合并比例（follower占全部调用的比例）"""
+        with self._lock:
+            stats = {label: tuple(counts) for label, counts in self._stats.items()}
+            in_flight = len(self._calls)
+        return {
+            'in_flight': in_flight,
+            'endpoints': {label: {
+                'leaders': leaders,
+                'followers': followers,
+                'ratio': round(followers / (leaders + followers), 4) if leaders + followers else 0.0
+            } for label, (leaders, followers) in stats.items()}
+        }
+
+class UpstreamNode:
+    """一个Dify上游节点及其负载、健康状态"""
+    
+    def __init__(self, url, weight=1):
+        self.url = url.rstrip('/')
+        self.weight = max(float(weight), 0.01)
+        self.healthy = True
+        self.outstanding = 0
+        self.failures = 0  # 连续失败次数
+        self.successes = 0  # 摘除后连续成功次数
+        self.requests = 0
+        self.ejections = 0
+    
+    def rebase(self, url):
+        """把按DifyAPIConfig.BASE_URL构建的地址改写到本节点"""
+        base = DifyAPIConfig.BASE_URL.rstrip('/')
+        if url.startswith(base):
+            return self.url + url[len(base):]
+        return url
+
+class UpstreamLease:
+    """一次上游请求占用的节点，release可重复调用"""
+    
+    def __init__(self, pool, node):
+        self.pool = pool
+        self.node = node
+        self._released = False
+        self._lock = threading.Lock()
+    
+    def release(self, ok=True):
+        """请求结束，ok为False表示请求异常或上游返回5xx"""
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        self.pool.release(self.node, ok)
+
+class UpstreamPool:
+    """多个Dify节点的负载均衡
+    
+    按 (在途请求数+1)/权重 选择最空闲的健康节点，分数相同时轮流选择。
+    请求异常或返回5xx连续FAIL_THRESHOLD次后摘除节点；后台线程定期检查所有节点，
+    被摘除的节点连续RISE_THRESHOLD次成功后重新加入。所有节点都被摘除时仍在全部节点中选择。
+    bind() 把会话ID、任务ID绑定到节点，带affinity的请求优先发往绑定且健康的节点。
+    只有一个节点时不做健康检查和绑定。
+    """
+    
+    def __init__(self, nodes=None):
+        if nodes is None:
+            nodes = UpstreamConfig.NODES or [{'url': DifyAPIConfig.BASE_URL}]
+        self.nodes = [UpstreamNode(node['url'], node.get('weight', 1)) for node in nodes]
+        self.affinity = TTLCache(UpstreamConfig.AFFINITY_MAX_ENTRIES, UpstreamConfig.AFFINITY_TTL)
+        self.checks = 0
+        self._cursor = itertools.count()
+        self._lock = threading.Lock()
+        self._thread = None
+    
+    @property
+    def balanced(self):
+        return len(self.nodes) > 1
+    
+    def _ensure_thread(self):
+        if self._thread is None and self.balanced:
+            self._thread = threading.Thread(target=self._run, name='upstream-health', daemon=True)
+            self._thread.start()
+    
+    def acquire(self, affinity=None):
+        """选择节点并计入在途请求，返回UpstreamLease"""
+        node = self.affinity.get(affinity) if affinity and self.balanced else None
+        with self._lock:
+            self._ensure_thread()
+            if node is None or not node.healthy:
+                candidates = [candidate for candidate in self.nodes if candidate.healthy] or self.nodes
+                offset = next(self._cursor)
+                rotated = candidates[offset % len(candidates):] + candidates[:offset % len(candidates)]
+                node = min(rotated, key=lambda candidate: (candidate.outstanding + 1) / candidate.weight)
+            node.outstanding += 1
+            node.requests += 1
+        return UpstreamLease(self, node)
+    
+    def release(self, node, ok=True):
+        with self._lock:
+            node.outstanding -= 1
+            self._record(node, ok)
+    
+    def bind(self, key, node):
+        """把会话ID或任务ID绑定到节点"""
+        if key and self.balanced:
+            self.affinity.set(key, node)
+    
+    def _record(self, node, ok):
+        if ok:
+            node.failures = 0
+            if not node.healthy:
+                node.successes += 1
+                if node.successes >= UpstreamConfig.RISE_THRESHOLD:
+                    node.healthy = True
+                    node.successes = 0
+                    logger.info('上游节点恢复', extra={'fields': {'node': node.url}})
+            return
+        
+        node.failures += 1
+        node.successes = 0
+        if node.healthy and self.balanced and node.failures >= UpstreamConfig.FAIL_THRESHOLD:
+            node.healthy = False
+            node.ejections += 1
+            logger.warning('上游节点已摘除', extra={'fields': {'node': node.url, 'failures': node.failures}})
+    
+    def check(self, node):
+        """主动健康检查一个节点"""
+        try:
+            response = requests.get(node.url + UpstreamConfig.HEALTH_PATH, headers=DifyAPIConfig.get_chat_headers(),
+                                    timeout=UpstreamConfig.HEALTH_TIMEOUT)
+            ok = response.status_code < 500
+            response.close()
+        except requests.RequestException:
+            ok = False
+        with self._lock:
+            self.checks += 1
+            self._record(node, ok)
+        return ok
+    
+    def _run(self):
+        while True:
+            for node in self.nodes:
+                self.check(node)
+            time.sleep(UpstreamConfig.HEALTH_INTERVAL)
+    
+    def stats(self):
+        with self._lock:
+            nodes = [{
+                'url': node.url,
+                'weight': node.weight,
+                'healthy': node.healthy,
+                'outstanding': node.outstanding,
+                'requests': node.requests,
+                'ejections': node.ejections
+            } for node in self.nodes]
+        return {'nodes': nodes, 'checks': self.checks, 'affinity_entries': self.affinity.stats()['size']}
+
+class StreamAffinity:
+    """把流中出现的会话ID、任务ID绑定到产生该流的节点，使后续消息和停止请求发往同一节点"""
+    
+    def __init__(self, pool, node):
+        self.pool = pool
+        self.node = node if pool.balanced else None
+        self._bound = set()
+    
+    def observe(self, relay):
+        if self.node is None:
+            return
+        for key in (getattr(relay, 'task_id', None), getattr(relay, 'conversation_id', None)):
+            if key and key not in self._bound:
+                self._bound.add(key)
+                self.pool.bind(key, self.node)
+
+class UploadTooLarge(Exception):
+    """上传文件超过大小限制"""
+
+def guess_mime_type(filename):
+    """根据文件名推断MIME类型"""
+    mime_type, _ = mimetypes.guess_type(filename)
+    if mime_type:
+        return mime_type
+    
+    # 根据文件扩展名设置默认MIME类型
+    file_ext = filename.lower().split('.')[-1]
+    mime_map = {
+        'png': 'image/png',
+        'jpg': 'image/jpeg',
+        'jpeg': 'image/jpeg',
+        'gif': 'image/gif',
+        'webp': 'image/webp',
+        'svg': 'image/svg+xml',
+        'pdf': 'application/pdf',
+        'txt': 'text/plain',
+        'md': 'text/markdown',
+        'docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+        'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        'csv': 'text/csv',
+        'html': 'text/html',
+        'xml': 'application/xml'
+    }
+    return mime_map.get(file_ext, 'application/octet-stream')
+
+def iter_file_chunks(f, chunk_size=None):
+    """按块读取文件对象"""
+    chunk_size = chunk_size or AppConfig.UPLOAD_CHUNK_SIZE
+    return iter(lambda: f.read(chunk_size), b'')
+
+class MultipartStreamBody:
+    """流式multipart请求体
+    
+    文件数据按块产出，直接写入上游连接；已知文件大小时提供Content-Length，
+    否则由requests以chunked方式发送。
+    """
+    
+    def __init__(self, fields, file_field, filename, mime_type, chunks, file_size=None):
+        self.boundary = uuid.uuid4().hex
+        self.content_type = f'multipart/form-data; boundary={self.boundary}'
+        
+        head = ''
+        for name, value in fields.items():
+            head += f'--{self.boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'
+        head += (f'--{self.boundary}\r\nContent-Disposition: form-data; name="{file_field}"; filename="{filename}"\r\n'
+                 f'Content-Type: {mime_type}\r\n\r\n')
+        self._head = head.encode('utf-8')
+        self._tail = f'\r\n--{self.boundary}--\r\n'.encode('utf-8')
+        self._chunks = chunks
+        self._file_size = file_size
+    
+    def __iter__(self):
+        yield self._head
+        for chunk in self._chunks:
+            if chunk:
+                metrics.UPLOAD_BYTES.inc(len(chunk), direction='upstream')
+                yield chunk
+        yield self._tail
+    
+    def __len__(self):
+        # requests据此决定Content-Length，返回0时使用chunked传输
+        if self._file_size is None:
+            return 0
+        return len(self._head) + self._file_size + len(self._tail)
+    
+    def __bool__(self):
+        return True
+
+class UploadPart:
+    """multipart请求中的文件分段，数据只能按顺序读取一次"""
+    
+    def __init__(self, name, filename, content_type, chunks):
+        self.name = name
+        self.filename = filename
+        self.content_type = content_type
+        self._chunks = chunks
+    
+    def __iter__(self):
+        return self._chunks
+    
+    def drain(self):
+        """丢弃未读取的剩余数据，以便继续解析后续分段"""
+        for _ in self._chunks:
+            pass
+
+class MultipartStreamReader:
+    """流式解析multipart请求
+    
+    基于werkzeug的sansio解码器按顺序产出普通字段和文件分段，
+    文件数据在被读取时才从请求流中拉取，不落盘也不整体缓存在内存中，
+    读取过程中超过max_file_size会抛出UploadTooLarge。
+    """
+    
+    def __init__(self, stream, boundary, max_file_size=None, chunk_size=None):
+        self.stream = stream
+        self.decoder = MultipartDecoder(boundary.encode('latin-1'))
+        self.max_file_size = max_file_size or AppConfig.MAX_CONTENT_LENGTH
+        self.chunk_size = chunk_size or AppConfig.UPLOAD_CHUNK_SIZE
+    
+    @classmethod
+    def from_request(cls, req):
+        """从Flask请求创建解析器，非multipart请求返回None"""
+        boundary = req.mimetype_params.get('boundary')
+        if req.mimetype != 'multipart/form-data' or not boundary:
+            return None
+        return cls(req.stream, boundary)
+    
+    def _events(self):
+        while True:
+            chunk = self.stream.read(self.chunk_size)
+            self.decoder.receive_data(chunk or None)
+            event = self.decoder.next_event()
+            while not isinstance(event, (Epilogue, NeedData)):
+                yield event
+                event = self.decoder.next_event()
+            if isinstance(event, Epilogue) or not chunk:
+                return
+    
+    @staticmethod
+    def _iter_data(events):
+        for event in events:
+            if not isinstance(event, Data):
+                raise ValueError('multipart数据格式错误')
+            yield event.data
+            if not event.more_data:
+                return
+    
+    def _iter_file(self, events):
+        size = 0
+        for data in self._iter_data(events):
+            size += len(data)
+            if size > self.max_file_size:
+                metrics.ERRORS.inc(type='UploadTooLarge')
+                raise UploadTooLarge(f'文件大小超过{self.max_file_size}字节')
+            metrics.UPLOAD_BYTES.inc(len(data), direction='received')
+            yield data
+    
+    def parts(self):
+        """依次产出 (字段名, 值)，普通字段的值为str，文件分段的值为UploadPart"""
+        events = self._events()
+        for event in events:
+            if isinstance(event, Field):
+                value = b''.join(self._iter_data(events)).decode('utf-8', 'replace')
+                yield event.name, value
+            elif isinstance(event, File):
+                part = UploadPart(event.name, event.filename, event.headers.get('Content-Type'), self._iter_file(events))
+                yield event.name, part
+                part.drain()
+
 class DifyAPIClient:
     """Dify API客户端类"""
     
-    def __init__(self):
+    def __init__(self, session_pool=None, admission=None, upstreams=None):
         self.base_url = DifyAPIConfig.BASE_URL
         self.timeout = DifyAPIConfig.TIMEOUT
         self.chat_headers = DifyAPIConfig.get_chat_headers()
         self.dataset_headers = DifyAPIConfig.get_dataset_headers()
+        self.session_pool = session_pool or UpstreamSessionPool()
+        self.upload_cache = TTLCache(CacheConfig.UPLOAD_CACHE_MAX_ENTRIES, CacheConfig.UPLOAD_CACHE_TTL)
+        self.admission = admission or AdmissionController()
+        self.upstreams = upstreams or UpstreamPool()
+        self.single_flight = SingleFlight()
     
-    def chat_message(self, query, conversation_id="", user_id=None, files=None, inputs=None, stream=True):
-        """发送聊天消息"""
-        url = DifyAPIConfig.get_full_url('chat_messages')
+    def _http(self, api_type='chat'):
+        """获取对应API密钥的复用Session"""
+        api_key = DifyAPIConfig.CHAT_API_KEY if api_type == 'chat' else DifyAPIConfig.DATASET_API_KEY
+        return self.session_pool.get_session(api_key)
+    
+    # 上游端点对应的准入类别，未列出的端点归入dataset
+    ENDPOINT_CLASSES = {
+        'chat_messages': 'chat',
+        'completion_messages': 'completion',
+        'conversations': 'history',
+        'messages': 'history',
+        'files_upload': 'upload',
+        'dataset_create_by_file': 'upload',
+        'dataset_update_by_file': 'upload',
+    }
+    
+    def _send(self, endpoint_key, api_type, method, url, affinity=None, **kwargs):
+        """发送请求并记录上游指标
+        
+        按affinity（会话ID、任务ID）或负载选择上游节点；流式响应在关闭时才结束节点的在途计数，
+        响应的upstream属性为处理该请求的节点。
+        """
+        lease = self.upstreams.acquire(affinity)
+        url = lease.node.rebase(url)
+        start = time.perf_counter()
+        try:
+            response = self._http(api_type).request(method, url, **kwargs)
+        except Exception as e:
+            lease.release(ok=False)
+            metrics.UPSTREAM_REQUESTS.inc(endpoint=endpoint_key, status='error')
+            metrics.ERRORS.inc(type=type(e).__name__)
+            logger.warning('上游请求异常', extra={'fields': {'endpoint': endpoint_key, 'method': method, 'url': url, 'error': repr(e)}})
+            raise
+        finally:
+            metrics.UPSTREAM_LATENCY.observe(time.perf_counter() - start, endpoint=endpoint_key)
+        metrics.UPSTREAM_REQUESTS.inc(endpoint=endpoint_key, status=response.status_code)
+        
+        response.upstream = lease.node
+        if kwargs.get('stream'):
+            if response.status_code < 500:
+                return release_on_close(response, lease)
+            # 流式响应的内容未读取，关闭后连接才能回到连接池
+            response.close()
+        lease.release(ok=response.status_code < 500)
+        return response
+    
+    def _request(self, endpoint_key, api_type, method, url, **kwargs):
+        """经过准入控制发送非流式请求"""
+        with self.admission.admit(self.ENDPOINT_CLASSES.get(endpoint_key, 'dataset')):
+            return self._send(endpoint_key, api_type, method, url, **kwargs)
+    
+    def _get(self, endpoint_key, api_type, url, headers, params=None, affinity=None):
+        """经过准入控制的GET请求
+        
+        端点、地址、参数与API密钥都相同的并发请求共享同一次上游请求，只有实际发出的请求占用准入名额；
+        共享的是已读取完内容的响应，各调用者的json()互不影响。
+        """
+        key = (endpoint_key, url, tuple(sorted((params or {}).items())), headers.get('Authorization'))
+        return self.single_flight.do(key, lambda: self._request(endpoint_key, api_type, 'GET', url, affinity=affinity, headers=headers,
+                                                                 params=params, timeout=self.timeout), endpoint_key)
+    
+    def forget_reads(self, endpoint_key, predicate=None):
+        """写操作之后，使该端点之后的读取不再合并到写之前发出的请求"""
+        self.single_flight.forget(lambda key: key[0] == endpoint_key and (predicate is None or predicate(key)))
+    
+    def forget_dataset_reads(self, dataset_id):
+        """知识库或其文档变更之后，使知识库列表（含文档数）与该知识库文档列表的读取重新发出"""
+        self.forget_reads('datasets')
+        self.forget_reads('dataset_documents', lambda key: f'/datasets/{dataset_id}/' in key[1])
+    
+    def _stream(self, endpoint_key, url, data, affinity=None):
+        """经过准入控制发送流式请求，准入凭证在响应关闭时释放"""
+        ticket = self.admission.acquire(self.ENDPOINT_CLASSES.get(endpoint_key, 'dataset'))
+        response = None
+        try:
+            response = self._send(endpoint_key, 'chat', 'POST', url, affinity=affinity, headers=self.chat_headers, json=data, stream=True, timeout=self.timeout)
+            response.raise_for_status()
+        except Exception:
+            if response is not None:
+                # 关闭错误响应，释放上游节点租约并归还连接
+                response.close()
+            ticket.release()
+            raise
+        return release_on_close(response, ticket)
+    
+    def pool_stats(self):
+        """获取连接池统计"""
+        return self.session_pool.stats()
+    
+    @staticmethod
+    def build_chat_payload(query, conversation_id="", user_id=None, files=None, inputs=None, stream=True):
+        """构建聊天消息请求体"""
         user_id = user_id or DefaultSettings.DEFAULT_USER_ID
         response_mode = DefaultSettings.DEFAULT_RESPONSE_MODE if stream else "blocking"
         
@@ -53,98 +921,146 @@ class DifyAPIClient:
             data["files"] = files
         elif files and isinstance(files, dict):
             data["files"] = [files]
+        return data
+    
+    def chat_message(self, query, conversation_id="", user_id=None, files=None, inputs=None, stream=True):
+        """发送聊天消息"""
+        url = DifyAPIConfig.get_full_url('chat_messages')
+        data = self.build_chat_payload(query, conversation_id, user_id, files, inputs, stream)
             
         try:
-            response = requests.post(url, headers=self.chat_headers, json=data, stream=stream, timeout=self.timeout)
+            if stream:
+                return self._stream('chat_messages', url, data, affinity=conversation_id or None)
+            response = self._request('chat_messages', 'chat', 'POST', url, affinity=conversation_id or None, headers=self.chat_headers, json=data, timeout=self.timeout)
             response.raise_for_status()
             return response
+        except UpstreamBusy:
+            raise
         except Exception as e:
             return None
     
     def upload_file(self, file_path, user_id=None):
         """上传文件"""
+        with open(file_path, 'rb') as f:
+            return self.upload_file_stream(os.path.basename(file_path), iter_file_chunks(f), user_id,
+                                           file_size=os.path.getsize(file_path))
+    
+    def upload_file_stream(self, filename, chunks, user_id=None, mime_type=None, file_size=None):
+        """以流的方式上传文件，数据边读边发，不经过本地磁盘
+        
+        不超过UPLOAD_CACHE_MAX_BUFFER的文件会先在内存中计算内容哈希，
+        同一API密钥、同一用户重复上传相同内容时直接返回缓存的上传结果。
+        """
+        user_id = user_id or DefaultSettings.DEFAULT_USER_ID
+        if not CacheConfig.UPLOAD_CACHE_ENABLED:
+            return self._post_file_stream(filename, chunks, user_id, mime_type, file_size)
+        
+        chunks = iter(chunks)
+        buffered = []
+        buffered_size = 0
+        for chunk in chunks:
+            buffered.append(chunk)
+            buffered_size += len(chunk)
+            if buffered_size > CacheConfig.UPLOAD_CACHE_MAX_BUFFER:
+                # 大文件不去重，已读取的部分与剩余数据拼接后继续流式上传
+                return self._post_file_stream(filename, itertools.chain(buffered, chunks), user_id, mime_type, file_size)
+        
+        digest = hashlib.sha256()
+        for chunk in buffered:
+            digest.update(chunk)
+        cache_key = (DifyAPIConfig.CHAT_API_KEY, user_id, digest.hexdigest())
+        
+        cached = self.upload_cache.get(cache_key)
+        if cached is not None:
+            return dict(cached)
+        
+        result = self._post_file_stream(filename, buffered, user_id, mime_type, buffered_size)
+        if result and result.get('id'):
+            self.upload_cache.set(cache_key, dict(result))
+        return result
+    
+    def _post_file_stream(self, filename, chunks, user_id, mime_type=None, file_size=None):
         url = DifyAPIConfig.get_full_url('files_upload')
         headers = DifyAPIConfig.get_file_upload_headers('chat')
-        user_id = user_id or DefaultSettings.DEFAULT_USER_ID
+        
+        body = MultipartStreamBody({'user': user_id}, 'file', filename, mime_type or guess_mime_type(filename), chunks, file_size)
+        headers['Content-Type'] = body.content_type
         
         try:
-            # 获取文件的MIME类型
-            import mimetypes
-            mime_type, _ = mimetypes.guess_type(file_path)
-            if not mime_type:
-                # 根据文件扩展名设置默认MIME类型
-                file_ext = file_path.lower().split('.')[-1]
-                mime_map = {
-                    'png': 'image/png',
-                    'jpg': 'image/jpeg',
-                    'jpeg': 'image/jpeg',
-                    'gif': 'image/gif',
-                    'webp': 'image/webp',
-                    'svg': 'image/svg+xml',
-                    'pdf': 'application/pdf',
-                    'txt': 'text/plain',
-                    'md': 'text/markdown',
-                    'docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
-                    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-                    'csv': 'text/csv',
-                    'html': 'text/html',
-                    'xml': 'application/xml'
-                }
-                mime_type = mime_map.get(file_ext, 'application/octet-stream')
-            
-            with open(file_path, 'rb') as f:
-                files = {'file': (os.path.basename(file_path), f, mime_type)}
-                data = {'user': user_id}
-                response = requests.post(url, headers=headers, files=files, data=data, timeout=self.timeout)
-                response.raise_for_status()
-                return response.json()
+            response = self._request('files_upload', 'chat', 'POST', url, headers=headers, data=body, timeout=self.timeout)
+            response.raise_for_status()
+            return response.json()
+        except (UploadTooLarge, UpstreamBusy):
+            raise
         except Exception as e:
             return None
     
-    def completion_message(self, inputs, user_id=None, stream=True):
-        """发送文本生成请求"""
-        url = DifyAPIConfig.get_full_url('completion_messages')
+    @staticmethod
+    def build_completion_payload(inputs, user_id=None, stream=True):
+        """构建文本生成请求体"""
         user_id = user_id or DefaultSettings.DEFAULT_USER_ID
         response_mode = DefaultSettings.DEFAULT_RESPONSE_MODE if stream else "blocking"
         
-        data = {
+        return {
             "inputs": inputs,
             "response_mode": response_mode,
             "user": user_id
         }
+    
+    def completion_message(self, inputs, user_id=None, stream=True):
+        """发送文本生成请求"""
+        url = DifyAPIConfig.get_full_url('completion_messages')
+        data = self.build_completion_payload(inputs, user_id, stream)
         
         try:
-            response = requests.post(url, headers=self.chat_headers, json=data, stream=stream, timeout=self.timeout)
+            if stream:
+                return self._stream('completion_messages', url, data)
+            response = self._request('completion_messages', 'chat', 'POST', url, headers=self.chat_headers, json=data, timeout=self.timeout)
             response.raise_for_status()
             return response
+        except UpstreamBusy:
+            raise
         except Exception as e:
             return None
     
-    def get_conversations(self, user_id=None, limit=None):
-        """获取会话列表"""
+    def fetch_conversations(self, user_id=None, limit=None):
+        """获取会话列表，请求失败时抛出异常"""
         url = DifyAPIConfig.get_full_url('conversations')
         user_id = user_id or DefaultSettings.DEFAULT_USER_ID
         limit = limit or DefaultSettings.DEFAULT_CONVERSATION_LIMIT
         params = {"user": user_id, "limit": limit}
         
+        response = self._get('conversations', 'chat', url, self.chat_headers, params)
+        response.raise_for_status()
+        return response.json()
+    
+    def get_conversations(self, user_id=None, limit=None):
+        """获取会话列表"""
         try:
-            response = requests.get(url, headers=self.chat_headers, params=params, timeout=self.timeout)
-            response.raise_for_status()
-            return response.json()
+            return self.fetch_conversations(user_id, limit)
         except Exception as e:
             return {"data": [], "has_more": False}
     
-    def get_messages(self, conversation_id, user_id=None, limit=None):
-        """获取消息历史"""
+    def fetch_messages(self, conversation_id, user_id=None, limit=None, first_id=None):
+        """获取消息历史，请求失败时抛出异常
+        
+        first_id为当前页最早一条消息的ID，传入时返回比它更早的limit条消息。
+        """
         url = DifyAPIConfig.get_full_url('messages')
         user_id = user_id or DefaultSettings.DEFAULT_USER_ID
         limit = limit or DefaultSettings.DEFAULT_MESSAGE_LIMIT
         params = {"user": user_id, "conversation_id": conversation_id, "limit": limit}
+        if first_id:
+            params["first_id"] = first_id
         
+        response = self._get('messages', 'chat', url, self.chat_headers, params, affinity=conversation_id)
+        response.raise_for_status()
+        return response.json()
+    
+    def get_messages(self, conversation_id, user_id=None, limit=None, first_id=None):
+        """获取消息历史"""
         try:
-            response = requests.get(url, headers=self.chat_headers, params=params, timeout=self.timeout)
-            response.raise_for_status()
-            return response.json()
+            return self.fetch_messages(conversation_id, user_id, limit, first_id)
         except Exception as e:
             return {"data": [], "has_more": False}
     
@@ -157,9 +1073,11 @@ class DifyAPIClient:
         params = {"page": page, "limit": limit}
         
         try:
-            response = requests.get(url, headers=self.dataset_headers, params=params, timeout=self.timeout)
+            response = self._get('datasets', 'dataset', url, self.dataset_headers, params)
             response.raise_for_status()
             return response.json()
+        except UpstreamBusy:
+            raise
         except Exception as e:
             return {"data": [], "has_more": False}
     
@@ -174,29 +1092,31 @@ class DifyAPIClient:
         }
         
         try:
-            print(f"创建知识库请求: {url}")
-            print(f"请求数据: {data}")
-            print(f"请求头: {self.dataset_headers}")
+            logger.debug('创建知识库请求', extra={'fields': {'url': url, 'data': data, 'headers': self.dataset_headers}})
             
-            response = requests.post(url, headers=self.dataset_headers, json=data, timeout=10)
-            print(f"响应状态码: {response.status_code}")
-            print(f"响应内容: {response.text}")
+            response = self._request('datasets', 'dataset', 'POST', url, headers=self.dataset_headers, json=data, timeout=10)
+            self.forget_reads('datasets')
+            if logger.isEnabledFor(logging.DEBUG):
+                # response.text会完整解码响应体，未开启DEBUG时不在请求线程中做这部分工作
+                logger.debug('创建知识库响应', extra={'fields': {'status': response.status_code, 'body': response.text}})
             
             if response.status_code == 200 or response.status_code == 201:
                 return response.json()
             else:
-                print(f"API错误: {response.status_code} - {response.text}")
+                logger.error('创建知识库失败', extra={'fields': {'status': response.status_code, 'body': response.text}})
                 return {"error": f"API错误: {response.status_code} - {response.text}"}
                 
+        except UpstreamBusy:
+            raise
         except requests.exceptions.RequestException as e:
-            print(f"请求异常: {e}")
+            logger.error('创建知识库请求异常', extra={'fields': {'url': url, 'error': repr(e)}})
             return {"error": f"请求失败: {str(e)}"}
         except Exception as e:
-            print(f"其他异常: {e}")
+            logger.exception('创建知识库异常')
             return {"error": f"未知错误: {str(e)}"}
     
-    def create_document_by_text(self, dataset_id, name, text, indexing_technique=None):
-        """通过文本创建文档"""
+    def submit_document_by_text(self, dataset_id, name, text, indexing_technique=None):
+        """通过文本创建文档，请求失败时抛出异常"""
         url = DifyAPIConfig.get_full_url('dataset_create_by_text', dataset_id=dataset_id)
         indexing_technique = indexing_technique or DefaultSettings.DEFAULT_INDEXING_TECHNIQUE
         
@@ -207,143 +1127,2265 @@ class DifyAPIClient:
             "process_rule": {"mode": DefaultSettings.DEFAULT_PROCESS_RULE_MODE}
         }
         
+        logger.debug('创建文档请求', extra={'fields': {'url': url, 'data': data, 'headers': self.dataset_headers}})
+        
+        response = self._request('dataset_create_by_text', 'dataset', 'POST', url, headers=self.dataset_headers, json=data, timeout=self.timeout)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('创建文档响应', extra={'fields': {'status': response.status_code, 'body': response.text}})
+        
+        response.raise_for_status()
+        return response.json()
+    
+    def create_document_by_text(self, dataset_id, name, text, indexing_technique=None):
+        """通过文本创建文档"""
         try:
-            print(f"创建文档请求: {url}")
-            print(f"请求数据: {data}")
-            print(f"请求头: {self.dataset_headers}")
-            
-            response = requests.post(url, headers=self.dataset_headers, json=data, timeout=self.timeout)
-            print(f"响应状态码: {response.status_code}")
-            print(f"响应内容: {response.text}")
-            
-            response.raise_for_status()
-            return response.json()
+            return self.submit_document_by_text(dataset_id, name, text, indexing_technique)
+        except UpstreamBusy:
+            raise
         except Exception as e:
-            print(f"创建文档异常: {e}")
+            logger.error('创建文档失败', extra={'fields': {'dataset_id': dataset_id, 'name': name, 'error': repr(e)}})
             return None
     
     def create_document_by_file(self, dataset_id, file_path, name=None, indexing_technique=None):
         """通过文件创建文档"""
-        url = DifyAPIConfig.get_full_url('dataset_create_by_file', dataset_id=dataset_id)
+        with open(file_path, 'rb') as f:
+            return self.create_document_by_stream(dataset_id, os.path.basename(file_path), iter_file_chunks(f), name,
+                                                  indexing_technique, file_size=os.path.getsize(file_path))
+    
+    def _submit_document_stream(self, endpoint_key, url, filename, chunks, data, file_size=None):
+        """以multipart流的方式提交文档文件，请求失败时抛出异常"""
         headers = DifyAPIConfig.get_file_upload_headers('dataset')
-        indexing_technique = indexing_technique or DefaultSettings.DEFAULT_INDEXING_TECHNIQUE
+        body = MultipartStreamBody({'data': json.dumps(data)}, 'file', filename, guess_mime_type(filename), chunks, file_size)
+        headers['Content-Type'] = body.content_type
+        
+        response = self._request(endpoint_key, 'dataset', 'POST', url, headers=headers, data=body, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+    
+    def submit_document_by_stream(self, dataset_id, filename, chunks, name=None, indexing_technique=None, file_size=None):
+        """以流的方式上传文件创建文档，数据边读边发，不经过本地磁盘；请求失败时抛出异常"""
+        url = DifyAPIConfig.get_full_url('dataset_create_by_file', dataset_id=dataset_id)
+        data = {
+            "name": name or filename,
+            "indexing_technique": indexing_technique or DefaultSettings.DEFAULT_INDEXING_TECHNIQUE,
+            "process_rule": {"mode": DefaultSettings.DEFAULT_PROCESS_RULE_MODE}
+        }
+        return self._submit_document_stream('dataset_create_by_file', url, filename, chunks, data, file_size)
+    
+    def submit_document_update_by_stream(self, dataset_id, document_id, filename, chunks, name=None, file_size=None):
+        """以流的方式上传文件更新已有文档（只重新嵌入该文档）；请求失败时抛出异常"""
+        url = DifyAPIConfig.get_full_url('dataset_update_by_file', dataset_id=dataset_id, document_id=document_id)
+        data = {
+            "name": name or filename,
+            "process_rule": {"mode": DefaultSettings.DEFAULT_PROCESS_RULE_MODE}
+        }
+        return self._submit_document_stream('dataset_update_by_file', url, filename, chunks, data, file_size)
+    
+    def create_document_by_stream(self, dataset_id, filename, chunks, name=None, indexing_technique=None, file_size=None):
+        """以流的方式上传文件创建文档，数据边读边发，不经过本地磁盘"""
+        try:
+            return self.submit_document_by_stream(dataset_id, filename, chunks, name, indexing_technique, file_size)
+        except (UploadTooLarge, UpstreamBusy):
+            raise
+        except Exception as e:
+            return None
+    
+    def delete_dataset(self, dataset_id):
+        """删除知识库"""
+        url = DifyAPIConfig.get_full_url('dataset_detail', dataset_id=dataset_id)
         
         try:
-            with open(file_path, 'rb') as f:
-                files = {'file': f}
-                data = {
-                    'data': json.dumps({
-                        "name": name or os.path.basename(file_path),
-                        "indexing_technique": indexing_technique,
-                        "process_rule": {"mode": DefaultSettings.DEFAULT_PROCESS_RULE_MODE}
-                    })
-                }
-                response = requests.post(url, headers=headers, files=files, data=data, timeout=self.timeout)
-                response.raise_for_status()
-                return response.json()
+            response = self._request('dataset_detail', 'dataset', 'DELETE', url, headers=self.dataset_headers, timeout=self.timeout)
+            self.forget_reads('datasets')
+            response.raise_for_status()
+            return response.status_code == 204
+        except UpstreamBusy:
+            raise
+        except Exception as e:
+            return False
+    
+    def submit_document_delete(self, dataset_id, document_id):
+        """删除文档，请求失败时抛出异常"""
+        url = DifyAPIConfig.get_full_url('dataset_document_detail', dataset_id=dataset_id, document_id=document_id)
+        
+        response = self._request('dataset_document_detail', 'dataset', 'DELETE', url, headers=self.dataset_headers, timeout=self.timeout)
+        response.raise_for_status()
+        # 新版Dify删除成功时返回204且没有响应体
+        return response.json() if response.content else {'result': 'success'}
+    
+    def delete_document(self, dataset_id, document_id):
+        """删除文档"""
+        try:
+            return self.submit_document_delete(dataset_id, document_id)
+        except UpstreamBusy:
+            raise
         except Exception as e:
             return None
     
-    def delete_dataset(self, dataset_id):
-        """删除知识库"""
-        url = DifyAPIConfig.get_full_url('dataset_detail', dataset_id=dataset_id)
-        
-        try:
-            response = requests.delete(url, headers=self.dataset_headers, timeout=self.timeout)
-            response.raise_for_status()
-            return response.status_code == 204
-        except Exception as e:
-            return False
+    def fetch_documents(self, dataset_id, page=None, limit=None):
+        """获取知识库文档列表，请求失败时抛出异常"""
+        url = DifyAPIConfig.get_full_url('dataset_documents', dataset_id=dataset_id)
+        page = page or DefaultSettings.DEFAULT_PAGE
+        limit = limit or DefaultSettings.DEFAULT_PAGE_SIZE
+        params = {"page": page, "limit": limit}
+        
+        response = self._get('dataset_documents', 'dataset', url, self.dataset_headers, params)
+        response.raise_for_status()
+        return response.json()
+    
+    def get_documents(self, dataset_id, page=None, limit=None):
+        """获取知识库文档列表"""
+        try:
+            return self.fetch_documents(dataset_id, page, limit)
+        except UpstreamBusy:
+            raise
+        except Exception as e:
+            return {"data": [], "has_more": False}
+    
+    def fetch_indexing_status(self, dataset_id, batch_id):
+        """获取文档嵌入状态，请求失败时抛出异常"""
+        url = DifyAPIConfig.get_full_url('dataset_indexing_status', dataset_id=dataset_id, batch_id=batch_id)
+        
+        response = self._request('dataset_indexing_status', 'dataset', 'GET', url, headers=self.dataset_headers, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+    
+    def get_document_indexing_status(self, dataset_id, batch_id):
+        """获取文档嵌入状态"""
+        try:
+            return self.fetch_indexing_status(dataset_id, batch_id)
+        except UpstreamBusy:
+            raise
+        except Exception as e:
+            return {"data": []}
+    
+    def fetch_segments(self, dataset_id, document_id, page=None, limit=None):
+        """获取文档的分段列表，请求失败时抛出异常"""
+        url = DifyAPIConfig.get_full_url('dataset_segments', dataset_id=dataset_id, document_id=document_id)
+        params = {"page": page or DefaultSettings.DEFAULT_PAGE, "limit": limit or DefaultSettings.DEFAULT_PAGE_SIZE}
+        
+        response = self._request('dataset_segments', 'dataset', 'GET', url, headers=self.dataset_headers, params=params, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+    
+    def fetch_retrieval(self, dataset_id, query, top_k=None, score_threshold=None, search_method='keyword_search'):
+        """检索知识库，请求失败时抛出异常"""
+        url = DifyAPIConfig.get_full_url('dataset_retrieve', dataset_id=dataset_id)
+        top_k = top_k or DefaultSettings.DEFAULT_TOP_K
+        score_threshold = score_threshold or DefaultSettings.DEFAULT_SCORE_THRESHOLD
+        
+        data = {
+            "query": query,
+            "retrieval_model": {
+                "search_method": search_method,
+                "reranking_enable": False,
+                "reranking_mode": None,
+                "reranking_model": {
+                    "reranking_provider_name": "",
+                    "reranking_model_name": ""
+                },
+                "weights": None,
+                "top_k": top_k,
+                "score_threshold_enabled": score_threshold > 0,
+                "score_threshold": score_threshold if score_threshold > 0 else None
+            }
+        }
+        
+        response = self._request('dataset_retrieve', 'dataset', 'POST', url, headers=self.dataset_headers, json=data, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+    
+    def retrieve_dataset(self, dataset_id, query, top_k=None, score_threshold=None, search_method='keyword_search'):
+        """检索知识库"""
+        try:
+            return self.fetch_retrieval(dataset_id, query, top_k, score_threshold, search_method)
+        except UpstreamBusy:
+            raise
+        except Exception as e:
+            return {"records": []}
+
+    def stop_chat_message(self, task_id, user_id=None):
+        """停止聊天消息生成"""
+        url = DifyAPIConfig.get_full_url('chat_messages_stop', task_id=task_id)
+        user_id = user_id or DefaultSettings.DEFAULT_USER_ID
+        
+        data = {
+            "user": user_id
+        }
+        
+        try:
+            # 停止请求用于释放上游资源，不经过准入控制
+            response = self._send('chat_messages_stop', 'chat', 'POST', url, affinity=task_id, headers=self.chat_headers, json=data, timeout=self.timeout)
+            response.raise_for_status()
+            return response.json()
+        except Exception as e:
+            return {"error": str(e)}
+
+class CachedJSON:
+    """缓存的JSON结果：保存数据、序列化后的响应体及ETag，命中时无需重新序列化"""
+    
+    __slots__ = ('data', 'body', 'etag')
+    
+    def __init__(self, data):
+        self.data = data
+        self.body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.etag = hashlib.sha1(self.body).hexdigest()
+
+class HistoryCache:
+    """会话列表与消息历史缓存
+    
+    按API密钥和用户隔离，容量与有效期受限；上游请求失败的结果不缓存。
+    聊天流收到message_end时调用invalidate_conversation使对应条目失效。
+    """
+    
+    def __init__(self, client, max_entries=None, ttl=None):
+        self.client = client
+        self.cache = TTLCache(max_entries or CacheConfig.HISTORY_CACHE_MAX_ENTRIES, ttl or CacheConfig.HISTORY_CACHE_TTL)
+    
+    def conversations(self, user_id=None, limit=None):
+        """获取会话列表（CachedJSON）"""
+        user_id = user_id or DefaultSettings.DEFAULT_USER_ID
+        limit = limit or DefaultSettings.DEFAULT_CONVERSATION_LIMIT
+        key = ('conversations', DifyAPIConfig.CHAT_API_KEY, user_id, limit)
+        return self._load(key, lambda: self.client.fetch_conversations(user_id, limit), {"data": [], "has_more": False})
+    
+    def messages(self, conversation_id, user_id=None, limit=None, first_id=None):
+        """获取消息历史（CachedJSON），first_id为分页游标"""
+        user_id = user_id or DefaultSettings.DEFAULT_USER_ID
+        limit = limit or DefaultSettings.DEFAULT_MESSAGE_LIMIT
+        key = ('messages', DifyAPIConfig.CHAT_API_KEY, user_id, limit, first_id, conversation_id)
+        return self._load(key, lambda: self.client.fetch_messages(conversation_id, user_id, limit, first_id),
+                          {"data": [], "has_more": False})
+    
+    def messages_since(self, conversation_id, since_id, user_id=None, limit=None):
+        """增量获取比since_id更新的消息（CachedJSON），按时间先后排序
+        
+        从最新一页开始向前翻页查找since_id，最多翻DEFAULT_HISTORY_DELTA_MAX_PAGES页；
+        找不到时返回最新一页并标记since_found为False，客户端应整体重新加载。
+        """
+        limit = limit or DefaultSettings.DEFAULT_MESSAGE_LIMIT
+        collected = []
+        first_id = None
+        latest_page = None
+        
+        for _ in range(DefaultSettings.DEFAULT_HISTORY_DELTA_MAX_PAGES):
+            page = self.messages(conversation_id, user_id, limit, first_id).data
+            items = page.get('data', [])
+            if latest_page is None:
+                latest_page = page
+            collected.extend(items)
+            
+            if any(item.get('id') == since_id for item in items):
+                ordered = sorted(collected, key=lambda item: item.get('created_at', 0))
+                position = next(i for i, item in enumerate(ordered) if item.get('id') == since_id)
+                return CachedJSON({
+                    'data': ordered[position + 1:],
+                    'has_more': False,
+                    'limit': limit,
+                    'since': since_id,
+                    'since_found': True
+                })
+            
+            if not items or not page.get('has_more'):
+                break
+            first_id = min(items, key=lambda item: item.get('created_at', 0)).get('id')
+        
+        latest_page = latest_page or {}
+        return CachedJSON({
+            'data': latest_page.get('data', []),
+            'has_more': latest_page.get('has_more', False),
+            'limit': limit,
+            'since': since_id,
+            'since_found': False
+        })
+    
+    def _load(self, key, fetch, fallback):
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        try:
+            cached = CachedJSON(fetch())
+        except UpstreamBusy:
+            raise
+        except Exception as e:
+            return CachedJSON(fallback)
+        self.cache.set(key, cached)
+        return cached
+    
+    def invalidate_conversation(self, conversation_id, user_id=None):
+        """会话产生新消息后，使该用户的会话列表及该会话的消息历史失效"""
+        user_id = user_id or DefaultSettings.DEFAULT_USER_ID
+        self.client.forget_reads('conversations')
+        self.client.forget_reads('messages', lambda key: ('conversation_id', conversation_id) in key[2])
+        return self.cache.invalidate(
+            lambda key: key[2] == user_id and (key[0] == 'conversations' or key[-1] == conversation_id)
+        )
+    
+    def stats(self):
+        return self.cache.stats()
+
+class RetrievalCache:
+    """知识库检索结果缓存
+    
+    键为规范化后的查询与检索参数，按API密钥和知识库隔离；上游请求失败的结果不缓存。
+    每个知识库有一个版本号，invalidate_dataset只需递增版本号，
+    失效前已发出、失效后才返回的请求会写入旧版本的键，不会被再次读取。
+    """
+    
+    def __init__(self, client, max_entries=None, ttl=None):
+        self.client = client
+        self.cache = TTLCache(max_entries or CacheConfig.RETRIEVAL_CACHE_MAX_ENTRIES, ttl or CacheConfig.RETRIEVAL_CACHE_TTL)
+        self._versions = {}
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def normalize(query, top_k=None, score_threshold=None):
+        """规范化查询与参数（默认值处理与DifyAPIClient.fetch_retrieval一致）"""
+        query = ' '.join(query.split())
+        top_k = int(top_k or DefaultSettings.DEFAULT_TOP_K)
+        score_threshold = round(float(score_threshold or DefaultSettings.DEFAULT_SCORE_THRESHOLD), 4)
+        return query, top_k, score_threshold
+    
+    def fetch(self, dataset_id, query, top_k=None, score_threshold=None, search_method='keyword_search'):
+        """检索知识库，相同知识库与参数的结果在有效期内直接返回；请求失败时抛出异常"""
+        query, top_k, score_threshold = self.normalize(query, top_k, score_threshold)
+        with self._lock:
+            version = self._versions.get(dataset_id, 0)
+        key = ('retrieve', DifyAPIConfig.DATASET_API_KEY, dataset_id, version, query, top_k, score_threshold, search_method)
+        
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        result = self.client.fetch_retrieval(dataset_id, query, top_k, score_threshold, search_method)
+        self.cache.set(key, result)
+        return result
+    
+    def retrieve(self, dataset_id, query, top_k=None, score_threshold=None, search_method='keyword_search'):
+        """检索知识库"""
+        try:
+            return self.fetch(dataset_id, query, top_k, score_threshold, search_method)
+        except UpstreamBusy:
+            raise
+        except Exception as e:
+            return {"records": []}
+    
+    def invalidate_dataset(self, dataset_id):
+        """知识库内容变化后使其检索结果失效"""
+        with self._lock:
+            self._versions[dataset_id] = self._versions.get(dataset_id, 0) + 1
+        return self.cache.invalidate(lambda key: key[2] == dataset_id)
+    
+    def stats(self):
+        return self.cache.stats()
+
+class SegmentMirror:
+    """知识库分段的本地镜像，用于在进程内完成关键词检索
+    
+    首次检索某个知识库时在后台拉取所有已完成索引的文档分段并构建BM25索引，建好之前返回None由调用方回退到Dify；
+    之后随本应用的文档增删增量更新（新文档在Dify索引完成后才拉取分段），超过MAX_AGE后在后台全量重建。
+    构建期间收到的增量更新会在新索引替换旧索引后重放。
+    """
+    
+    def __init__(self, client, executor=None):
+        self.client = client
+        self.executor = executor or ThreadPoolExecutor(max_workers=KeywordIndexConfig.BUILD_WORKERS, thread_name_prefix='keyword-index')
+        self._indexes = {}
+        self._built_at = {}
+        self._building = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.fallbacks = 0
+        self.builds = 0
+        self.build_errors = 0
+    
+    @property
+    def enabled(self):
+        return KeywordIndexConfig.ENABLED and keyword_index.AVAILABLE
+    
+    def search(self, dataset_id, query, top_k=None, score_threshold=None):
+        """在本地索引中检索，返回与Dify检索接口相同格式的结果；索引不可用时返回None"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            index = self._indexes.get(dataset_id)
+            stale = index is None or time.time() - self._built_at[dataset_id] > KeywordIndexConfig.MAX_AGE
+            if index is None:
+                self.fallbacks += 1
+            else:
+                self.hits += 1
+        if stale:
+            self._schedule_build(dataset_id)
+        if index is None:
+            return None
+        
+        query, top_k, score_threshold = RetrievalCache.normalize(query, top_k, score_threshold)
+        records = [{'segment': segment, 'score': score} for segment, score in index.search(query, top_k, score_threshold)]
+        return {'query': {'content': query}, 'records': records}
+    
+    def _schedule_build(self, dataset_id):
+        with self._lock:
+            if dataset_id in self._building:
+                return
+            self._building[dataset_id] = []
+        try:
+            self.executor.submit(self._build, dataset_id)
+        except RuntimeError:
+            with self._lock:
+                self._building.pop(dataset_id, None)
+    
+    def _iter_documents(self, dataset_id):
+        page = 1
+        while True:
+            result = self.client.fetch_documents(dataset_id, page, KeywordIndexConfig.PAGE_SIZE)
+            yield from result.get('data', [])
+            if not result.get('has_more'):
+                return
+            page += 1
+    
+    def _fetch_segments(self, dataset_id, document_id):
+        segments = []
+        page = 1
+        while True:
+            result = self.client.fetch_segments(dataset_id, document_id, page, KeywordIndexConfig.PAGE_SIZE)
+            segments.extend(segment for segment in result.get('data', []) if segment.get('enabled', True))
+            if not result.get('has_more'):
+                return segments
+            page += 1
+    
+    @staticmethod
+    def _indexable(document):
+        return document.get('indexing_status') == 'completed' and document.get('enabled', True) and not document.get('archived')
+    
+    def _build(self, dataset_id):
+        start = time.perf_counter()
+        index = keyword_index.BM25Index(KeywordIndexConfig.K1, KeywordIndexConfig.B)
+        try:
+            for document in self._iter_documents(dataset_id):
+                if self._indexable(document):
+                    index.add_document(document, self._fetch_segments(dataset_id, document['id']))
+        except Exception as e:
+            with self._lock:
+                self._building.pop(dataset_id, None)
+                self.build_errors += 1
+            logger.warning('关键词索引构建失败', extra={'fields': {'dataset_id': dataset_id, 'error': repr(e)}})
+            return
+        
+        with self._lock:
+            pending = self._building.pop(dataset_id, [])
+            self._indexes[dataset_id] = index
+            self._built_at[dataset_id] = time.time()
+            self.builds += 1
+        for document_id, document in pending:
+            self._apply(dataset_id, index, document_id, document)
+        logger.info('关键词索引已构建', extra={'fields': {
+            'dataset_id': dataset_id, 'elapsed': round(time.perf_counter() - start, 3), **index.stats()
+        }})
+    
+    def _apply(self, dataset_id, index, document_id, document):
+        """把单个文档的变化应用到索引：document为None表示删除，否则重新拉取其分段"""
+        if document is None:
+            index.remove_document(document_id)
+            return
+        try:
+            index.add_document(document, self._fetch_segments(dataset_id, document_id))
+        except Exception as e:
+            logger.warning('关键词索引更新失败', extra={'fields': {'dataset_id': dataset_id, 'document_id': document_id, 'error': repr(e)}})
+    
+    def _update(self, dataset_id, document_id, document):
+        with self._lock:
+            if dataset_id in self._building:
+                self._building[dataset_id].append((document_id, document))
+                return
+            index = self._indexes.get(dataset_id)
+        if index is None:
+            return
+        if document is None:
+            self._apply(dataset_id, index, document_id, None)
+            return
+        try:
+            self.executor.submit(self._apply, dataset_id, index, document_id, document)
+        except RuntimeError:
+            pass
+    
+    def refresh_documents(self, dataset_id, documents):
+        """Dify索引完成后更新文档的分段，documents为索引状态接口返回的文档列表（可附带本应用提交时的name）"""
+        completed = [{'id': document['id'], 'name': document.get('name')} for document in documents or ()
+                     if document.get('indexing_status') == 'completed' and document.get('id')]
+        if any(not document['name'] for document in completed):
+            # 索引状态接口不返回文档名称，缺少名称时整个batch只拉取一次文档列表
+            try:
+                self.executor.submit(self._resolve_names, dataset_id, completed)
+            except RuntimeError:
+                pass
+            return
+        for document in completed:
+            self._update(dataset_id, document['id'], document)
+    
+    def _resolve_names(self, dataset_id, documents):
+        with self._lock:
+            if dataset_id not in self._building and dataset_id not in self._indexes:
+                return
+        missing = {document['id']: document for document in documents if not document['name']}
+        try:
+            for item in self._iter_documents(dataset_id):
+                document = missing.pop(item.get('id'), None)
+                if document is not None:
+                    document['name'] = item.get('name')
+                if not missing:
+                    break
+        except Exception as e:
+            logger.warning('获取文档名称失败', extra={'fields': {'dataset_id': dataset_id, 'error': repr(e)}})
+        for document in documents:
+            self._update(dataset_id, document['id'], document)
+    
+    def remove_document(self, dataset_id, document_id):
+        self._update(dataset_id, document_id, None)
+    
+    def drop(self, dataset_id):
+        """删除知识库后丢弃其索引"""
+        with self._lock:
+            self._indexes.pop(dataset_id, None)
+            self._built_at.pop(dataset_id, None)
+    
+    def stats(self):
+        with self._lock:
+            indexes = dict(self._indexes)
+            result = {
+                'enabled': self.enabled,
+                'hits': self.hits,
+                'fallbacks': self.fallbacks,
+                'builds': self.builds,
+                'build_errors': self.build_errors,
+                'building': len(self._building)
+            }
+        totals = [index.stats() for index in indexes.values()]
+        result.update({
+            'datasets': len(totals),
+            'documents': sum(item['documents'] for item in totals),
+            'segments': sum(item['segments'] for item in totals)
+        })
+        return result
+
+def cached_json_response(cached):
+    """返回缓存的JSON响应，支持If-None-Match条件请求（未变化时返回304）"""
+    response = app.response_class(cached.body, mimetype='application/json')
+    response.set_etag(cached.etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+# 初始化API客户端
+dify_client = DifyAPIClient()
+history_cache = HistoryCache(dify_client)
+retrieval_cache = RetrievalCache(dify_client)
+segment_mirror = SegmentMirror(dify_client)
+
+SEARCH_METHODS = ('keyword_search', 'semantic_search', 'full_text_search', 'hybrid_search')
+retrieval_executor = ThreadPoolExecutor(max_workers=FederatedRetrievalConfig.MAX_WORKERS, thread_name_prefix='retrieve')
+
+def search_dataset(dataset_id, query, top_k=None, score_threshold=None, search_method='keyword_search'):
+    """检索单个知识库：关键词检索优先使用本地索引，否则请求Dify（经检索缓存）；请求失败时抛出异常"""
+    if search_method == 'keyword_search':
+        result = segment_mirror.search(dataset_id, query, top_k, score_threshold)
+        if result is not None:
+            return result
+    return retrieval_cache.fetch(dataset_id, query, top_k, score_threshold, search_method)
+
+def federated_retrieve(dataset_ids, query, top_k=None, score_threshold=None, search_method='keyword_search', budget=None):
+    """并行检索多个知识库，按分数合并为全局top_k
+    
+    各知识库同时开始检索，总耗时不超过预算；预算内未返回的知识库记为timeout，不影响其他结果
+    （其请求在后台继续，完成后写入检索缓存）。本地索引与Dify返回的分数都在0~1之间，直接按分数排序。
+    """
+    start = time.perf_counter()
+    query, top_k, score_threshold = RetrievalCache.normalize(query, top_k, score_threshold)
+    
+    def timed(dataset_id):
+        began = time.perf_counter()
+        result = search_dataset(dataset_id, query, top_k, score_threshold, search_method)
+        return result, time.perf_counter() - began
+    
+    futures = {retrieval_executor.submit(timed, dataset_id): dataset_id for dataset_id in dataset_ids}
+    _, pending = wait(futures, timeout=budget or FederatedRetrievalConfig.BUDGET)
+    
+    records = []
+    datasets = {}
+    for future, dataset_id in futures.items():
+        if future in pending:
+            # 还在排队的直接取消，已开始的在后台完成
+            future.cancel()
+            datasets[dataset_id] = {'status': 'timeout'}
+        else:
+            try:
+                result, elapsed = future.result()
+            except UpstreamBusy as e:
+                datasets[dataset_id] = {'status': 'busy', 'error': str(e)}
+            except Exception as e:
+                logger.warning('联合检索中的知识库检索失败', extra={'fields': {'dataset_id': dataset_id, 'error': repr(e)}})
+                datasets[dataset_id] = {'status': 'error', 'error': '检索失败'}
+            else:
+                hits = result.get('records') or []
+                records.extend(dict(record, dataset_id=dataset_id) for record in hits)
+                datasets[dataset_id] = {'status': 'ok', 'records': len(hits), 'elapsed': round(elapsed, 4)}
+        metrics.FEDERATED_RETRIEVALS.inc(status=datasets[dataset_id]['status'])
+    
+    records.sort(key=lambda record: record.get('score') or 0, reverse=True)
+    elapsed = time.perf_counter() - start
+    metrics.FEDERATED_LATENCY.observe(elapsed)
+    return {
+        'query': {'content': query},
+        'records': records[:top_k],
+        'datasets': datasets,
+        'partial': any(item['status'] != 'ok' for item in datasets.values()),
+        'elapsed': round(elapsed, 4)
+    }
+
+def allowed_file(filename):
+    """检查文件扩展名是否允许"""
+    return '.' in filename and \
+           filename.rsplit('.', 1)[1].lower() in AppConfig.ALLOWED_EXTENSIONS
+
+def sse_frame(data):
+    """将数据编码为一帧SSE消息"""
+    return f"data: {json.dumps(data)}\n\n".encode('utf-8')
+
+def build_document_inputs(task_type, content, language='zh'):
+    """根据文档处理类型构建输入，不支持的类型返回None"""
+    if task_type == 'translate':
+        return {
+            "query": f"请将以下内容翻译成{language}：\n\n{content}"
+        }
+    elif task_type == 'summary':
+        return {
+            "query": f"请总结以下内容的要点：\n\n{content}"
+        }
+    elif task_type == 'rewrite':
+        return {
+            "query": f"请改写以下内容，使其更加清晰易懂：\n\n{content}"
+        }
+    return None
+
+def build_reduce_inputs(partials):
+    """构建总结任务的整合（reduce）输入"""
+    sections = '\n\n'.join(f"第{i}部分：\n{partial}" for i, partial in enumerate(partials, 1))
+    return {
+        "query": f"以下是一篇长文档各部分的要点，请整合为一份完整、连贯的总结：\n\n{sections}"
+    }
+
+# 句子边界：中文标点后直接切分，英文标点后需有空白
+SENTENCE_BOUNDARY = re.compile(r'(?<=[。！？；])|(?<=[.!?;])\s+')
+
+def split_document(content, max_chars=None):
+    """按段落切分长文档，段落过长时再按句子切分，句子仍过长时按长度截断
+    
+    返回 [(分块文本, 与下一块之间的分隔符)]，用于按原文结构拼接各块的处理结果。
+    """
+    max_chars = max_chars or DocumentConfig.CHUNK_SIZE
+    pieces = []
+    for paragraph in re.split(r'\n\s*\n', content.strip()):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if len(paragraph) <= max_chars:
+            pieces.append((paragraph, '\n\n'))
+            continue
+        for sentence in SENTENCE_BOUNDARY.split(paragraph):
+            if not sentence:
+                continue
+            joiner = '' if sentence[-1] in '。！？；' else ' '
+            for start in range(0, len(sentence), max_chars):
+                pieces.append((sentence[start:start + max_chars], '' if start + max_chars < len(sentence) else joiner))
+        pieces[-1] = (pieces[-1][0], '\n\n')
+    
+    chunks = []
+    text, separator = '', ''
+    for piece, piece_separator in pieces:
+        if text and len(text) + len(separator) + len(piece) > max_chars:
+            chunks.append((text, separator))
+            text = ''
+        text = text + separator + piece if text else piece
+        separator = piece_separator
+    if text:
+        chunks.append((text, ''))
+    return chunks
+
+class ChatStreamRelay:
+    """聊天流转发器：把Dify的SSE事件行转换为前端使用的帧
+    
+    on_end(conversation_id) 在下发message_end帧之前调用。
+    """
+    
+    def __init__(self, conversation_id="", on_end=None):
+        self.answer = ""
+        self.conversation_id = conversation_id
+        self.task_id = None
+        self.on_end = on_end
+    
+    def feed(self, line):
+        """处理一行上游数据，返回需要下发的帧，无需下发时返回None"""
+        if not line or not line.startswith(b'data: '):
+            return None
+        try:
+            json_data = json.loads(line[6:])
+        except ValueError:
+            return None
+        
+        # 获取task_id
+        if json_data.get('task_id'):
+            self.task_id = json_data.get('task_id')
+        
+        if json_data.get('event') == 'message':
+            self.answer += json_data.get('answer', '')
+            self.conversation_id = json_data.get('conversation_id', self.conversation_id)
+            
+            # 直接转发Dify的响应格式
+            return sse_frame({
+                'event': 'message',
+                'answer': json_data.get('answer', ''),
+                'conversation_id': self.conversation_id,
+                'task_id': self.task_id
+            })
+        
+        elif json_data.get('event') == 'message_end':
+            if self.on_end:
+                self.on_end(self.conversation_id)
+            # 直接转发Dify的响应格式
+            return sse_frame({
+                'event': 'message_end',
+                'conversation_id': self.conversation_id,
+                'message_id': json_data.get('id', ''),
+                'metadata': json_data.get('metadata', {}),
+                'task_id': self.task_id
+            })
+        return None
+
+class PassthroughChatRelay:
+    """聊天流直通转发器
+    
+    只从原始字节中扫描event、task_id、conversation_id与answer，不做JSON解析：
+    message事件以扫描到的字段直接拼接成帧（answer保持上游的JSON转义原样输出），字段与ChatStreamRelay一致，
+    上游帧中前端用不到的元数据不再下发；仅message_end需要改写字段，才做完整的JSON解析。
+    上游JSON中answer等字符串内的引号均已转义，不会被字段扫描误匹配。
+    """
+    
+    EVENT_PATTERN = re.compile(rb'"event"\s*:\s*"([^"]*)"')
+    TASK_ID_PATTERN = re.compile(rb'"task_id"\s*:\s*"([^"]*)"')
+    CONVERSATION_ID_PATTERN = re.compile(rb'"conversation_id"\s*:\s*"([^"]*)"')
+    ANSWER_PATTERN = re.compile(rb'"answer"\s*:\s*"((?:[^"\\]|\\.)*)"')
+    
+    def __init__(self, conversation_id="", on_end=None):
+        self.conversation_id = conversation_id
+        self.task_id = None
+        self.on_end = on_end
+        self._ids = None  # message帧中answer之后的固定部分，ID变化时重新生成
+    
+    def _message_frame(self, answer):
+        if self._ids is None:
+            self._ids = json.dumps({
+                'conversation_id': self.conversation_id,
+                'task_id': self.task_id
+            })[1:].encode('utf-8')
+        return b'data: {"event": "message", "answer": "' + answer + b'", ' + self._ids + b'\n\n'
+    
+    def feed(self, line):
+        """处理一行上游数据，返回需要下发的帧，无需下发时返回None"""
+        if not line or not line.startswith(b'data: '):
+            return None
+        
+        event = self.EVENT_PATTERN.search(line)
+        if event is None:
+            return None
+        event = event.group(1)
+        
+        if event == b'message':
+            if self.task_id is None:
+                task_id = self.TASK_ID_PATTERN.search(line)
+                if task_id:
+                    self.task_id = task_id.group(1).decode('ascii')
+                    self._ids = None
+            conversation_id = self.CONVERSATION_ID_PATTERN.search(line)
+            if conversation_id and conversation_id.group(1):
+                conversation_id = conversation_id.group(1).decode('ascii')
+                if conversation_id != self.conversation_id:
+                    self.conversation_id = conversation_id
+                    self._ids = None
+            answer = self.ANSWER_PATTERN.search(line)
+            return self._message_frame(answer.group(1) if answer else b'')
+        
+        elif event == b'message_end':
+            try:
+                json_data = json.loads(line[6:])
+            except ValueError:
+                return None
+            if json_data.get('task_id'):
+                self.task_id = json_data.get('task_id')
+            if self.on_end:
+                self.on_end(self.conversation_id)
+            return sse_frame({
+                'event': 'message_end',
+                'conversation_id': self.conversation_id,
+                'message_id': json_data.get('id', ''),
+                'metadata': json_data.get('metadata', {}),
+                'task_id': self.task_id
+            })
+        return None
+
+def create_chat_relay(conversation_id="", on_end=None):
+    """根据配置创建聊天流转发器"""
+    if StreamConfig.CHAT_PASSTHROUGH:
+        return PassthroughChatRelay(conversation_id, on_end)
+    return ChatStreamRelay(conversation_id, on_end)
+
+class DocumentStreamRelay:
+    """文档处理流转发器：把文本生成的SSE事件行转换为前端使用的帧
+    
+    on_end(answer) 在正常结束（收到message_end）时以完整结果调用。
+    """
+    
+    def __init__(self, on_end=None):
+        self.answer = ""
+        self.on_end = on_end
+    
+    def feed(self, line):
+        """处理一行上游数据，返回需要下发的帧，无需下发时返回None"""
+        if not line or not line.startswith(b'data: '):
+            return None
+        try:
+            json_data = json.loads(line[6:])
+        except ValueError:
+            return None
+        
+        if 'answer' in json_data:
+            self.answer += json_data.get('answer', '')
+            return sse_frame({
+                'type': 'message',
+                'content': json_data.get('answer', ''),
+                'full_content': self.answer
+            })
+        
+        elif json_data.get('event') == 'message_end':
+            if self.on_end:
+                self.on_end(self.answer)
+            return sse_frame({'type': 'end'})
+        
+        elif json_data.get('event') == 'error':
+            return sse_frame({'error': json_data.get('message') or '处理失败'})
+        return None
+
+class DeltaDocumentStreamRelay:
+    """文档处理流转发器（协议v2）：只下发增量内容，定期附带检查点
+    
+    帧格式:
+        {"type": "start", "protocol": 2, "stream_id": ..., "checkpoint_interval": N}
+        {"type": "delta", "seq": n, "content": 新增文本}
+        {"type": "checkpoint", "seq": n, "bytes": 累计UTF-8字节数, "checksum": 累计内容的CRC32}
+        {"type": "end", "seq": n, "bytes": ..., "checksum": ...}
+    前端校验失败时可通过 /api/document/process/<stream_id> 取回完整内容重新同步。
+    on_end(answer) 在正常结束（收到message_end）时以完整结果调用。
+    """
+    
+    PROTOCOL = 2
+    
+    def __init__(self, checkpoint_interval=None, on_end=None):
+        self.stream_id = uuid.uuid4().hex
+        self.on_end = on_end
+        self.checkpoint_interval = checkpoint_interval or StreamConfig.DOCUMENT_CHECKPOINT_INTERVAL
+        self.seq = 0
+        self.bytes = 0
+        self.checksum = 0
+        self.finished = False
+        self._parts = []
+        self._started = False
+        self._lock = threading.Lock()
+    
+    def _checkpoint(self, frame_type):
+        return sse_frame({
+            'type': frame_type,
+            'seq': self.seq,
+            'bytes': self.bytes,
+            'checksum': f'{self.checksum:08x}'
+        })
+    
+    def feed(self, line):
+        """处理一行上游数据，返回需要下发的帧，无需下发时返回None"""
+        if not line or not line.startswith(b'data: '):
+            return None
+        try:
+            json_data = json.loads(line[6:])
+        except ValueError:
+            return None
+        
+        frames = b''
+        if not self._started:
+            self._started = True
+            frames += sse_frame({
+                'type': 'start',
+                'protocol': self.PROTOCOL,
+                'stream_id': self.stream_id,
+                'checkpoint_interval': self.checkpoint_interval
+            })
+        
+        if json_data.get('answer'):
+            delta = json_data['answer']
+            encoded = delta.encode('utf-8')
+            with self._lock:
+                self._parts.append(delta)
+                self.seq += 1
+                self.bytes += len(encoded)
+                self.checksum = zlib.crc32(encoded, self.checksum)
+            frames += sse_frame({'type': 'delta', 'seq': self.seq, 'content': delta})
+            if self.seq % self.checkpoint_interval == 0:
+                frames += self._checkpoint('checkpoint')
+        
+        elif json_data.get('event') == 'message_end':
+            self.finished = True
+            if self.on_end:
+                with self._lock:
+                    answer = ''.join(self._parts)
+                self.on_end(answer)
+            frames += self._checkpoint('end')
+        
+        elif json_data.get('event') == 'error':
+            frames += sse_frame({'error': json_data.get('message') or '处理失败'})
+        return frames or None
+    
+    def snapshot(self):
+        """当前累计的完整内容及对应的检查点"""
+        with self._lock:
+            return {
+                'stream_id': self.stream_id,
+                'seq': self.seq,
+                'bytes': self.bytes,
+                'checksum': f'{self.checksum:08x}',
+                'finished': self.finished,
+                'content': ''.join(self._parts)
+            }
+
+document_streams = TTLCache(StreamConfig.DOCUMENT_SNAPSHOT_MAX_ENTRIES, StreamConfig.DOCUMENT_SNAPSHOT_TTL)
+document_executor = ThreadPoolExecutor(max_workers=DocumentConfig.MAX_WORKERS, thread_name_prefix='document-chunk')
+
+def create_document_relay(protocol=None, on_end=None):
+    """按协议版本创建文档处理流转发器，协议v2的转发器会登记以供重新同步"""
+    try:
+        protocol = int(protocol or StreamConfig.DOCUMENT_PROTOCOL)
+    except (TypeError, ValueError):
+        protocol = StreamConfig.DOCUMENT_PROTOCOL
+    if protocol == 1:
+        return DocumentStreamRelay(on_end=on_end)
+    relay = DeltaDocumentStreamRelay(on_end=on_end)
+    document_streams.set(relay.stream_id, relay)
+    return relay
+
+class DocumentChunkError(Exception):
+    """分块处理失败"""
+
+def completion_line(data):
+    """编码为一行与Dify格式一致的上游数据"""
+    return b'data: ' + json.dumps(data, ensure_ascii=False).encode('utf-8')
+
+class ChunkedDocumentJob:
+    """长文档分块流水线（map-reduce）
+    
+    文档按段落、句子边界切分后，各块以有限并发同时发往文本生成接口，结果按原文顺序输出：
+    第一块边生成边输出，后续块先缓冲，前面的块全部完成后立即输出。
+    总结任务先并发生成各块要点（过长时逐级合并），再用一次整合请求流式输出最终总结。
+    对外提供与上游响应相同的iter_lines()/close()，可直接交给stream_upstream和各转发器。
+    """
+    
+    def __init__(self, client, task_type, content, language='zh', executor=None, concurrency=None):
+        self.client = client
+        self.task_type = task_type
+        self.language = language
+        self.chunks = split_document(content)
+        self.executor = executor or document_executor
+        self.concurrency = concurrency or DocumentConfig.CHUNK_CONCURRENCY
+        self.closed = False
+        self._responses = set()
+        self._lock = threading.Lock()
+    
+    def _generate(self, inputs, output):
+        """工作线程：发送一次流式文本生成请求，把增量文本放入output队列"""
+        response = None
+        try:
+            if self.closed:
+                return
+            response = self.client.completion_message(inputs, stream=True)
+            if response is None:
+                output.put(('error', '文本生成请求失败'))
+                return
+            with self._lock:
+                self._responses.add(response)
+            ended = False
+            for line in response.iter_lines():
+                if self.closed:
+                    break
+                if not line.startswith(b'data: '):
+                    continue
+                try:
+                    data = json.loads(line[6:])
+                except ValueError:
+                    continue
+                if data.get('answer'):
+                    output.put(('text', data['answer']))
+                elif data.get('event') == 'message_end':
+                    ended = True
+                elif data.get('event') == 'error':
+                    output.put(('error', data.get('message') or '文本生成失败'))
+                    return
+            if not ended and not self.closed:
+                # 连接中断或上游流被截断，分块结果不完整，不能当作完整结果合并与缓存
+                output.put(('error', '文本生成未正常结束'))
+        except UpstreamBusy:
+            output.put(('error', '服务繁忙，请稍后重试'))
+        except Exception as e:
+            if not self.closed:
+                output.put(('error', f'分块处理失败: {e}'))
+        finally:
+            if response is not None:
+                with self._lock:
+                    self._responses.discard(response)
+                response.close()
+            output.put(('done', None))
+    
+    def _map(self, inputs_list):
+        """以有限并发调度各块请求，返回与输入顺序一致的输出队列"""
+        outputs = [queue.Queue() for _ in inputs_list]
+        pending = iter(range(len(inputs_list)))
+        pending_lock = threading.Lock()
+        
+        def submit_next(_future=None):
+            with pending_lock:
+                index = next(pending, None)
+            if index is None or self.closed:
+                return
+            future = self.executor.submit(self._generate, inputs_list[index], outputs[index])
+            future.add_done_callback(submit_next)
+        
+        for _ in range(min(self.concurrency, len(inputs_list))):
+            submit_next()
+        return outputs
+    
+    @staticmethod
+    def _drain(output):
+        """依次取出一个分块的增量文本，分块失败时抛出DocumentChunkError"""
+        while True:
+            kind, value = output.get()
+            if kind == 'done':
+                return
+            if kind == 'error':
+                raise DocumentChunkError(value)
+            yield value
+    
+    def _summary(self):
+        partials = [text for text, _ in self.chunks]
+        for _ in range(DocumentConfig.REDUCE_MAX_ROUNDS):
+            outputs = self._map([build_document_inputs('summary', text, self.language) for text in partials])
+            partials = [''.join(self._drain(output)) for output in outputs]
+            if sum(len(partial) for partial in partials) <= DocumentConfig.CHUNK_SIZE:
+                break
+            partials = [text for text, _ in split_document('\n\n'.join(partials))]
+        yield from self._drain(self._map([build_reduce_inputs(partials)])[0])
+    
+    def _ordered(self):
+        outputs = self._map([build_document_inputs(self.task_type, text, self.language) for text, _ in self.chunks])
+        for (_, separator), output in zip(self.chunks, outputs):
+            yield from self._drain(output)
+            if separator:
+                yield separator
+    
+    def iter_lines(self):
+        pieces = self._summary() if self.task_type == 'summary' else self._ordered()
+        try:
+            for piece in pieces:
+                yield completion_line({'event': 'message', 'answer': piece})
+        except DocumentChunkError as e:
+            yield completion_line({'event': 'error', 'message': str(e)})
+            return
+        yield completion_line({'event': 'message_end'})
+    
+    def close(self):
+        """客户端断开时停止调度剩余分块并关闭进行中的上游连接"""
+        self.closed = True
+        with self._lock:
+            responses = list(self._responses)
+        for response in responses:
+            response.close()
+
+class CompletionResultCache:
+    """文档处理结果的持久化缓存（SQLite）
+    
+    键为 (任务类型, 目标语言, 内容哈希, 应用密钥) 的摘要，只保存正常结束的完整结果。
+    总大小超过上限时按最近访问时间淘汰；同一台机器上的多个工作进程共享同一个数据库文件。
+    """
+    
+    def __init__(self, path=None, max_bytes=None, ttl=None, enabled=None):
+        self.path = path or CacheConfig.RESULT_CACHE_PATH
+        self.max_bytes = max_bytes or CacheConfig.RESULT_CACHE_MAX_BYTES
+        self.ttl = ttl or CacheConfig.RESULT_CACHE_TTL
+        self._enabled = enabled
+        self._conn = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.bytes_saved = 0
+    
+    @property
+    def enabled(self):
+        """未指定时跟随RESULT_CACHE_ENABLED"""
+        return CacheConfig.RESULT_CACHE_ENABLED if self._enabled is None else self._enabled
+    
+    def _connection(self):
+        # 延迟打开，确保使用的是环境变量覆盖后的路径
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS completion_results ('
+                'key TEXT PRIMARY KEY, answer TEXT NOT NULL, size INTEGER NOT NULL, '
+                'created_at REAL NOT NULL, accessed_at REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_completion_results_accessed ON completion_results (accessed_at)')
+            self._conn = conn
+        return self._conn
+    
+    @staticmethod
+    def make_key(task_type, language, content, api_key=None):
+        """缓存键：不保存原文和密钥本身，只保存摘要"""
+        content_hash = hashlib.sha256(content.encode('utf-8')).hexdigest()
+        api_key = api_key or DifyAPIConfig.CHAT_API_KEY
+        return hashlib.sha256('\0'.join((task_type, language, content_hash, api_key)).encode('utf-8')).hexdigest()
+    
+    def get(self, key):
+        """返回缓存的完整结果，未命中或已过期时返回None"""
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            try:
+                conn = self._connection()
+                row = conn.execute('SELECT answer, size, created_at FROM completion_results WHERE key = ?', (key,)).fetchone()
+                if row is not None and row[2] + self.ttl < now:
+                    conn.execute('DELETE FROM completion_results WHERE key = ?', (key,))
+                    row = None
+                if row is not None:
+                    conn.execute('UPDATE completion_results SET accessed_at = ? WHERE key = ?', (now, key))
+            except sqlite3.Error as e:
+                logger.warning('结果缓存读取失败', extra={'fields': {'path': self.path, 'error': repr(e)}})
+                row = None
+            
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.bytes_saved += row[1]
+            return row[0]
+    
+    def set(self, key, answer):
+        """保存完整结果，并在超过总大小上限时淘汰最久未访问的条目"""
+        if not self.enabled or not answer:
+            return
+        size = len(answer.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            try:
+                conn = self._connection()
+                conn.execute(
+                    'INSERT OR REPLACE INTO completion_results (key, answer, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)',
+                    (key, answer, size, now, now)
+                )
+                self.stores += 1
+                self.evictions += conn.execute('DELETE FROM completion_results WHERE created_at < ?', (now - self.ttl,)).rowcount
+                total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM completion_results').fetchone()[0]
+                if total > self.max_bytes:
+                    evict = []
+                    for old_key, old_size in conn.execute('SELECT key, size FROM completion_results ORDER BY accessed_at'):
+                        if total <= self.max_bytes:
+                            break
+                        evict.append((old_key,))
+                        total -= old_size
+                    conn.executemany('DELETE FROM completion_results WHERE key = ?', evict)
+                    self.evictions += len(evict)
+            except sqlite3.Error as e:
+                logger.warning('结果缓存写入失败', extra={'fields': {'path': self.path, 'error': repr(e)}})
+    
+    def clear(self):
+        with self._lock:
+            self._connection().execute('DELETE FROM completion_results')
+    
+    def stats(self):
+        entries, total = 0, 0
+        with self._lock:
+            if self.enabled:
+                try:
+                    entries, total = self._connection().execute(
+                        'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM completion_results'
+                    ).fetchone()
+                except sqlite3.Error:
+                    pass
+            lookups = self.hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'size': entries,
+                'bytes': total,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'stores': self.stores,
+                'evictions': self.evictions,
+                'bytes_saved': self.bytes_saved,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+class CachedCompletion:
+    """缓存命中时的回放流
+    
+    提供与上游响应相同的iter_lines()/close()（以及ASGI使用的aiter_bytes()/aclose()），
+    经同一个转发器输出，前端收到的帧格式与实时生成完全一致。
+    """
+    
+    def __init__(self, answer, piece_size=None):
+        self.answer = answer
+        self.piece_size = piece_size or CacheConfig.RESULT_CACHE_REPLAY_CHUNK
+    
+    def iter_lines(self):
+        for start in range(0, len(self.answer), self.piece_size):
+            yield completion_line({'event': 'message', 'answer': self.answer[start:start + self.piece_size]})
+        yield completion_line({'event': 'message_end', 'metadata': {'cached': True}})
+    
+    async def aiter_bytes(self):
+        for line in self.iter_lines():
+            yield line + b'\n'
+    
+    def close(self):
+        pass
+    
+    async def aclose(self):
+        pass
+
+result_cache = CompletionResultCache()
+
+class TextExtractor:
+    """把上传的PDF、Office等文件转换为文本
+    
+    解析在进程池中进行（默认每个CPU核一个进程，以spawn方式启动，不继承父进程的线程和锁），
+    请求线程只负责接收文件和转发结果。PDF按页分段同时提交到进程池，按页序逐页返回；其他格式整体解析。
+    结果按文件内容哈希保存在本地SQLite中（extract_id），相同文件不再重复解析，
+    extract_id可以直接作为文档处理和知识库文本导入的输入。
+    """
+    
+    PAGE_SEPARATOR = '\f'
+    
+    def __init__(self, cache=None):
+        self.cache = cache or CompletionResultCache(ExtractionConfig.CACHE_PATH, ExtractionConfig.CACHE_MAX_BYTES,
+                                                    ExtractionConfig.CACHE_TTL, enabled=True)
+        self._pool = None
+        self._lock = threading.Lock()
+    
+    @property
+    def pool(self):
+        # 延迟创建：导入app时不启动子进程，每个工作进程使用自己的进程池
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=ExtractionConfig.MAX_WORKERS,
+                                                 mp_context=multiprocessing.get_context('spawn'))
+            return self._pool
+    
+    def _reset_pool(self, pool):
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+    
+    @staticmethod
+    def extension(filename):
+        return filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
+    
+    @staticmethod
+    def supported(filename):
+        return TextExtractor.extension(filename) in extraction.SUPPORTED_EXTENSIONS
+    
+    @staticmethod
+    def make_id(content_hash, extension):
+        return hashlib.sha256('\0'.join(('extract', content_hash, extension, str(extraction.VERSION))).encode('utf-8')).hexdigest()
+    
+    def spool(self, chunks):
+        """把上传数据写入暂存文件，同时计算内容哈希，返回 (路径, 哈希, 大小)"""
+        digest = hashlib.sha256()
+        size = 0
+        fd, path = tempfile.mkstemp(prefix='extract-', dir=ExtractionConfig.SPOOL_DIR)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    digest.update(chunk)
+                    size += len(chunk)
+        except BaseException:
+            os.unlink(path)
+            raise
+        return path, digest.hexdigest(), size
+    
+    def pages(self, extract_id):
+        """返回缓存的提取结果（逐页），不存在时返回None"""
+        text = self.cache.get(extract_id) if extract_id else None
+        return None if text is None else text.split(self.PAGE_SEPARATOR)
+    
+    def text(self, extract_id):
+        """返回缓存的提取结果全文，不存在时返回None"""
+        pages = self.pages(extract_id)
+        return None if pages is None else '\n\n'.join(page for page in pages if page)
+    
+    def _result(self, future, pool):
+        try:
+            return future.result(timeout=ExtractionConfig.TASK_TIMEOUT)
+        except extraction.ExtractionError:
+            raise
+        except FutureTimeoutError:
+            raise extraction.ExtractionError('文件解析超时')
+        except BrokenProcessPool:
+            self._reset_pool(pool)
+            raise extraction.ExtractionError('解析进程异常退出')
+        except Exception as e:
+            raise extraction.ExtractionError(f'文件解析失败: {e}')
+    
+    def iter_pages(self, path, extension):
+        """按页序逐页返回文本"""
+        pool = self.pool
+        if extension != 'pdf':
+            yield from self._result(pool.submit(extraction.extract_document, path, extension), pool)
+            return
+        
+        count = min(self._result(pool.submit(extraction.pdf_page_count, path), pool), ExtractionConfig.MAX_PAGES)
+        step = ExtractionConfig.PDF_PAGES_PER_TASK
+        futures = [pool.submit(extraction.extract_pdf_pages, path, start, min(start + step, count)) for start in range(0, count, step)]
+        try:
+            for future in futures:
+                yield from self._result(future, pool)
+        finally:
+            # 客户端断开或解析失败时取消尚未开始的分段
+            for future in futures:
+                future.cancel()
+    
+    def run(self, path, extension, extract_id):
+        """逐页返回提取结果，全部完成后写入缓存"""
+        start = time.perf_counter()
+        pages = []
+        for page in self.iter_pages(path, extension):
+            page = page.replace(self.PAGE_SEPARATOR, '\n')
+            pages.append(page)
+            metrics.EXTRACTION_PAGES.inc(extension=extension)
+            yield page
+        metrics.EXTRACTION_DURATION.observe(time.perf_counter() - start, extension=extension)
+        self.cache.set(extract_id, self.PAGE_SEPARATOR.join(pages))
+    
+    def stats(self):
+        return self.cache.stats()
+
+text_extractor = TextExtractor()
+
+def is_retryable_error(error):
+    """超时、连接失败、429/5xx以及本地准入排队失败可以重试，其余错误（如4xx）直接失败"""
+    if isinstance(error, (UpstreamBusy, requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    if isinstance(error, requests.exceptions.HTTPError) and error.response is not None:
+        return error.response.status_code == 429 or error.response.status_code >= 500
+    return False
+
+class IngestDocument:
+    """批量导入任务中的单个文档
+    
+    kind为'file'（暂存文件）、'zip'（压缩包内的文件）或'text'；
+    status依次为 pending -> running -> (retrying -> running)* -> succeeded/failed，无法导入的为skipped。
+    """
+    
+    def __init__(self, index, name, kind, source=None, size=None):
+        self.index = index
+        self.name = name
+        self.kind = kind
+        self.source = source
+        self.size = size
+        self.status = 'pending'
+        self.attempts = 0
+        self.error = None
+        self.document_id = None
+        self.batch = None
+    
+    def to_dict(self):
+        return {
+            'index': self.index,
+            'name': self.name,
+            'size': self.size,
+            'status': self.status,
+            'attempts': self.attempts,
+            'error': self.error,
+            'document_id': self.document_id,
+            'batch': self.batch
+        }
+
+class IngestJob:
+    """知识库批量导入任务
+    
+    文件在接收过程中逐个暂存到磁盘并立即提交到有界线程池，上传与接收同时进行；
+    zip压缩包暂存后按条目展开为多个文档。可重试的错误按指数退避（带抖动）重试，
+    每个文档结束时调用 on_document_done(dataset_id, batch, document={'id', 'name'})，失败时batch与document为None。
+    每个文档结束时调用 on_document_done(dataset_id, batch)，失败时batch为None。
+    """
+    
+    TERMINAL = ('succeeded', 'failed', 'skipped')
+    
+    def __init__(self, client, dataset_id, executor=None, on_document_done=None):
+        self.id = uuid.uuid4().hex
+        self.client = client
+        self.dataset_id = dataset_id
+        self.executor = executor or ingest_executor
+        self.on_document_done = on_document_done
+        self.documents = []
+        self.sealed = False
+        self.created_at = time.time()
+        self.finished_at = None
+        self.spool_dir = tempfile.mkdtemp(prefix='ingest-', dir=IngestConfig.SPOOL_DIR)
+        self._lock = threading.Lock()
+    
+    def _add(self, name, kind, source=None, size=None):
+        with self._lock:
+            document = IngestDocument(len(self.documents), name, kind, source, size)
+            self.documents.append(document)
+            if len(self.documents) > IngestConfig.MAX_DOCUMENTS:
+                document.status = 'skipped'
+                document.error = f'超过单次导入上限（{IngestConfig.MAX_DOCUMENTS}个）'
+        if document.status == 'pending':
+            self._submit(document)
+        return document
+    
+    def skip(self, name, reason):
+        """记录无法导入的文件"""
+        with self._lock:
+            document = IngestDocument(len(self.documents), name, 'file')
+            document.status = 'skipped'
+            document.error = reason
+            self.documents.append(document)
+        return document
+    
+    def _spool(self, chunks):
+        """把上传数据写入暂存文件，返回 (路径, 大小)"""
+        fd, path = tempfile.mkstemp(dir=self.spool_dir)
+        size = 0
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+                size += len(chunk)
+        return path, size
+    
+    def add_file(self, name, chunks):
+        path, size = self._spool(chunks)
+        return self._add(name, 'file', path, size)
+    
+    def add_zip(self, name, chunks):
+        """暂存zip压缩包并按条目添加文档，跳过目录、隐藏文件和不支持的类型"""
+        path, _ = self._spool(chunks)
+        try:
+            with zipfile.ZipFile(path) as archive:
+                members = archive.infolist()
+        except zipfile.BadZipFile:
+            self.skip(name, '压缩包格式错误')
+            return
+        
+        for member in members:
+            entry_name = os.path.basename(member.filename.rstrip('/'))
+            if member.is_dir() or not entry_name or entry_name.startswith('.') or '__MACOSX' in member.filename:
+                continue
+            if not allowed_file(entry_name) or entry_name.lower().endswith('.zip'):
+                self.skip(entry_name, '不支持的文件类型')
+            elif member.file_size > AppConfig.MAX_CONTENT_LENGTH:
+                self.skip(entry_name, '文件过大')
+            else:
+                self._add(entry_name, 'zip', (path, member.filename), member.file_size)
+    
+    def add_text(self, name, text):
+        return self._add(name, 'text', text, len(text.encode('utf-8')))
+    
+    def seal(self):
+        """所有文档已接收完毕"""
+        with self._lock:
+            self.sealed = True
+        self._maybe_finish()
+    
+    def _submit(self, document):
+        try:
+            self.executor.submit(self._run, document)
+        except RuntimeError as e:
+            # 进程退出时线程池已关闭
+            self._finish_document(document, 'failed', str(e))
+    
+    def _upload(self, document):
+        if document.kind == 'text':
+            return self.client.submit_document_by_text(self.dataset_id, document.name, document.source)
+        if document.kind == 'file':
+            with open(document.source, 'rb') as f:
+                return self.client.submit_document_by_stream(self.dataset_id, document.name, iter_file_chunks(f),
+                                                             file_size=document.size)
+        archive_path, member = document.source
+        with zipfile.ZipFile(archive_path) as archive, archive.open(member) as f:
+            return self.client.submit_document_by_stream(self.dataset_id, document.name, iter_file_chunks(f),
+                                                         file_size=document.size)
+    
+    def _run(self, document):
+        with self._lock:
+            document.status = 'running'
+            document.attempts += 1
+        try:
+            result = self._upload(document)
+        except Exception as e:
+            if is_retryable_error(e) and document.attempts < IngestConfig.MAX_ATTEMPTS:
+                delay = min(IngestConfig.BACKOFF_BASE * 2 ** (document.attempts - 1), IngestConfig.BACKOFF_MAX)
+                with self._lock:
+                    document.status = 'retrying'
+                    document.error = str(e)
+                timer = threading.Timer(delay * random.uniform(0.5, 1.5), self._submit, (document,))
+                timer.daemon = True
+                timer.start()
+                return
+            logger.warning('批量导入文档失败', extra={'fields': {
+                'job_id': self.id, 'dataset_id': self.dataset_id, 'name': document.name,
+                'attempts': document.attempts, 'error': repr(e)
+            }})
+            self._finish_document(document, 'failed', str(e))
+            return
+        
+        with self._lock:
+            document.document_id = (result.get('document') or {}).get('id')
+            document.batch = result.get('batch')
+        self._finish_document(document, 'succeeded')
+    
+    def _finish_document(self, document, status, error=None):
+        with self._lock:
+            document.status = status
+            document.error = error
+        if self.on_document_done:
+            created = {'id': document.document_id, 'name': document.name} if document.document_id else None
+            self.on_document_done(self.dataset_id, document.batch, document=created)
+        self._maybe_finish()
+    
+    def _maybe_finish(self):
+        with self._lock:
+            if not self.sealed or self.finished_at is not None:
+                return
+            if any(document.status not in self.TERMINAL for document in self.documents):
+                return
+            self.finished_at = time.time()
+        shutil.rmtree(self.spool_dir, ignore_errors=True)
+    
+    def to_dict(self, include_documents=True):
+        with self._lock:
+            counts = {status: 0 for status in ('pending', 'running', 'retrying', 'succeeded', 'failed', 'skipped')}
+            for document in self.documents:
+                counts[document.status] += 1
+            documents = [document.to_dict() for document in self.documents] if include_documents else None
+            sealed, finished_at = self.sealed, self.finished_at
+        
+        if not sealed:
+            status = 'receiving'
+        elif finished_at is None:
+            status = 'running'
+        elif counts['failed'] == 0:
+            status = 'completed'
+        elif counts['succeeded'] == 0:
+            status = 'failed'
+        else:
+            status = 'partial'
+        
+        result = {
+            'job_id': self.id,
+            'dataset_id': self.dataset_id,
+            'status': status,
+            'total': sum(counts.values()),
+            'counts': counts,
+            'created_at': self.created_at,
+            'finished_at': finished_at
+        }
+        if documents is not None:
+            result['documents'] = documents
+        return result
+
+ingest_executor = ThreadPoolExecutor(max_workers=IngestConfig.MAX_WORKERS, thread_name_prefix='ingest')
+ingest_jobs = TTLCache(IngestConfig.JOB_MAX_ENTRIES, IngestConfig.JOB_TTL)
+
+class TrackedBatch:
+    """跟踪中的一个batch"""
+    
+    def __init__(self, dataset_id, batch_id):
+        self.dataset_id = dataset_id
+        self.batch_id = batch_id
+        self.data = None
+        self.names = {}  # document_id -> 本应用提交的文档名称（索引状态接口不返回名称）
+        self.polled = False
+        self.finished = False
+        self.interval = IndexingConfig.MIN_INTERVAL
+        self.started = time.monotonic()
+        self.updated_at = None
+    
+    def to_dict(self):
+        return {
+            'type': 'status',
+            'dataset_id': self.dataset_id,
+            'batch': self.batch_id,
+            'data': self.data or [],
+            'finished': self.finished,
+            'updated_at': self.updated_at
+        }
+
+class IndexingTracker:
+    """文档索引状态跟踪
+    
+    每个活跃的batch只由后台统一轮询Dify：状态无变化时按BACKOFF逐步拉长轮询间隔，有变化时恢复最短间隔。
+    最新状态供所有查询共享，状态变化按知识库推送给订阅者（每个知识库一个SSE通道），
+    上游轮询次数只与活跃batch数有关，与查看者数量无关。
+    所有文档进入终态后停止轮询，最终状态保留FINISHED_TTL秒；此时调用 on_batch_done(dataset_id, 文档状态列表)，
+    track时传入过的文档名称会附在对应文档上。
+    """
+    
+    TERMINAL = ('completed', 'error', 'paused', 'stopped')
+    
+    def __init__(self, client, on_batch_done=None, executor=None):
+        self.client = client
+        self.on_batch_done = on_batch_done
+        self.executor = executor or ThreadPoolExecutor(max_workers=IndexingConfig.POLL_WORKERS, thread_name_prefix='indexing-poll')
+        self._batches = {}
+        self._subscribers = {}
+        self._schedule = []
+        self._cond = threading.Condition()
+        self._thread = None
+        self.polls = 0
+        self.poll_errors = 0
+        self.events = 0
+        self.dropped_events = 0
+    
+    def _ensure_thread(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='indexing-tracker', daemon=True)
+            self._thread.start()
+    
+    def track(self, dataset_id, batch_id, document=None):
+        """开始跟踪一个batch，已在跟踪时无操作；document为本应用创建的文档 {'id', 'name'}"""
+        key = (dataset_id, batch_id)
+        with self._cond:
+            batch = self._batches.get(key)
+            if batch is None:
+                batch = self._batches[key] = TrackedBatch(dataset_id, batch_id)
+                heapq.heappush(self._schedule, (time.monotonic(), key))
+                self._ensure_thread()
+                self._cond.notify_all()
+            if document and document.get('id') and document.get('name'):
+                batch.names[document['id']] = document['name']
+            return batch
+    
+    def status(self, dataset_id, batch_id, wait=None):
+        """返回batch的最新状态（与Dify接口格式一致），首次查询时最多等待IndexingConfig.STATUS_WAIT秒的第一次轮询结果"""
+        batch = self.track(dataset_id, batch_id)
+        wait = IndexingConfig.STATUS_WAIT if wait is None else min(wait, IndexingConfig.STATUS_WAIT)
+        deadline = time.monotonic() + wait
+        with self._cond:
+            while not batch.polled:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return {'data': batch.data or [], 'finished': batch.finished, 'updated_at': batch.updated_at}
+    
+    def subscribe(self, dataset_id):
+        """订阅知识库的状态变化，返回 (事件队列, 当前各batch状态)"""
+        subscription = queue.Queue(IndexingConfig.SUBSCRIBER_QUEUE_SIZE)
+        with self._cond:
+            self._subscribers.setdefault(dataset_id, set()).add(subscription)
+            batches = [batch.to_dict() for batch in self._batches.values() if batch.dataset_id == dataset_id and batch.polled]
+        return subscription, batches
+    
+    def has_active(self, dataset_id):
+        """知识库是否有尚未结束的batch"""
+        with self._cond:
+            return any(batch.dataset_id == dataset_id and not batch.finished for batch in self._batches.values())
+    
+    def unsubscribe(self, dataset_id, subscription):
+        with self._cond:
+            subscribers = self._subscribers.get(dataset_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[dataset_id]
+    
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._schedule or self._schedule[0][0] > time.monotonic():
+                    self._cond.wait(self._schedule[0][0] - time.monotonic() if self._schedule else None)
+                _, key = heapq.heappop(self._schedule)
+                batch = self._batches.get(key)
+                if batch is None:
+                    continue
+                if batch.finished:
+                    del self._batches[key]
+                    continue
+            self.executor.submit(self._poll, batch)
+    
+    def _poll(self, batch):
+        try:
+            data = self.client.fetch_indexing_status(batch.dataset_id, batch.batch_id).get('data', [])
+        except Exception as e:
+            data = None
+            logger.debug('索引状态轮询失败', extra={'fields': {'dataset_id': batch.dataset_id, 'batch': batch.batch_id, 'error': repr(e)}})
+        
+        with self._cond:
+            self.polls += 1
+            changed = data is not None and data != batch.data
+            if changed:
+                batch.data = data
+                batch.updated_at = time.time()
+                batch.interval = IndexingConfig.MIN_INTERVAL
+            else:
+                self.poll_errors += data is None
+                batch.interval = min(batch.interval * IndexingConfig.BACKOFF, IndexingConfig.MAX_INTERVAL)
+            batch.polled = True
+            
+            done = bool(batch.data) and all(doc.get('indexing_status') in self.TERMINAL for doc in batch.data)
+            if done or time.monotonic() - batch.started > IndexingConfig.MAX_TRACK_TIME:
+                batch.finished = True
+            delay = IndexingConfig.FINISHED_TTL if batch.finished else batch.interval
+            heapq.heappush(self._schedule, (time.monotonic() + delay, (batch.dataset_id, batch.batch_id)))
+            self._cond.notify_all()
+            
+            event = batch.to_dict() if changed or batch.finished else None
+            subscribers = list(self._subscribers.get(batch.dataset_id, ()))
+            if batch.finished:
+                documents = [dict(doc, name=batch.names[doc['id']]) if doc.get('id') in batch.names else doc for doc in batch.data or ()]
+        
+        if event is not None:
+            self._publish(subscribers, event)
+        if batch.finished and self.on_batch_done:
+            self.on_batch_done(batch.dataset_id, documents)
+    
+    def _publish(self, subscribers, event):
+        for subscription in subscribers:
+            try:
+                subscription.put_nowait(event)
+                self.events += 1
+            except queue.Full:
+                self.dropped_events += 1
+    
+    def stats(self):
+        with self._cond:
+            return {
+                'tracked_batches': sum(1 for batch in self._batches.values() if not batch.finished),
+                'finished_batches': sum(1 for batch in self._batches.values() if batch.finished),
+                'subscribers': sum(len(subscribers) for subscribers in self._subscribers.values()),
+                'polls': self.polls,
+                'poll_errors': self.poll_errors,
+                'events': self.events,
+                'dropped_events': self.dropped_events
+            }
+
+def on_batch_indexed(dataset_id, documents):
+    """一个batch的文档全部索引结束后：使检索缓存失效，并把新分段加入本地关键词索引"""
+    retrieval_cache.invalidate_dataset(dataset_id)
+    segment_mirror.refresh_documents(dataset_id, documents)
+
+indexing_tracker = IndexingTracker(dify_client, on_batch_done=on_batch_indexed)
+
+def on_documents_changed(dataset_id, batch=None, removed_document_id=None, document=None):
+    """经本应用增删文档后：使检索缓存失效，跟踪新文档的索引进度，并从本地关键词索引中移除已删除的文档
+    
+    document为新建的文档 {'id', 'name'}，索引完成后按该名称加入本地关键词索引。
+    """
+    retrieval_cache.invalidate_dataset(dataset_id)
+    dify_client.forget_dataset_reads(dataset_id)
+    if removed_document_id:
+        segment_mirror.remove_document(dataset_id, removed_document_id)
+    if batch:
+        indexing_tracker.track(dataset_id, batch, document)
+
+def created_document(result, name):
+    """从创建文档的响应中取出 {'id', 'name'}，名称缺失时使用提交时的名称"""
+    document = (result or {}).get('document') or {}
+    if not document.get('id'):
+        return None
+    return {'id': document['id'], 'name': document.get('name') or name}
+
+def hash_file(path):
+    """计算文件内容的SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter_file_chunks(f):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class SyncManifest:
+    """目录同步清单：相对路径 -> {sha256, size, mtime_ns, document_id, batch, synced_at}
+    
+    每完成一个操作保存一次（先写临时文件再原子替换），同步中途失败时已完成的部分不会丢失。
+    清单属于其他知识库时视为空清单。
+    """
+    
+    def __init__(self, path, dataset_id):
+        self.path = path
+        self.dataset_id = dataset_id
+        self.entries = {}
+        self._lock = threading.Lock()
+        
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.warning('同步清单读取失败，按全量同步处理', extra={'fields': {'path': path, 'error': repr(e)}})
+            return
+        if data.get('dataset_id') == dataset_id:
+            self.entries = data.get('files', {})
+    
+    @staticmethod
+    def default_path(dataset_id, root):
+        """按知识库ID和目录绝对路径确定清单位置，命令行与API同步同一目录时共用一份清单"""
+        digest = hashlib.sha256(os.path.realpath(root).encode('utf-8')).hexdigest()[:16]
+        return os.path.join(SyncConfig.MANIFEST_DIR, f'{secure_filename(dataset_id)}-{digest}.json')
+    
+    def get(self, relpath):
+        with self._lock:
+            return self.entries.get(relpath)
+    
+    def paths(self):
+        with self._lock:
+            return list(self.entries)
+    
+    def update(self, relpath, entry):
+        with self._lock:
+            self.entries[relpath] = entry
+        self.save()
+    
+    def remove(self, relpath):
+        with self._lock:
+            self.entries.pop(relpath, None)
+        self.save()
+    
+    def save(self):
+        with self._lock:
+            data = json.dumps({'dataset_id': self.dataset_id, 'files': self.entries}, ensure_ascii=False, indent=1)
+            directory = os.path.dirname(self.path) or '.'
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.manifest-')
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    f.write(data)
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+
+class SyncAction:
+    """目录同步中的单个操作
+    
+    op为create（新文件）、update（内容变化）、delete（文件已删除）或unchanged；
+    status依次为 pending -> running -> (retrying -> running)* -> succeeded/failed。
+    """
+    
+    def __init__(self, op, path, size=None, sha256=None, mtime_ns=None, document_id=None):
+        self.op = op
+        self.path = path
+        self.size = size
+        self.sha256 = sha256
+        self.mtime_ns = mtime_ns
+        self.document_id = document_id
+        self.status = 'succeeded' if op == 'unchanged' else 'pending'
+        self.attempts = 0
+        self.error = None
+        self.batch = None
+    
+    def to_dict(self):
+        return {
+            'op': self.op,
+            'path': self.path,
+            'size': self.size,
+            'status': self.status,
+            'attempts': self.attempts,
+            'error': self.error,
+            'document_id': self.document_id,
+            'batch': self.batch
+        }
+
+class DatasetSync:
+    """把本地目录增量同步到知识库
+    
+    根据清单中记录的内容哈希对比目录：新文件用create_by_file上传，内容变化的文件用
+    update_by_file只重新嵌入该文档，已删除的文件删除对应文档，未变化的文件不产生任何请求。
+    大小和修改时间都未变的文件直接沿用清单中的哈希，不重新读取（checksum=True时总是重新计算）。
+    操作在有界线程池中执行，可重试的错误按指数退避重试；失败的操作不写入清单，下次同步时重试。
+    """
     
-    def delete_document(self, dataset_id, document_id):
-        """删除文档"""
-        url = DifyAPIConfig.get_full_url('dataset_document_detail', dataset_id=dataset_id, document_id=document_id)
+    OPS = ('create', 'update', 'delete', 'unchanged')
+    
+    def __init__(self, client, dataset_id, root, manifest_path=None, concurrency=None, checksum=False, on_documents_changed=None):
+        self.id = uuid.uuid4().hex
+        self.client = client
+        self.dataset_id = dataset_id
+        self.root = os.path.realpath(root)
+        self.manifest = SyncManifest(manifest_path or SyncManifest.default_path(dataset_id, self.root), dataset_id)
+        self.concurrency = concurrency or SyncConfig.CONCURRENCY
+        self.checksum = checksum
+        self.on_documents_changed = on_documents_changed
+        self.actions = []
+        self.state = 'pending'
+        self.created_at = time.time()
+        self.finished_at = None
+        self._lock = threading.Lock()
+    
+    def scan(self):
+        """遍历目录，返回 {相对路径: (绝对路径, 大小, 修改时间)}，跳过隐藏文件/目录和不支持的类型"""
+        files = {}
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames[:] = sorted(name for name in dirnames if not name.startswith('.'))
+            for filename in sorted(filenames):
+                if filename.startswith('.') or not allowed_file(filename):
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                relpath = os.path.relpath(path, self.root).replace(os.sep, '/')
+                files[relpath] = (path, stat.st_size, stat.st_mtime_ns)
+        return files
+    
+    def plan(self):
+        """对比目录与清单，生成操作列表"""
+        actions = []
+        files = self.scan()
+        for relpath, (path, size, mtime_ns) in files.items():
+            entry = self.manifest.get(relpath)
+            if entry and not self.checksum and entry.get('size') == size and entry.get('mtime_ns') == mtime_ns:
+                actions.append(SyncAction('unchanged', relpath, size, entry.get('sha256'), mtime_ns, entry.get('document_id')))
+                continue
+            
+            sha256 = hash_file(path)
+            if entry and entry.get('sha256') == sha256:
+                # 只是修改时间变化：刷新清单中的修改时间，下次可以跳过哈希计算
+                if entry.get('mtime_ns') != mtime_ns:
+                    self.manifest.update(relpath, dict(entry, size=size, mtime_ns=mtime_ns))
+                actions.append(SyncAction('unchanged', relpath, size, sha256, mtime_ns, entry.get('document_id')))
+            elif entry and entry.get('document_id'):
+                actions.append(SyncAction('update', relpath, size, sha256, mtime_ns, entry['document_id']))
+            else:
+                actions.append(SyncAction('create', relpath, size, sha256, mtime_ns))
         
-        try:
-            response = requests.delete(url, headers=self.dataset_headers, timeout=self.timeout)
-            response.raise_for_status()
-            return response.json()
-        except Exception as e:
-            return None
+        for relpath in self.manifest.paths():
+            if relpath not in files:
+                entry = self.manifest.get(relpath) or {}
+                actions.append(SyncAction('delete', relpath, document_id=entry.get('document_id')))
+        
+        with self._lock:
+            self.actions = actions
+        return actions
     
-    def get_documents(self, dataset_id, page=None, limit=None):
-        """获取知识库文档列表"""
-        url = DifyAPIConfig.get_full_url('dataset_documents', dataset_id=dataset_id)
-        page = page or DefaultSettings.DEFAULT_PAGE
-        limit = limit or DefaultSettings.DEFAULT_PAGE_SIZE
-        params = {"page": page, "limit": limit}
+    def _apply(self, action):
+        """执行单个操作，返回Dify的响应"""
+        if action.op == 'delete':
+            if not action.document_id:
+                return {}
+            try:
+                return self.client.submit_document_delete(self.dataset_id, action.document_id)
+            except requests.exceptions.HTTPError as e:
+                # 文档已在Dify中被删除，视为成功
+                if e.response is not None and e.response.status_code == 404:
+                    return {}
+                raise
         
-        try:
-            response = requests.get(url, headers=self.dataset_headers, params=params, timeout=self.timeout)
-            response.raise_for_status()
-            return response.json()
-        except Exception as e:
-            return {"data": [], "has_more": False}
+        path = os.path.join(self.root, *action.path.split('/'))
+        with open(path, 'rb') as f:
+            if action.op == 'update':
+                try:
+                    return self.client.submit_document_update_by_stream(self.dataset_id, action.document_id, action.path,
+                                                                        iter_file_chunks(f), file_size=action.size)
+                except requests.exceptions.HTTPError as e:
+                    # 文档已在Dify中被删除，改为重新创建
+                    if e.response is None or e.response.status_code != 404:
+                        raise
+                    f.seek(0)
+            return self.client.submit_document_by_stream(self.dataset_id, action.path, iter_file_chunks(f), file_size=action.size)
     
-    def get_document_indexing_status(self, dataset_id, batch_id):
-        """获取文档嵌入状态"""
-        url = DifyAPIConfig.get_full_url('dataset_indexing_status', dataset_id=dataset_id, batch_id=batch_id)
+    def _run(self, action):
+        while True:
+            with self._lock:
+                action.status = 'running'
+                action.attempts += 1
+            try:
+                result = self._apply(action)
+                break
+            except Exception as e:
+                if is_retryable_error(e) and action.attempts < SyncConfig.MAX_ATTEMPTS:
+                    with self._lock:
+                        action.status = 'retrying'
+                        action.error = str(e)
+                    time.sleep(SyncConfig.BACKOFF_BASE * 2 ** (action.attempts - 1) * random.uniform(0.5, 1.5))
+                    continue
+                logger.warning('目录同步操作失败', extra={'fields': {
+                    'sync_id': self.id, 'dataset_id': self.dataset_id, 'op': action.op, 'path': action.path,
+                    'attempts': action.attempts, 'error': repr(e)
+                }})
+                with self._lock:
+                    action.status = 'failed'
+                    action.error = str(e)
+                return
         
+        with self._lock:
+            if action.op != 'delete':
+                action.document_id = (result.get('document') or {}).get('id') or action.document_id
+                action.batch = result.get('batch')
+            action.status = 'succeeded'
+            action.error = None
+        
+        if action.op == 'delete':
+            self.manifest.remove(action.path)
+        else:
+            self.manifest.update(action.path, {
+                'sha256': action.sha256,
+                'size': action.size,
+                'mtime_ns': action.mtime_ns,
+                'document_id': action.document_id,
+                'batch': action.batch,
+                'synced_at': time.time()
+            })
+        if self.on_documents_changed:
+            if action.op == 'delete':
+                self.on_documents_changed(self.dataset_id, removed_document_id=action.document_id)
+            else:
+                self.on_documents_changed(self.dataset_id, action.batch, document={'id': action.document_id, 'name': action.path})
+    
+    def run(self, dry_run=False):
+        """扫描并执行同步，dry_run=True时只生成操作列表；返回进度字典"""
+        with self._lock:
+            self.state = 'scanning'
         try:
-            response = requests.get(url, headers=self.dataset_headers, timeout=self.timeout)
-            response.raise_for_status()
-            return response.json()
+            actions = self.plan()
+            if not dry_run:
+                with self._lock:
+                    self.state = 'running'
+                pending = [action for action in actions if action.status == 'pending']
+                with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='sync') as executor:
+                    list(executor.map(self._run, pending))
+            state = 'planned' if dry_run else 'finished'
         except Exception as e:
-            return {"data": []}
+            logger.error('目录同步失败', extra={'fields': {'sync_id': self.id, 'dataset_id': self.dataset_id, 'error': repr(e)}})
+            state = 'error'
+        with self._lock:
+            self.state = state
+            self.finished_at = time.time()
+        return self.to_dict()
     
-    def retrieve_dataset(self, dataset_id, query, top_k=None, score_threshold=None):
-        """检索知识库"""
-        url = DifyAPIConfig.get_full_url('dataset_retrieve', dataset_id=dataset_id)
-        top_k = top_k or DefaultSettings.DEFAULT_TOP_K
-        score_threshold = score_threshold or DefaultSettings.DEFAULT_SCORE_THRESHOLD
+    def to_dict(self, include_actions=True):
+        with self._lock:
+            ops = {op: 0 for op in self.OPS}
+            counts = {status: 0 for status in ('pending', 'running', 'retrying', 'succeeded', 'failed')}
+            for action in self.actions:
+                ops[action.op] += 1
+                counts[action.status] += 1
+            actions = [action.to_dict() for action in self.actions if action.op != 'unchanged'] if include_actions else None
+            state, finished_at = self.state, self.finished_at
         
-        data = {
-            "query": query,
-            "retrieval_model": {
-                "search_method": "keyword_search",
-                "reranking_enable": False,
-                "reranking_mode": None,
-                "reranking_model": {
-                    "reranking_provider_name": "",
-                    "reranking_model_name": ""
-                },
-                "weights": None,
-                "top_k": top_k,
-                "score_threshold_enabled": score_threshold > 0,
-                "score_threshold": score_threshold if score_threshold > 0 else None
-            }
+        if state == 'finished':
+            status = 'completed' if counts['failed'] == 0 else 'partial'
+        else:
+            status = state
+        
+        result = {
+            'sync_id': self.id,
+            'dataset_id': self.dataset_id,
+            'root': self.root,
+            'status': status,
+            'ops': ops,
+            'counts': counts,
+            'created_at': self.created_at,
+            'finished_at': finished_at
         }
+        if actions is not None:
+            result['actions'] = actions
+        return result
+
+sync_jobs = TTLCache(SyncConfig.JOB_MAX_ENTRIES, SyncConfig.JOB_TTL)
+active_syncs = {}
+active_syncs_lock = threading.Lock()
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.HTTP_REQUESTS.inc(route=route, method=request.method, status=response.status_code)
+    if 'request_start' in g:
+        metrics.HTTP_LATENCY.observe(time.perf_counter() - g.request_start, route=route, method=request.method)
+    if response.status_code >= 500:
+        metrics.ERRORS.inc(type=f'http_{response.status_code}')
+    return response
+
+def collect_component_metrics():
+    """读取连接池、准入控制和缓存的现有统计"""
+    pool = dify_client.pool_stats()
+    admission = dify_client.admission.stats()
+    indexing = indexing_tracker.stats()
+    keyword = segment_mirror.stats()
+    upstreams = dify_client.upstreams.stats()
+    coalescing = dify_client.single_flight.stats()
+    caches = {'uploads': dify_client.upload_cache.stats(), 'history': history_cache.stats(),
+              'retrieval': retrieval_cache.stats(), 'completions': result_cache.stats(),
+              'extracted_text': text_extractor.stats()}
+    return [
+        ('dify_web_http_pool_requests_total', 'counter', '上游连接池请求数（hit为复用keep-alive连接）',
+         [({'result': 'hit'}, pool['hits']), ({'result': 'miss'}, pool['misses'])]),
+        ('dify_web_admission_active', 'gauge', '各类上游调用的在途请求数',
+         [({'class': name}, stats['active']) for name, stats in admission.items()]),
+        ('dify_web_admission_queue_depth', 'gauge', '各类上游调用的排队请求数',
+         [({'class': name}, stats['waiting']) for name, stats in admission.items()]),
+        ('dify_web_admission_rejected_total', 'counter', '因队列已满或等待超时被拒绝的请求数',
+         [({'class': name}, stats['rejected'] + stats['timeouts']) for name, stats in admission.items()]),
+        ('dify_web_admission_wait_seconds_total', 'counter', '排队等待总时长',
+         [({'class': name}, stats['wait_time_total']) for name, stats in admission.items()]),
+        ('dify_web_cache_lookups_total', 'counter', '服务端缓存查询数',
+         [({'cache': name, 'result': result}, stats[key]) for name, stats in caches.items()
+          for result, key in (('hit', 'hits'), ('miss', 'misses'))]),
+        ('dify_web_cache_entries', 'gauge', '服务端缓存条目数',
+         [({'cache': name}, stats['size']) for name, stats in caches.items()]),
+        ('dify_web_completion_cache_bytes', 'gauge', '文档处理结果缓存占用字节数',
+         [({}, caches['completions']['bytes'])]),
+        ('dify_web_completion_cache_bytes_saved_total', 'counter', '由结果缓存回放、无需重新生成的字节数',
+         [({}, caches['completions']['bytes_saved'])]),
+        ('dify_web_indexing_tracked_batches', 'gauge', '后台跟踪中的索引batch数',
+         [({}, indexing['tracked_batches'])]),
+        ('dify_web_indexing_subscribers', 'gauge', '索引状态推送通道的订阅者数',
+         [({}, indexing['subscribers'])]),
+        ('dify_web_indexing_polls_total', 'counter', '索引状态上游轮询次数',
+         [({}, indexing['polls'])]),
+        ('dify_web_keyword_index_queries_total', 'counter', '关键词检索查询数（local为本地索引，fallback为回退到Dify）',
+         [({'result': 'local'}, keyword['hits']), ({'result': 'fallback'}, keyword['fallbacks'])]),
+        ('dify_web_keyword_index_segments', 'gauge', '本地关键词索引中的分段数',
+         [({}, keyword['segments'])]),
+        ('dify_web_upstream_node_healthy', 'gauge', '上游节点是否在负载均衡中（1为健康，0为已摘除）',
+         [({'node': node['url']}, int(node['healthy'])) for node in upstreams['nodes']]),
+        ('dify_web_upstream_node_outstanding', 'gauge', '各上游节点的在途请求数',
+         [({'node': node['url']}, node['outstanding']) for node in upstreams['nodes']]),
+        ('dify_web_upstream_node_ejections_total', 'counter', '上游节点被摘除的次数',
+         [({'node': node['url']}, node['ejections']) for node in upstreams['nodes']]),
+        ('dify_web_upstream_coalescing_ratio', 'gauge', '相同并发GET请求中共享结果、未实际发出的比例',
+         [({'endpoint': endpoint}, stats['ratio']) for endpoint, stats in coalescing['endpoints'].items()]),
+    ]
+
+metrics.REGISTRY.register_collector(collect_component_metrics)
+
+stop_executor = ThreadPoolExecutor(max_workers=StreamConfig.STOP_WORKERS, thread_name_prefix='stop-generation')
+
+def cancel_generation(stop, task_id):
+    """客户端断开后在后台调用stop(task_id)停止上游生成，不阻塞当前线程"""
+    if stop is None or not task_id or not StreamConfig.STOP_ON_DISCONNECT:
+        return None
+    
+    def run():
+        result = stop(task_id)
+        status = 'error' if 'error' in result else 'ok'
+        metrics.UPSTREAM_STOPS.inc(status=status)
+        logger.info('客户端断开，已请求停止上游生成', extra={'fields': {'task_id': task_id, 'status': status}})
+    
+    return stop_executor.submit(run)
+
+def stream_upstream(response, relay, stop=None):
+    """将上游流式响应经relay转换后逐帧返回，响应结束或客户端断开时关闭上游连接
+    
+    客户端中途断开时（写入失败后服务器关闭生成器）立即关闭上游连接，
+    并以relay捕获的task_id在后台调用stop停止生成。
+    流中出现的会话ID、任务ID绑定到处理该流的上游节点。
+    """
+    meter = metrics.StreamMeter(request.url_rule.rule, g.get('request_start'))
+    affinity = StreamAffinity(dify_client.upstreams, getattr(response, 'upstream', None))
+    
+    def generate():
+        if not response:
+            yield sse_frame({'error': 'API请求失败'})
+            return
         
         try:
-            response = requests.post(url, headers=self.dataset_headers, json=data, timeout=self.timeout)
-            response.raise_for_status()
-            return response.json()
-        except Exception as e:
-            return {"records": []}
+            for line in response.iter_lines():
+                frame = relay.feed(line)
+                if frame:
+                    meter.frame()
+                    affinity.observe(relay)
+                    yield frame
+        except GeneratorExit:
+            response.close()
+            meter.abort()
+            cancel_generation(stop, getattr(relay, 'task_id', None))
+            raise
+    
+    streamed = app.response_class(generate(), mimetype='text/plain')
+    if response is not None:
+        streamed.call_on_close(response.close)
+    streamed.call_on_close(meter.finish)
+    return streamed
 
-    def stop_chat_message(self, task_id, user_id=None):
-        """停止聊天消息生成"""
-        url = DifyAPIConfig.get_full_url('chat_messages_stop', task_id=task_id)
-        user_id = user_id or DefaultSettings.DEFAULT_USER_ID
-        
-        data = {
-            "user": user_id
-        }
-        
+class StaticAssets:
+    """build_assets.py构建的页面脚本与样式
+    
+    manifest存在时引用压缩后带内容哈希的文件（由/assets/路由长期缓存），否则直接引用源文件；
+    manifest在文件修改后自动重新加载，重新构建无需重启应用。
+    """
+    
+    def __init__(self, dist_dir=None):
+        self.dist_dir = os.path.join(app.root_path, dist_dir or AssetConfig.DIST_DIR)
+        self.manifest_path = os.path.join(self.dist_dir, AssetConfig.MANIFEST)
+        self._manifest = {}
+        self._mtime = None
+    
+    def manifest(self):
         try:
-            response = requests.post(url, headers=self.chat_headers, json=data, timeout=self.timeout)
-            response.raise_for_status()
-            return response.json()
-        except Exception as e:
-            return {"error": str(e)}
+            mtime = os.stat(self.manifest_path).st_mtime
+        except OSError:
+            self._manifest, self._mtime = {}, None
+            return self._manifest
+        if mtime != self._mtime:
+            with open(self.manifest_path, encoding='utf-8') as f:
+                self._manifest = json.load(f)
+            self._mtime = mtime
+        return self._manifest
+    
+    def url(self, name):
+        """模板中引用资源的地址"""
+        built = self.manifest().get(name)
+        if built:
+            return url_for('static_asset', filename=built)
+        source = os.path.relpath(os.path.join(app.root_path, AssetConfig.SOURCE_DIR, name), app.static_folder)
+        return url_for('static', filename=source.replace(os.sep, '/'))
 
-# 初始化API客户端
-dify_client = DifyAPIClient()
+static_assets = StaticAssets()
+app.add_template_global(static_assets.url, 'asset_url')
 
-def allowed_file(filename):
-    """检查文件扩展名是否允许"""
-    return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in AppConfig.ALLOWED_EXTENSIONS
+@app.route('/assets/<path:filename>')
+def static_asset(filename):
+    """返回构建后的资源：按Accept-Encoding优先返回预压缩副本，文件名带内容哈希，可永久缓存"""
+    path = safe_join(static_assets.dist_dir, filename)
+    mimetype = mimetypes.guess_type(filename)[0]
+    for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if path and request.accept_encodings[encoding] and os.path.isfile(path + suffix):
+            response = send_from_directory(static_assets.dist_dir, filename + suffix, mimetype=mimetype)
+            response.headers['Content-Encoding'] = encoding
+            break
+    else:
+        response = send_from_directory(static_assets.dist_dir, filename, mimetype=mimetype)
+    response.headers['Cache-Control'] = f'public, max-age={AssetConfig.MAX_AGE}, immutable'
+    response.vary.add('Accept-Encoding')
+    return response
 
 @app.route('/')
 def index():
@@ -397,55 +3439,47 @@ def send_message():
     """发送聊天消息API - 支持JSON和FormData格式"""
     # 检查请求格式
     if request.content_type and 'multipart/form-data' in request.content_type:
-        # FormData格式 (移动端文件上传)
-        query = request.form.get('message', '')
-        conversation_id = request.form.get('conversation_id', '')
+        # FormData格式 (移动端文件上传)，文件边解析边上传到Dify
+        reader = MultipartStreamReader.from_request(request)
+        if reader is None:
+            return jsonify({'error': '请求数据格式错误'}), 400
+        
+        form = {}
         files = None
         inputs = {}
         
-        # 处理文件上传
-        if 'file' in request.files:
-            uploaded_file = request.files['file']
-            if uploaded_file and uploaded_file.filename:
+        try:
+            for name, part in reader.parts():
+                if not isinstance(part, UploadPart):
+                    form[name] = part
+                    continue
+                if name != 'file' or not part.filename:
+                    continue
+                
                 # 检查文件类型
-                filename = secure_filename(uploaded_file.filename)
+                filename = secure_filename(part.filename)
                 if not allowed_file(filename):
                     return jsonify({'error': '不支持的文件类型'}), 400
                 
-                try:
-                    # 确保上传目录存在
-                    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-                    
-                    # 保存文件到临时目录
-                    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                    uploaded_file.save(filepath)
-                    
-                    # 检查文件大小
-                    file_size = os.path.getsize(filepath)
-                    if file_size > 50 * 1024 * 1024:
-                        os.remove(filepath)
-                        return jsonify({'error': '文件大小不能超过50MB'}), 400
-                    
-                    # 上传到Dify
-                    upload_result = dify_client.upload_file(filepath)
-                    
-                    # 删除临时文件
-                    try:
-                        os.remove(filepath)
-                    except:
-                        pass
-                    
-                    if upload_result:
-                        files = [{
-                            'type': 'image' if upload_result.get('extension', '').lower() in ['png', 'jpg', 'jpeg', 'gif', 'webp'] else 'document',
-                            'transfer_method': 'local_file',
-                            'upload_file_id': upload_result.get('id')
-                        }]
-                    else:
-                        return jsonify({'error': '文件上传失败'}), 500
-                        
-                except Exception as e:
-                    return jsonify({'error': f'文件处理失败: {str(e)}'}), 500
+                # 上传到Dify
+                upload_result = dify_client.upload_file_stream(filename, part)
+                if upload_result:
+                    files = [{
+                        'type': 'image' if upload_result.get('extension', '').lower() in ['png', 'jpg', 'jpeg', 'gif', 'webp'] else 'document',
+                        'transfer_method': 'local_file',
+                        'upload_file_id': upload_result.get('id')
+                    }]
+                else:
+                    return jsonify({'error': '文件上传失败'}), 500
+        except UploadTooLarge:
+            return jsonify({'error': '文件大小不能超过50MB'}), 400
+        except UpstreamBusy:
+            raise
+        except Exception as e:
+            return jsonify({'error': f'文件处理失败: {str(e)}'}), 500
+        
+        query = form.get('message', '')
+        conversation_id = form.get('conversation_id', '')
     else:
         # JSON格式 (原有格式)
         data = request.get_json()
@@ -457,88 +3491,39 @@ def send_message():
     if not query.strip() and not files and not inputs:
         return jsonify({'error': '消息不能为空'}), 400
     
-    def generate():
-        response = dify_client.chat_message(query, conversation_id, files=files, inputs=inputs, stream=True)
-        if not response:
-            yield f"data: {json.dumps({'error': 'API请求失败'})}\n\n"
-            return
-            
-        current_answer = ""
-        current_conversation_id = conversation_id
-        current_task_id = None
-        
-        for line in response.iter_lines():
-            if line:
-                line_str = line.decode('utf-8')
-                if line_str.startswith('data: '):
-                    try:
-                        json_data = json.loads(line_str[6:])
-                        
-                        # 获取task_id
-                        if json_data.get('task_id'):
-                            current_task_id = json_data.get('task_id')
-                        
-                        if json_data.get('event') == 'message':
-                            current_answer += json_data.get('answer', '')
-                            current_conversation_id = json_data.get('conversation_id', current_conversation_id)
-                            
-                            # 直接转发Dify的响应格式
-                            response_data = {
-                                'event': 'message',
-                                'answer': json_data.get('answer', ''),
-                                'conversation_id': current_conversation_id,
-                                'task_id': current_task_id
-                            }
-                            yield f"data: {json.dumps(response_data)}\n\n"
-                            
-                        elif json_data.get('event') == 'message_end':
-                            # 直接转发Dify的响应格式
-                            response_data = {
-                                'event': 'message_end',
-                                'conversation_id': current_conversation_id,
-                                'message_id': json_data.get('id', ''),
-                                'metadata': json_data.get('metadata', {}),
-                                'task_id': current_task_id
-                            }
-                            yield f"data: {json.dumps(response_data)}\n\n"
-                            
-                    except json.JSONDecodeError:
-                        continue
-    
-    return app.response_class(generate(), mimetype='text/plain')
+    # 在返回流式响应前发起上游请求，上游繁忙时可以直接返回503
+    response = dify_client.chat_message(query, conversation_id, files=files, inputs=inputs, stream=True)
+    relay = create_chat_relay(conversation_id, on_end=history_cache.invalidate_conversation)
+    return stream_upstream(response, relay, stop=dify_client.stop_chat_message)
 
 @app.route('/api/conversations')
 def get_conversations():
     """获取会话列表API"""
-    result = dify_client.get_conversations()
-    return jsonify(result)
+    return cached_json_response(history_cache.conversations())
 
 @app.route('/api/conversations/<conversation_id>/messages')
 def get_conversation_messages(conversation_id):
-    """获取会话消息API"""
-    result = dify_client.get_messages(conversation_id)
-    return jsonify(result)
+    """获取会话消息API
+    
+    游标分页: first_id为已加载的最早消息ID，返回比它更早的limit条消息
+    增量模式: since为客户端已有的最新消息ID，只返回比它更新的消息
+    """
+    limit = request.args.get('limit', DefaultSettings.DEFAULT_MESSAGE_LIMIT, type=int)
+    limit = max(1, min(limit, DefaultSettings.MAX_MESSAGE_LIMIT))
+    first_id = request.args.get('first_id') or None
+    since = request.args.get('since') or None
+    
+    if since:
+        return cached_json_response(history_cache.messages_since(conversation_id, since, limit=limit))
+    return cached_json_response(history_cache.messages(conversation_id, limit=limit, first_id=first_id))
 
 @app.route('/document')
 def document():
     """文档处理页面"""
     return render_template('document.html')
 
-@app.route('/api/upload', methods=['POST'])
-def upload_file():
-    """上传文件，支持图片和文档格式"""
-    if 'file' not in request.files:
-        return jsonify({'error': '未选择文件'}), 400
-    
-    file = request.files['file']
-    if file.filename == '':
-        return jsonify({'error': '未选择文件'}), 400
-    
-    # 检查文件扩展名
-    filename = secure_filename(file.filename)
-    if not allowed_file(filename):
-        return jsonify({'error': '不支持的文件类型'}), 400
-    
+def detect_file_type(filename):
+    """根据扩展名确定Dify文件类型"""
     file_extension = filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
     
     # 所有支持的文件类型都上传到Dify API
@@ -547,125 +3532,173 @@ def upload_file():
     audio_extensions = {'mp3', 'm4a', 'wav', 'webm', 'amr'}
     video_extensions = {'mp4', 'mov', 'mpeg', 'mpga'}
     
-    # 确定文件类型
     if file_extension in image_extensions:
-        file_type = 'image'
+        return 'image'
     elif file_extension in document_extensions:
-        file_type = 'document'
+        return 'document'
     elif file_extension in audio_extensions:
-        file_type = 'audio'
+        return 'audio'
     elif file_extension in video_extensions:
-        file_type = 'video'
-    else:
-        file_type = 'custom'
+        return 'video'
+    return 'custom'
+
+@app.route('/api/upload', methods=['POST'])
+def upload_file():
+    """上传文件，支持图片和文档格式
+    
+    文件数据从请求流直接转发到Dify，不写入本地临时文件。
+    """
+    reader = MultipartStreamReader.from_request(request)
+    if reader is None:
+        return jsonify({'error': '未选择文件'}), 400
     
     try:
-        # 确保上传目录存在
-        os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-        
-        # 保存文件到上传目录
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
-        
-        # 检查文件大小 (50MB限制)
-        file_size = os.path.getsize(filepath)
-        if file_size > 50 * 1024 * 1024:
-            os.remove(filepath)
-            return jsonify({'error': '文件大小不能超过50MB'}), 400
-        
-        # 所有文件都上传到Dify API
-        result = dify_client.upload_file(filepath)
-        
-        # 删除本地临时文件
-        try:
-            os.remove(filepath)
-        except:
-            pass
+        for name, part in reader.parts():
+            if name != 'file' or not isinstance(part, UploadPart):
+                continue
+            if not part.filename:
+                return jsonify({'error': '未选择文件'}), 400
+            
+            # 检查文件扩展名
+            filename = secure_filename(part.filename)
+            if not allowed_file(filename):
+                return jsonify({'error': '不支持的文件类型'}), 400
+            
+            # 确定文件类型
+            file_type = detect_file_type(filename)
+            
+            # 所有文件都上传到Dify API
+            result = dify_client.upload_file_stream(filename, part)
+            
+            if result:
+                return jsonify({
+                    'success': True,
+                    'file_type': file_type,
+                    'file': {
+                        'id': result.get('id'),
+                        'name': result.get('name'),
+                        'size': result.get('size'),
+                        'extension': result.get('extension'),
+                        'mime_type': result.get('mime_type'),
+                        'type': file_type,
+                        'transfer_method': 'local_file'
+                    }
+                })
+            else:
+                return jsonify({'error': '文件上传到Dify失败'}), 500
         
-        if result:
-            return jsonify({
-                'success': True,
-                'file_type': file_type,
-                'file': {
-                    'id': result.get('id'),
-                    'name': result.get('name'),
-                    'size': result.get('size'),
-                    'extension': result.get('extension'),
-                    'mime_type': result.get('mime_type'),
-                    'type': file_type,
-                    'transfer_method': 'local_file'
-                }
-            })
-        else:
-            return jsonify({'error': '文件上传到Dify失败'}), 500
+        return jsonify({'error': '未选择文件'}), 400
             
+    except UploadTooLarge:
+        return jsonify({'error': '文件大小不能超过50MB'}), 400
+    except UpstreamBusy:
+        raise
     except Exception as e:
-        # 删除临时文件
+        return jsonify({'error': f'文件处理失败: {str(e)}'}), 500
+
+@app.route('/api/document/extract', methods=['POST'])
+def extract_document_text():
+    """从上传的文件中提取文本API（PDF、Word、Excel、CSV、HTML及纯文本）
+    
+    按页返回SSE帧：start（含extract_id）-> page* -> end，解析失败时为error。
+    extract_id可代替content传给 /api/document/process，或代替text用于知识库文本导入；相同文件直接返回缓存结果。
+    """
+    reader = MultipartStreamReader.from_request(request)
+    if reader is None:
+        return jsonify({'error': '未选择文件'}), 400
+    
+    spooled = None
+    try:
+        for name, part in reader.parts():
+            if name != 'file' or not isinstance(part, UploadPart):
+                continue
+            filename = os.path.basename((part.filename or '').replace('\\', '/'))
+            if not filename:
+                return jsonify({'error': '未选择文件'}), 400
+            if not TextExtractor.supported(filename):
+                return jsonify({'error': '不支持从该格式提取文本'}), 400
+            spooled = (filename, *text_extractor.spool(part))
+            break
+    except UploadTooLarge:
+        return jsonify({'error': '文件大小不能超过50MB'}), 400
+    except ValueError as e:
+        return jsonify({'error': f'文件处理失败: {str(e)}'}), 400
+    if spooled is None:
+        return jsonify({'error': '未选择文件'}), 400
+    
+    filename, path, content_hash, size = spooled
+    extension = TextExtractor.extension(filename)
+    extract_id = TextExtractor.make_id(content_hash, extension)
+    cached = text_extractor.pages(extract_id)
+    pages = iter(cached) if cached is not None else text_extractor.run(path, extension, extract_id)
+    
+    def generate():
+        yield sse_frame({'type': 'start', 'extract_id': extract_id, 'name': filename, 'size': size, 'cached': cached is not None})
+        count, chars = 0, 0
+        try:
+            for page in pages:
+                count += 1
+                chars += len(page)
+                yield sse_frame({'type': 'page', 'page': count, 'content': page})
+        except extraction.ExtractionError as e:
+            logger.warning('文本提取失败', extra={'fields': {'name': filename, 'size': size, 'error': str(e)}})
+            yield sse_frame({'type': 'error', 'error': str(e)})
+            return
+        yield sse_frame({'type': 'end', 'extract_id': extract_id, 'pages': count, 'chars': chars})
+    
+    def cleanup():
+        if cached is None:
+            pages.close()
         try:
-            if 'filepath' in locals():
-                os.remove(filepath)
-        except:
+            os.unlink(path)
+        except OSError:
             pass
-        return jsonify({'error': f'文件处理失败: {str(e)}'}), 500
+    
+    response = app.response_class(generate(), mimetype='text/plain')
+    response.call_on_close(cleanup)
+    return response
 
 @app.route('/api/document/process', methods=['POST'])
 def process_document():
-    """处理文档API"""
+    """处理文档API（content或extract_id二选一）"""
     data = request.get_json()
     task_type = data.get('type', 'translate')  # translate, summary, rewrite
     content = data.get('content', '')
     language = data.get('language', 'zh')
     
+    if not content.strip() and data.get('extract_id'):
+        content = text_extractor.text(data['extract_id'])
+        if content is None:
+            return jsonify({'error': '提取结果不存在或已过期，请重新上传文件'}), 404
+    
     if not content.strip():
         return jsonify({'error': '内容不能为空'}), 400
     
     # 根据任务类型构建输入
-    if task_type == 'translate':
-        inputs = {
-            "query": f"请将以下内容翻译成{language}：\n\n{content}"
-        }
-    elif task_type == 'summary':
-        inputs = {
-            "query": f"请总结以下内容的要点：\n\n{content}"
-        }
-    elif task_type == 'rewrite':
-        inputs = {
-            "query": f"请改写以下内容，使其更加清晰易懂：\n\n{content}"
-        }
-    else:
+    inputs = build_document_inputs(task_type, content, language)
+    if inputs is None:
         return jsonify({'error': '不支持的处理类型'}), 400
     
-    def generate():
+    # 相同内容的处理结果直接从缓存回放
+    cache_key = result_cache.make_key(task_type, language, content)
+    cached = result_cache.get(cache_key)
+    if cached is not None:
+        return stream_upstream(CachedCompletion(cached), create_document_relay(data.get('protocol')))
+    
+    relay = create_document_relay(data.get('protocol'), on_end=functools.partial(result_cache.set, cache_key))
+    if len(content) > DocumentConfig.CHUNK_THRESHOLD:
+        response = ChunkedDocumentJob(dify_client, task_type, content, language)
+    else:
         response = dify_client.completion_message(inputs, stream=True)
-        if not response:
-            yield f"data: {json.dumps({'error': 'API请求失败'})}\n\n"
-            return
-        
-        current_answer = ""
-        
-        for line in response.iter_lines():
-            if line:
-                line_str = line.decode('utf-8')
-                if line_str.startswith('data: '):
-                    try:
-                        json_data = json.loads(line_str[6:])
-                        
-                        if 'answer' in json_data:
-                            current_answer += json_data.get('answer', '')
-                            response_data = {
-                                'type': 'message',
-                                'content': json_data.get('answer', ''),
-                                'full_content': current_answer
-                            }
-                            yield f"data: {json.dumps(response_data)}\n\n"
-                            
-                        elif json_data.get('event') == 'message_end':
-                            yield f"data: {json.dumps({'type': 'end'})}\n\n"
-                            
-                    except json.JSONDecodeError:
-                        continue
-    
-    return app.response_class(generate(), mimetype='text/plain')
+    return stream_upstream(response, relay)
+
+@app.route('/api/document/process/<stream_id>')
+def document_stream_snapshot(stream_id):
+    """获取文档处理流（协议v2）的完整内容，用于前端检查点校验失败后重新同步"""
+    relay = document_streams.get(stream_id)
+    if relay is None:
+        return jsonify({'error': '处理记录不存在或已过期'}), 404
+    return jsonify(relay.snapshot())
 
 @app.route('/knowledge')
 def knowledge():
@@ -694,7 +3727,7 @@ def create_dataset():
         if not name:
             return jsonify({'error': '知识库名称不能为空'}), 400
         
-        print(f"创建知识库: name={name}, description={description}")
+        logger.info('创建知识库', extra={'fields': {'name': name, 'description': description}})
         
         result = dify_client.create_dataset(name, description)
         
@@ -705,59 +3738,190 @@ def create_dataset():
         else:
             return jsonify({'error': '创建知识库失败，API返回空结果'}), 500
             
+    except UpstreamBusy:
+        raise
     except Exception as e:
-        print(f"创建知识库异常: {e}")
+        logger.exception('创建知识库接口异常')
         return jsonify({'error': f'服务器错误: {str(e)}'}), 500
 
 @app.route('/api/datasets/<dataset_id>/documents', methods=['POST'])
 def create_document(dataset_id):
     """创建文档API"""
     # 检查是否为文件上传
-    if 'file' in request.files:
-        file = request.files['file']
-        if file.filename == '':
-            return jsonify({'error': '未选择文件'}), 400
-        
-        if file and allowed_file(file.filename):
-            filename = secure_filename(file.filename)
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(filepath)
-            
-            # 通过文件创建文档
-            result = dify_client.create_document_by_file(dataset_id, filepath, filename)
-            
-            # 删除临时文件
-            try:
-                os.remove(filepath)
-            except:
-                pass
-            
-            if result:
-                return jsonify(result)
-            else:
-                return jsonify({'error': '创建文档失败'}), 500
-        else:
-            return jsonify({'error': '不支持的文件类型'}), 400
+    reader = MultipartStreamReader.from_request(request)
+    if reader is not None:
+        try:
+            for name, part in reader.parts():
+                if name != 'file' or not isinstance(part, UploadPart):
+                    continue
+                if not part.filename:
+                    return jsonify({'error': '未选择文件'}), 400
+                if not allowed_file(part.filename):
+                    return jsonify({'error': '不支持的文件类型'}), 400
+                
+                # 通过文件创建文档，数据直接转发到Dify
+                filename = secure_filename(part.filename)
+                result = None
+                try:
+                    result = dify_client.create_document_by_stream(dataset_id, filename, part)
+                finally:
+                    # 请求失败时上游也可能已经处理，一律使检索缓存失效
+                    on_documents_changed(dataset_id, (result or {}).get('batch'), document=created_document(result, filename))
+                
+                if result:
+                    return jsonify(result)
+                else:
+                    return jsonify({'error': '创建文档失败'}), 500
+        except UploadTooLarge:
+            return jsonify({'error': '文件大小不能超过50MB'}), 400
+        except UpstreamBusy:
+            raise
+        except Exception as e:
+            return jsonify({'error': f'文件处理失败: {str(e)}'}), 500
+        
+        return jsonify({'error': '未选择文件'}), 400
     else:
-        # 通过文本创建文档
+        # 通过文本创建文档（text或extract_id二选一）
         data = request.get_json()
         name = data.get('name', '')
         text = data.get('text', '')
         
+        if not text.strip() and data.get('extract_id'):
+            text = text_extractor.text(data['extract_id'])
+            if text is None:
+                return jsonify({'error': '提取结果不存在或已过期，请重新上传文件'}), 404
+        
         if not name.strip() or not text.strip():
             return jsonify({'error': '文档名称和内容不能为空'}), 400
         
-        result = dify_client.create_document_by_text(dataset_id, name, text)
+        result = None
+        try:
+            result = dify_client.create_document_by_text(dataset_id, name, text)
+        finally:
+            on_documents_changed(dataset_id, (result or {}).get('batch'), document=created_document(result, name))
         if result:
             return jsonify(result)
         else:
             return jsonify({'error': '创建文档失败'}), 500
 
+@app.route('/api/datasets/<dataset_id>/documents/bulk', methods=['POST'])
+def bulk_create_documents(dataset_id):
+    """批量导入文档API
+    
+    multipart格式：任意多个文件分段（zip压缩包会展开）；JSON格式：{"documents": [{"name", "text"或"extract_id"}, ...]}。
+    文件边接收边导入，接收完毕后立即返回任务ID，进度通过 /api/ingest/jobs/<job_id> 查询。
+    """
+    job = IngestJob(dify_client, dataset_id, on_document_done=on_documents_changed)
+    ingest_jobs.set(job.id, job)
+    
+    boundary = request.mimetype_params.get('boundary')
+    error = None
+    try:
+        if request.mimetype == 'multipart/form-data' and boundary:
+            # 批量请求体可以超过单文件上限，单个文件的大小仍由解析器限制
+            stream = get_input_stream(request.environ, max_content_length=IngestConfig.MAX_REQUEST_SIZE)
+            for name, part in MultipartStreamReader(stream, boundary).parts():
+                if not isinstance(part, UploadPart):
+                    continue
+                filename = os.path.basename((part.filename or '').replace('\\', '/'))
+                if not filename:
+                    part.drain()
+                elif filename.lower().endswith('.zip'):
+                    job.add_zip(filename, part)
+                elif allowed_file(filename):
+                    job.add_file(filename, part)
+                else:
+                    part.drain()
+                    job.skip(filename, '不支持的文件类型')
+        else:
+            data = request.get_json(silent=True) or {}
+            for item in data.get('documents', []):
+                name = str(item.get('name', '')).strip()
+                text = str(item.get('text', ''))
+                if not text.strip() and item.get('extract_id'):
+                    text = text_extractor.text(item['extract_id']) or ''
+                if name and text.strip():
+                    job.add_text(name, text)
+                else:
+                    job.skip(name, '文档名称和内容不能为空')
+    except UploadTooLarge:
+        error = '单个文件大小不能超过50MB，已接收的文件仍会继续导入'
+    except ValueError as e:
+        error = f'文件处理失败: {str(e)}'
+    finally:
+        job.seal()
+    
+    if error:
+        return jsonify({'error': error, **job.to_dict(False)}), 400
+    if not job.documents:
+        return jsonify({'error': '没有可导入的文档'}), 400
+    return jsonify(job.to_dict(False)), 202
+
+@app.route('/api/ingest/jobs/<job_id>')
+def get_ingest_job(job_id):
+    """查询批量导入任务进度API"""
+    job = ingest_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': '任务不存在或已过期'}), 404
+    return jsonify(job.to_dict(request.args.get('documents', 'true') != 'false'))
+
+@app.route('/api/datasets/<dataset_id>/sync', methods=['POST'])
+def sync_dataset(dataset_id):
+    """目录同步API
+    
+    请求：{"path": 相对SYNC_ROOT的目录, "dry_run": false, "checksum": false}。
+    dry_run时直接返回操作列表；否则在后台同步并立即返回任务ID，进度通过 /api/sync/jobs/<sync_id> 查询。
+    同一知识库与目录同时只能有一个同步任务。
+    """
+    if not SyncConfig.ROOT:
+        return jsonify({'error': '未配置同步根目录（SYNC_ROOT）'}), 403
+    
+    data = request.get_json(silent=True) or {}
+    root = os.path.realpath(SyncConfig.ROOT)
+    directory = os.path.realpath(os.path.join(root, str(data.get('path', '')).lstrip('/\\')))
+    if os.path.commonpath([root, directory]) != root or not os.path.isdir(directory):
+        return jsonify({'error': '同步目录不存在或不在同步根目录下'}), 400
+    
+    job = DatasetSync(dify_client, dataset_id, directory, checksum=bool(data.get('checksum')),
+                      on_documents_changed=on_documents_changed)
+    key = (dataset_id, job.root)
+    with active_syncs_lock:
+        if key in active_syncs:
+            return jsonify({'error': '该目录正在同步中', 'sync_id': active_syncs[key]}), 409
+        active_syncs[key] = job.id
+    
+    def run():
+        try:
+            job.run(dry_run=bool(data.get('dry_run')))
+        finally:
+            with active_syncs_lock:
+                active_syncs.pop(key, None)
+    
+    sync_jobs.set(job.id, job)
+    if data.get('dry_run'):
+        run()
+        return jsonify(job.to_dict())
+    threading.Thread(target=run, name=f'sync-{job.id[:8]}', daemon=True).start()
+    return jsonify(job.to_dict(False)), 202
+
+@app.route('/api/sync/jobs/<sync_id>')
+def get_sync_job(sync_id):
+    """查询目录同步任务进度API"""
+    job = sync_jobs.get(sync_id)
+    if job is None:
+        return jsonify({'error': '任务不存在或已过期'}), 404
+    return jsonify(job.to_dict(request.args.get('actions', 'true') != 'false'))
+
 @app.route('/api/datasets/<dataset_id>', methods=['DELETE'])
 def delete_dataset(dataset_id):
     """删除知识库API"""
-    result = dify_client.delete_dataset(dataset_id)
+    try:
+        result = dify_client.delete_dataset(dataset_id)
+    finally:
+        retrieval_cache.invalidate_dataset(dataset_id)
+        dify_client.forget_dataset_reads(dataset_id)
     if result:
+        segment_mirror.drop(dataset_id)
         return jsonify({'result': 'success'})
     else:
         return jsonify({'error': '删除知识库失败'}), 500
@@ -773,32 +3937,115 @@ def get_documents(dataset_id):
 @app.route('/api/datasets/<dataset_id>/documents/<document_id>', methods=['DELETE'])
 def delete_document(dataset_id, document_id):
     """删除文档API"""
-    result = dify_client.delete_document(dataset_id, document_id)
+    try:
+        result = dify_client.delete_document(dataset_id, document_id)
+    finally:
+        retrieval_cache.invalidate_dataset(dataset_id)
+        dify_client.forget_dataset_reads(dataset_id)
     if result:
+        segment_mirror.remove_document(dataset_id, document_id)
         return jsonify(result)
     else:
         return jsonify({'error': '删除文档失败'}), 500
 
 @app.route('/api/datasets/<dataset_id>/documents/<batch_id>/status', methods=['GET'])
 def get_document_status(dataset_id, batch_id):
-    """获取文档处理状态API"""
-    result = dify_client.get_document_indexing_status(dataset_id, batch_id)
-    return jsonify(result)
+    """获取文档处理状态API（所有查询共享后台跟踪器的轮询结果）"""
+    return jsonify(indexing_tracker.status(dataset_id, batch_id))
+
+@app.route('/api/datasets/<dataset_id>/indexing/events')
+def indexing_events(dataset_id):
+    """知识库索引状态推送（SSE）：先下发当前状态快照，之后推送各batch的状态变化
+    
+    没有进行中的batch或连接超过STREAM_MAX_DURATION时结束，并通过retry字段让EventSource稍后重连，
+    每个打开的页面不会一直占用一个工作线程。重连时的快照包含断开期间的最新状态。
+    """
+    subscription, batches = indexing_tracker.subscribe(dataset_id)
+    
+    def generate():
+        yield sse_frame({'type': 'snapshot', 'dataset_id': dataset_id, 'batches': batches})
+        deadline = time.monotonic() + IndexingConfig.STREAM_MAX_DURATION
+        active = indexing_tracker.has_active(dataset_id)
+        while active:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                event = subscription.get(timeout=min(IndexingConfig.HEARTBEAT_INTERVAL, remaining))
+            except queue.Empty:
+                yield b': ping\n\n'
+                continue
+            yield sse_frame(event)
+            active = indexing_tracker.has_active(dataset_id)
+        
+        while True:
+            try:
+                yield sse_frame(subscription.get_nowait())
+            except queue.Empty:
+                break
+        retry = IndexingConfig.ACTIVE_RETRY if active else IndexingConfig.IDLE_RETRY
+        yield f'retry: {int(retry * 1000)}\n\n'.encode('ascii')
+    
+    response = app.response_class(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.call_on_close(functools.partial(indexing_tracker.unsubscribe, dataset_id, subscription))
+    return response
 
 @app.route('/api/datasets/<dataset_id>/retrieve', methods=['POST'])
 def retrieve_dataset(dataset_id):
-    """检索知识库API"""
+    """检索知识库API
+    
+    关键词检索优先使用本地索引（KeywordIndexConfig.ENABLED），其余检索方式或本地索引未就绪时请求Dify。
+    """
     data = request.get_json()
     query = data.get('query', '')
     top_k = data.get('top_k', 3)
     score_threshold = data.get('score_threshold', 0.5)
+    search_method = data.get('search_method', 'keyword_search')
     
     if not query.strip():
         return jsonify({'error': '查询内容不能为空'}), 400
+    if search_method not in SEARCH_METHODS:
+        return jsonify({'error': '不支持的检索方式'}), 400
     
-    result = dify_client.retrieve_dataset(dataset_id, query, top_k, score_threshold)
+    try:
+        result = search_dataset(dataset_id, query, top_k, score_threshold, search_method)
+    except UpstreamBusy:
+        raise
+    except Exception as e:
+        result = {"records": []}
     return jsonify(result)
 
+@app.route('/api/datasets/retrieve', methods=['POST'])
+def retrieve_datasets():
+    """联合检索API
+    
+    请求：{"dataset_ids": [...], "query", "top_k", "score_threshold", "search_method", "budget": 秒}。
+    返回合并后的records（每条附带dataset_id），datasets中为各知识库的状态，有知识库超时或失败时partial为true。
+    """
+    data = request.get_json(silent=True) or {}
+    query = data.get('query', '')
+    top_k = data.get('top_k', 3)
+    score_threshold = data.get('score_threshold', 0.5)
+    search_method = data.get('search_method', 'keyword_search')
+    dataset_ids = list(dict.fromkeys(str(dataset_id) for dataset_id in data.get('dataset_ids') or [] if dataset_id))
+    
+    if not query.strip():
+        return jsonify({'error': '查询内容不能为空'}), 400
+    if not dataset_ids:
+        return jsonify({'error': '请选择要检索的知识库'}), 400
+    if len(dataset_ids) > FederatedRetrievalConfig.MAX_DATASETS:
+        return jsonify({'error': f'单次最多检索{FederatedRetrievalConfig.MAX_DATASETS}个知识库'}), 400
+    if search_method not in SEARCH_METHODS:
+        return jsonify({'error': '不支持的检索方式'}), 400
+    try:
+        budget = min(float(data.get('budget') or FederatedRetrievalConfig.BUDGET), FederatedRetrievalConfig.MAX_BUDGET)
+    except (TypeError, ValueError):
+        return jsonify({'error': '延迟预算格式错误'}), 400
+    
+    return jsonify(federated_retrieve(dataset_ids, query, top_k, score_threshold, search_method, budget))
+
 @app.route('/api/chat/stop', methods=['POST'])
 def stop_chat():
     """停止聊天回答"""
@@ -809,8 +4056,7 @@ def stop_chat():
         if not task_id:
             return jsonify({"error": "缺少task_id参数"}), 400
         
-        client = DifyAPIClient()
-        result = client.stop_chat_message(task_id)
+        result = dify_client.stop_chat_message(task_id)
         
         if "error" in result:
             return jsonify({"error": result["error"]}), 500
@@ -820,15 +4066,46 @@ def stop_chat():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus指标"""
+    return app.response_class(metrics.REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/cache/stats')
+def cache_stats():
+    """服务端缓存统计API"""
+    return jsonify({
+        'uploads': dify_client.upload_cache.stats(),
+        'history': history_cache.stats(),
+        'retrieval': retrieval_cache.stats(),
+        'completions': result_cache.stats(),
+        'extracted_text': text_extractor.stats(),
+        'keyword_index': segment_mirror.stats()
+    })
+
 @app.route('/api/health')
 def health_check():
     """健康检查API"""
     return jsonify({
         'status': 'healthy',
         'timestamp': datetime.now().isoformat(),
-        'version': '1.0.0'
+        'version': '1.0.0',
+        'http_pool': dify_client.pool_stats(),
+        'admission': dify_client.admission.stats(),
+        'upstreams': dify_client.upstreams.stats(),
+        'coalescing': dify_client.single_flight.stats(),
+        'indexing': indexing_tracker.stats()
     })
 
+@app.errorhandler(UpstreamBusy)
+def upstream_busy(error):
+    """上游并发已满，快速失败并提示客户端稍后重试"""
+    metrics.ERRORS.inc(type='UpstreamBusy')
+    response = jsonify({'error': str(error)})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
 @app.errorhandler(404)
 def not_found(error):
     return render_template('404.html'), 404
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Dify智能助手Web应用 日志
+请求线程只负责把日志记录放入队列，格式化、脱敏、截断和写出都在后台线程完成
+"""
+
+import atexit
+import json
+import logging
+import queue
+import re
+import sys
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
+
+import metrics
+from config import LogConfig
+
+LOGGER_NAME = 'dify_web'
+REDACTED = '***'
+
+LOG_DROPPED = metrics.REGISTRY.counter('dify_web_log_records_dropped_total', '日志队列已满而丢弃的记录数')
+
+# 文本中可能出现的密钥：Bearer令牌以及Dify的app-/dataset-密钥
+SECRET_PATTERNS = (
+    (re.compile(r'(Bearer\s+)\S+', re.IGNORECASE), r'\1' + REDACTED),
+    (re.compile(r'\b(app|dataset)-[A-Za-z0-9]{8,}'), r'\1-' + REDACTED),
+)
+
+_listener = None
+
+def truncate(text, limit=None):
+    """截断过长的文本"""
+    limit = limit or LogConfig.MAX_FIELD_LENGTH
+    if len(text) <= limit:
+        return text
+    return f'{text[:limit]}...(已截断，共{len(text)}字符)'
+
+def redact_text(text):
+    for pattern, replacement in SECRET_PATTERNS:
+        text = pattern.sub(replacement, text)
+    return text
+
+def is_secret_key(key):
+    """字段名是否为密钥类字段（按完整名称匹配，见LogConfig.REDACT_KEYS）"""
+    name = str(key).lower().replace('-', '_')
+    return any(name == word or name.endswith('_' + word) for word in LogConfig.REDACT_KEYS)
+
+def sanitize(value, key=None, depth=0):
+    """递归脱敏并截断日志字段"""
+    if key is not None and is_secret_key(key):
+        return REDACTED
+    if depth > 5:
+        return truncate(str(value), 200)
+    if isinstance(value, dict):
+        return {k: sanitize(v, k, depth + 1) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        items = [sanitize(item, None, depth + 1) for item in value[:LogConfig.MAX_LIST_ITEMS]]
+        if len(value) > LogConfig.MAX_LIST_ITEMS:
+            items.append(f'...(共{len(value)}项)')
+        return items
+    if isinstance(value, bytes):
+        value = value[:LogConfig.MAX_FIELD_LENGTH * 4].decode('utf-8', 'replace')
+    if isinstance(value, str):
+        return truncate(redact_text(value))
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    return truncate(redact_text(str(value)))
+
+class JSONFormatter(logging.Formatter):
+    """每条记录输出一行JSON，附加字段通过 extra={'fields': {...}} 传入"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'event': redact_text(record.getMessage()),
+            'thread': record.threadName
+        }
+        fields = getattr(record, 'fields', None)
+        if fields:
+            entry.update(sanitize(fields))
+        if record.exc_info:
+            entry['exc'] = truncate(redact_text(self.formatException(record.exc_info)))
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class NonBlockingQueueHandler(QueueHandler):
+    """只负责入队：不在调用线程格式化记录，队列已满时丢弃并计数"""
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_DROPPED.inc()
+
+def setup_logging():
+    """初始化日志队列与后台写出线程，重复调用无副作用"""
+    global _listener
+    if _listener is not None:
+        return
+
+    formatter = JSONFormatter()
+    handlers = []
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(formatter)
+    handlers.append(stream_handler)
+    if LogConfig.FILE:
+        file_handler = logging.FileHandler(LogConfig.FILE, encoding='utf-8')
+        file_handler.setFormatter(formatter)
+        handlers.append(file_handler)
+
+    log_queue = queue.Queue(LogConfig.QUEUE_SIZE)
+    logger = logging.getLogger(LOGGER_NAME)
+    logger.setLevel(LogConfig.LEVEL.upper())
+    logger.addHandler(NonBlockingQueueHandler(log_queue))
+    logger.propagate = False
+
+    _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+def shutdown_logging():
+    """写出队列中剩余的日志并停止后台线程"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+def get_logger(name):
+    return logging.getLogger(f'{LOGGER_NAME}.{name}')
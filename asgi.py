@@ -0,0 +1,370 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Dify智能助手Web应用 ASGI入口
+/api/chat/send 与 /api/document/process 的流式转发在事件循环中完成，
+一个进程即可同时保持大量打开的流；其余路由仍交给Flask处理。
+
+启动方式:
+    uvicorn asgi:application --host 0.0.0.0 --port 8080
+"""
+
+import asyncio
+import contextlib
+import contextvars
+import functools
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+
+from app import app as flask_app, CachedCompletion, DifyAPIClient, StreamAffinity, UpstreamBusy, build_document_inputs, cancel_generation, create_chat_relay, create_document_relay, dify_client, history_cache, logger, result_cache, sse_frame
+from config import AppConfig, DifyAPIConfig, DocumentConfig, HTTPPoolConfig
+import metrics
+
+class AsyncDifyClient:
+    """基于httpx的异步Dify客户端，只负责流式接口"""
+
+    def __init__(self):
+        self._client = None
+
+    @property
+    def client(self):
+        # 延迟创建，确保AsyncClient绑定在服务器的事件循环上
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(DifyAPIConfig.TIMEOUT),
+                limits=httpx.Limits(
+                    max_connections=HTTPPoolConfig.ASYNC_MAX_CONNECTIONS,
+                    max_keepalive_connections=HTTPPoolConfig.POOL_MAXSIZE
+                ),
+                transport=httpx.AsyncHTTPTransport(retries=HTTPPoolConfig.MAX_RETRIES)
+            )
+        return self._client
+
+    async def _stream(self, endpoint_key, payload, affinity=None):
+        """发送流式请求，与同步客户端共用准入控制、上游节点的选择、计数与健康状态
+
+        准入名额已满时抛出UpstreamBusy；凭证与节点租约在响应关闭时一并释放。
+        """
+        ticket = await dify_client.admission.acquire_async(DifyAPIClient.ENDPOINT_CLASSES.get(endpoint_key, 'dataset'))
+        lease = dify_client.upstreams.acquire(affinity)
+        url = lease.node.rebase(DifyAPIConfig.get_full_url(endpoint_key))
+        request = self.client.build_request('POST', url, headers=DifyAPIConfig.get_chat_headers(), json=payload)
+        start = time.perf_counter()
+        try:
+            response = await self.client.send(request, stream=True)
+        except asyncio.CancelledError:
+            lease.release()
+            ticket.release()
+            raise
+        except Exception as e:
+            lease.release(ok=False)
+            ticket.release()
+            metrics.UPSTREAM_REQUESTS.inc(endpoint=endpoint_key, status='error')
+            metrics.ERRORS.inc(type=type(e).__name__)
+            logger.warning('上游请求异常', extra={'fields': {'endpoint': endpoint_key, 'method': 'POST', 'url': url, 'error': repr(e)}})
+            return None
+        finally:
+            metrics.UPSTREAM_LATENCY.observe(time.perf_counter() - start, endpoint=endpoint_key)
+        metrics.UPSTREAM_REQUESTS.inc(endpoint=endpoint_key, status=response.status_code)
+
+        if response.status_code >= 400:
+            lease.release(ok=response.status_code < 500)
+            ticket.release()
+            await response.aclose()
+            return None
+
+        aclose = response.aclose
+
+        async def aclose_and_release():
+            try:
+                await aclose()
+            finally:
+                lease.release()
+                ticket.release()
+
+        response.aclose = aclose_and_release
+        response.upstream = lease.node
+        return response
+
+    async def chat_message(self, query, conversation_id="", files=None, inputs=None):
+        """发送流式聊天消息"""
+        payload = DifyAPIClient.build_chat_payload(query, conversation_id, files=files, inputs=inputs)
+        return await self._stream('chat_messages', payload, affinity=conversation_id or None)
+
+    async def completion_message(self, inputs):
+        """发送流式文本生成请求"""
+        payload = DifyAPIClient.build_completion_payload(inputs)
+        return await self._stream('completion_messages', payload)
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+def in_background(callback):
+    """把同步回调包装为提交到线程池执行，用于在事件循环中触发的relay回调"""
+    loop = asyncio.get_running_loop()
+
+    def submit(*args):
+        loop.run_in_executor(None, callback, *args)
+
+    return submit
+
+async def aiter_sse_lines(response):
+    """按行读取上游字节流，与requests的iter_lines保持一致（返回bytes）"""
+    pending = b''
+    async for chunk in response.aiter_bytes():
+        pending += chunk
+        lines = pending.split(b'\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line.rstrip(b'\r')
+    if pending:
+        yield pending.rstrip(b'\r')
+
+async def read_body(receive, limit):
+    """读取请求体，超过limit时返回None"""
+    body = b''
+    more_body = True
+    while more_body:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        body += message.get('body', b'')
+        if len(body) > limit:
+            return None
+        more_body = message.get('more_body', False)
+    return body
+
+async def wait_disconnect(receive):
+    """请求体读取完毕后，等待客户端断开"""
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+def replay_body(body, receive):
+    """把已读取的请求体重新交给其他ASGI应用，之后的消息仍从原receive读取"""
+    sent = False
+    
+    async def replay():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+        return await receive()
+    
+    return replay
+
+def replay_scope(scope, body):
+    """已读取完的请求体转交其他ASGI应用时，按实际长度设置content-length
+
+    分块传输（没有content-length）的请求体在WSGI中无法读取。
+    """
+    headers = [(name, value) for name, value in scope.get('headers', []) if name not in (b'content-length', b'transfer-encoding')]
+    headers.append((b'content-length', str(len(body)).encode('ascii')))
+    return dict(scope, headers=headers)
+
+async def send_json(send, data, status=200, headers=()):
+    body = json.dumps(data).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(body)).encode('ascii')),
+            *headers
+        ]
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+class ThreadPoolWsgiInstance(WsgiToAsgiInstance):
+    """在线程池中运行Flask的WsgiToAsgiInstance
+
+    asgiref默认以thread_sensitive方式运行WSGI应用，所有请求在同一个线程中依次处理，
+    一个长时间的请求（SSE推送、文本提取）会阻塞其余全部路由；这里改为在独立线程池中并发运行。
+    """
+
+    executor = ThreadPoolExecutor(max_workers=AppConfig.ASGI_WSGI_THREADS, thread_name_prefix='asgi-wsgi')
+    run_wsgi_app = sync_to_async(WsgiToAsgiInstance.__dict__['run_wsgi_app'].func, thread_sensitive=False, executor=executor)
+
+class ThreadPoolWsgiToAsgi(WsgiToAsgi):
+    async def __call__(self, scope, receive, send):
+        await ThreadPoolWsgiInstance(self.wsgi_application)(scope, receive, send)
+
+class StreamingApplication:
+    """ASGI应用：JSON格式的流式路由走异步转发，其余请求转交Flask
+
+    路由的请求与响应格式与app.py中的同名路由完全一致，前端模板无需改动。
+    multipart格式的/api/chat/send（移动端附件）依赖文件上传，仍由Flask处理。
+    """
+
+    def __init__(self, wsgi_app):
+        self.wsgi = ThreadPoolWsgiToAsgi(wsgi_app)
+        self.dify = AsyncDifyClient()
+        self.routes = {
+            '/api/chat/send': self.send_message,
+            '/api/document/process': self.process_document
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+
+        handler = self.routes.get(scope.get('path')) if scope['type'] == 'http' else None
+        if handler is None or scope['method'] != 'POST' or not self._is_json(scope):
+            await self._call_wsgi(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        body = await read_body(receive, AppConfig.MAX_CONTENT_LENGTH)
+        if body is None:
+            await send_json(send, {'error': '请求体过大或连接已断开'}, 413)
+            return
+        try:
+            data = json.loads(body or b'{}')
+        except ValueError:
+            await send_json(send, {'error': '请求数据格式错误'}, 400)
+            return
+        if scope['path'] == '/api/document/process' and self._is_long_document(data):
+            await self._call_wsgi(replay_scope(scope, body), replay_body(body, receive), send)
+            return
+        try:
+            await handler(scope['path'], data, receive, send, start)
+        except UpstreamBusy as e:
+            # 与Flask的UpstreamBusy错误处理一致：503 + Retry-After
+            metrics.ERRORS.inc(type='UpstreamBusy')
+            await send_json(send, {'error': str(e)}, 503, [(b'retry-after', str(e.retry_after).encode('ascii'))])
+
+    async def _call_wsgi(self, scope, receive, send):
+        """在全新的上下文中转交Flask
+
+        asgiref会把WSGI线程中修改过的上下文变量复制回调用方，
+        服务器为同一keep-alive连接的下一个请求创建任务时又会复制该上下文，隔离后各请求互不影响。
+        """
+        await contextvars.Context().run(asyncio.ensure_future, self.wsgi(scope, receive, send))
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.dify.aclose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    @staticmethod
+    def _is_json(scope):
+        for name, value in scope.get('headers', []):
+            if name == b'content-type':
+                return b'multipart/form-data' not in value
+        return True
+
+    @staticmethod
+    def _is_long_document(data):
+        """交给Flask中的分块流水线（线程池并发处理各分块）的文档
+
+        按字符数判断，与Flask路由一致；内容需要从提取结果缓存中读取（extract_id）时长度未知，也交给Flask。
+        """
+        content = data.get('content', '')
+        if not isinstance(content, str) or (not content.strip() and data.get('extract_id')):
+            return True
+        return len(content) > DocumentConfig.CHUNK_THRESHOLD
+
+    async def send_message(self, route, data, receive, send, start):
+        """发送聊天消息（JSON格式）"""
+        query = data.get('query', '')
+        conversation_id = data.get('conversation_id', '')
+        files = data.get('files', None)
+        inputs = data.get('inputs', {})
+
+        if not query.strip() and not files and not inputs:
+            await send_json(send, {'error': '消息不能为空'}, 400)
+            return
+
+        response = await self.dify.chat_message(query, conversation_id, files=files, inputs=inputs)
+        await self._relay(send, receive, response, create_chat_relay(conversation_id, on_end=history_cache.invalidate_conversation),
+                          metrics.StreamMeter(route, start), stop=dify_client.stop_chat_message)
+
+    async def process_document(self, route, data, receive, send, start):
+        """处理文档"""
+        task_type = data.get('type', 'translate')
+        content = data.get('content', '')
+        language = data.get('language', 'zh')
+
+        if not content.strip():
+            await send_json(send, {'error': '内容不能为空'}, 400)
+            return
+
+        inputs = build_document_inputs(task_type, content, language)
+        if inputs is None:
+            await send_json(send, {'error': '不支持的处理类型'}, 400)
+            return
+
+        # 相同内容的处理结果直接从缓存回放；SQLite的读写在线程池中进行，磁盘慢或锁竞争时不阻塞事件循环
+        cache_key = result_cache.make_key(task_type, language, content)
+        cached = await asyncio.to_thread(result_cache.get, cache_key)
+        if cached is not None:
+            await self._relay(send, receive, CachedCompletion(cached), create_document_relay(data.get('protocol')), metrics.StreamMeter(route, start))
+            return
+
+        relay = create_document_relay(data.get('protocol'), on_end=in_background(functools.partial(result_cache.set, cache_key)))
+        response = await self.dify.completion_message(inputs)
+        await self._relay(send, receive, response, relay, metrics.StreamMeter(route, start))
+
+    async def _relay(self, send, receive, response, relay, meter, stop=None):
+        """将上游SSE流逐帧转发给客户端
+
+        服务器在客户端断开后会静默丢弃写入，因此同时监听http.disconnect：
+        客户端先断开时取消转发并关闭上游连接，再以relay捕获的task_id在后台调用stop停止生成。
+        """
+        try:
+            await send({
+                'type': 'http.response.start',
+                'status': 200,
+                'headers': [(b'content-type', b'text/plain; charset=utf-8')]
+            })
+
+            if response is None:
+                await send({'type': 'http.response.body', 'body': sse_frame({'error': 'API请求失败'})})
+                return
+
+            forward = asyncio.ensure_future(self._forward(send, response, relay, meter))
+            disconnect = asyncio.ensure_future(wait_disconnect(receive))
+            try:
+                await asyncio.wait((forward, disconnect), return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                disconnect.cancel()
+                if not forward.done():
+                    forward.cancel()
+                    with contextlib.suppress(asyncio.CancelledError):
+                        await forward
+                    meter.abort()
+                    cancel_generation(stop, getattr(relay, 'task_id', None))
+            if not forward.cancelled():
+                forward.result()
+                await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            meter.finish()
+
+    @staticmethod
+    async def _forward(send, response, relay, meter):
+        affinity = StreamAffinity(dify_client.upstreams, getattr(response, 'upstream', None))
+        try:
+            async for line in aiter_sse_lines(response):
+                frame = relay.feed(line)
+                if frame:
+                    meter.frame()
+                    affinity.observe(relay)
+                    await send({'type': 'http.response.body', 'body': frame, 'more_body': True})
+        finally:
+            await response.aclose()
+
+application = StreamingApplication(flask_app)
@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+端到端压测
+被测应用在独立进程中运行（Dify替身服务在压测进程的后台线程中运行，也可用--dify-url指定单独启动的替身服务），
+以N个并发客户端压测聊天、上传、文档处理和知识库路由，
+输出吞吐、p50/p95/p99延迟、首帧耗时（TTFT）以及每个打开的流占用的内存；
+可保存为JSON并与基线对比，超出容差时以非零状态退出。
+
+用法:
+    python benchmarks/load_test.py --clients 50 --duration 20
+    python benchmarks/load_test.py --scenarios chat,document --server uvicorn --token-rate 20 --tokens 200
+    python benchmarks/load_test.py --target http://127.0.0.1:8080 --server-pid 1234
+    python benchmarks/load_test.py --json current.json --baseline baseline.json --tolerance 0.2
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import socket
+import string
+import subprocess
+import sys
+import threading
+import time
+
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import mock_dify
+
+SCENARIOS = ('chat', 'upload', 'document', 'datasets')
+STREAMING = ('chat', 'document')
+
+# 与基线对比的指标：(名称, 变大是否为退化)
+COMPARED = (('throughput', False), ('latency_p95', True), ('ttft_p95', True), ('kb_per_stream', True))
+
+class Sample:
+    __slots__ = ('latency', 'ttft', 'ok', 'status')
+
+    def __init__(self, latency, ttft, ok, status):
+        self.latency = latency
+        self.ttft = ttft
+        self.ok = ok
+        self.status = status
+
+class OpenStreams:
+    """客户端当前打开的流数，以及压测期间的峰值"""
+
+    def __init__(self):
+        self.current = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        with self._lock:
+            self.current += 1
+            self.peak = max(self.peak, self.current)
+
+    def __exit__(self, *exc):
+        with self._lock:
+            self.current -= 1
+
+def random_text(length):
+    return ''.join(random.choices(string.ascii_letters + ' ', k=length))
+
+def read_stream(response, start):
+    """读取流式响应，返回 (首帧耗时, 是否出现错误帧)"""
+    ttft = None
+    failed = False
+    for chunk in response.iter_content(chunk_size=None):
+        if ttft is None and b'data: ' in chunk:
+            ttft = time.perf_counter() - start
+        if b'"error"' in chunk:
+            failed = True
+    return ttft, failed
+
+def run_chat(session, base_url, args, streams):
+    start = time.perf_counter()
+    with streams, session.post(f'{base_url}/api/chat/send', json={'query': random_text(40)}, stream=True, timeout=args.timeout) as response:
+        ttft, failed = read_stream(response, start) if response.ok else (None, True)
+    return Sample(time.perf_counter() - start, ttft, response.ok and not failed, response.status_code)
+
+def run_document(session, base_url, args, streams):
+    # 每次内容不同，避免命中结果缓存
+    payload = {'type': 'summary', 'content': random_text(args.document_chars), 'language': '中文', 'protocol': 2}
+    start = time.perf_counter()
+    with streams, session.post(f'{base_url}/api/document/process', json=payload, stream=True, timeout=args.timeout) as response:
+        ttft, failed = read_stream(response, start) if response.ok else (None, True)
+    return Sample(time.perf_counter() - start, ttft, response.ok and not failed, response.status_code)
+
+def run_upload(session, base_url, args, streams):
+    data = os.urandom(args.upload_bytes)
+    start = time.perf_counter()
+    response = session.post(f'{base_url}/api/upload', files={'file': ('bench.txt', data, 'text/plain')}, timeout=args.timeout)
+    return Sample(time.perf_counter() - start, None, response.ok, response.status_code)
+
+def run_datasets(session, base_url, args, streams):
+    """依次请求知识库列表、文档列表和检索，按一次请求计"""
+    start = time.perf_counter()
+    responses = [
+        session.get(f'{base_url}/api/datasets', timeout=args.timeout),
+        session.get(f'{base_url}/api/datasets/ds0/documents', timeout=args.timeout),
+        session.post(f'{base_url}/api/datasets/ds0/retrieve', json={'query': random_text(12)}, timeout=args.timeout)
+    ]
+    failed = next((response for response in responses if not response.ok), None)
+    return Sample(time.perf_counter() - start, None, failed is None, (failed or responses[-1]).status_code)
+
+RUNNERS = {'chat': run_chat, 'upload': run_upload, 'document': run_document, 'datasets': run_datasets}
+
+def read_rss(pid):
+    """读取进程常驻内存（KB），非Linux系统返回None"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+def run_scenario(name, base_url, args, server_pid):
+    """以args.clients个并发客户端执行一个场景args.duration秒"""
+    runner = RUNNERS[name]
+    streams = OpenStreams()
+    samples = []
+    samples_lock = threading.Lock()
+    stop_at = time.perf_counter() + args.duration
+
+    def client():
+        session = requests.Session()
+        local = []
+        while time.perf_counter() < stop_at:
+            try:
+                local.append(runner(session, base_url, args, streams))
+            except requests.RequestException:
+                local.append(Sample(args.timeout, None, False, 0))
+        session.close()
+        with samples_lock:
+            samples.extend(local)
+
+    # 预热一次，并记录空闲时的内存
+    try:
+        runner(requests.Session(), base_url, args, OpenStreams())
+    except requests.RequestException:
+        pass
+    baseline_rss = read_rss(server_pid) if server_pid else None
+    peak = {'rss': baseline_rss, 'streams': 0}
+
+    def sample_memory():
+        while time.perf_counter() < stop_at:
+            rss = read_rss(server_pid)
+            if rss is not None and streams.current >= peak['streams']:
+                peak['rss'], peak['streams'] = rss, streams.current
+            time.sleep(0.1)
+
+    threads = [threading.Thread(target=client, daemon=True) for _ in range(args.clients)]
+    if server_pid:
+        threads.append(threading.Thread(target=sample_memory, daemon=True))
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    ok = [sample for sample in samples if sample.ok]
+    latencies = [sample.latency * 1000 for sample in ok]
+    ttfts = [sample.ttft * 1000 for sample in ok if sample.ttft is not None]
+    statuses = {}
+    for sample in samples:
+        statuses[str(sample.status)] = statuses.get(str(sample.status), 0) + 1
+
+    result = {
+        'requests': len(samples),
+        'errors': len(samples) - len(ok),
+        'statuses': statuses,
+        'throughput': round(len(ok) / elapsed, 2) if elapsed else 0,
+        'latency_p50': percentile(latencies, 50),
+        'latency_p95': percentile(latencies, 95),
+        'latency_p99': percentile(latencies, 99),
+        'ttft_p50': percentile(ttfts, 50),
+        'ttft_p95': percentile(ttfts, 95),
+        'ttft_p99': percentile(ttfts, 99),
+        'rss_baseline_kb': baseline_rss,
+        'rss_peak_kb': peak['rss'],
+        'peak_open_streams': streams.peak if name in STREAMING else None,
+        'kb_per_stream': None
+    }
+    if name in STREAMING and baseline_rss and peak['streams']:
+        result['kb_per_stream'] = round((peak['rss'] - baseline_rss) / peak['streams'], 1)
+    return result
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def start_app(args, dify_url):
+    """在独立进程中启动被测应用，返回 (进程, 地址)"""
+    port = free_port()
+    env = dict(os.environ, DIFY_API_BASE=dify_url, LOG_LEVEL=os.environ.get('LOG_LEVEL', 'WARNING'))
+    if args.server == 'uvicorn':
+        command = [sys.executable, '-m', 'uvicorn', 'asgi:application', '--host', '127.0.0.1', '--port', str(port),
+                   '--log-level', 'warning', '--no-access-log']
+    else:
+        command = [sys.executable, '-c',
+                   'from werkzeug.serving import make_server; from app import app; '
+                   f'make_server("127.0.0.1", {port}, app, threaded=True).serve_forever()']
+    process = subprocess.Popen(command, cwd=ROOT_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f'http://127.0.0.1:{port}'
+
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'被测应用启动失败（退出码 {process.returncode}）')
+        try:
+            if requests.get(f'{base_url}/api/health', timeout=1).ok:
+                return process, base_url
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError('被测应用启动超时')
+
+def format_ms(value):
+    return '-' if value is None else f'{value:.1f}'
+
+def print_report(results):
+    header = f"{'场景':<10}{'请求':>8}{'错误':>7}{'吞吐/s':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'TTFT50':>9}{'TTFT95':>9}{'TTFT99':>9}{'KB/流':>9}"
+    print(header)
+    print('-' * 96)
+    for name, result in results.items():
+        per_stream = '-' if result['kb_per_stream'] is None else f"{result['kb_per_stream']:.1f}"
+        print(f"{name:<10}{result['requests']:>8}{result['errors']:>7}{result['throughput']:>9.1f}"
+              f"{format_ms(result['latency_p50']):>9}{format_ms(result['latency_p95']):>9}{format_ms(result['latency_p99']):>9}"
+              f"{format_ms(result['ttft_p50']):>9}{format_ms(result['ttft_p95']):>9}{format_ms(result['ttft_p99']):>9}{per_stream:>9}")
+    print("延迟单位为毫秒；KB/流 = (压测中内存峰值 - 空闲内存) / 同时打开的流数")
+
+def compare(results, baseline, tolerance):
+    """与基线对比，返回退化项列表"""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get('results', {}).get(name)
+        if not base:
+            continue
+        for metric, higher_is_worse in COMPARED:
+            current, previous = result.get(metric), base.get(metric)
+            if not current or not previous:
+                continue
+            change = (current - previous) / previous
+            if (change > tolerance) if higher_is_worse else (change < -tolerance):
+                regressions.append(f'{name}.{metric}: {previous} -> {current} ({change:+.0%})')
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='端到端压测（内置Dify替身服务）')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help=f'逗号分隔，可选 {",".join(SCENARIOS)}')
+    parser.add_argument('--clients', type=int, default=20, help='并发客户端数')
+    parser.add_argument('--duration', type=float, default=10, help='每个场景的持续时间（秒）')
+    parser.add_argument('--timeout', type=float, default=60, help='单个请求的超时（秒）')
+    parser.add_argument('--upload-bytes', type=int, default=64 * 1024, help='上传场景的文件大小')
+    parser.add_argument('--document-chars', type=int, default=2000, help='文档处理场景的内容长度')
+    parser.add_argument('--server', choices=('werkzeug', 'uvicorn'), default='werkzeug', help='被测应用的运行方式')
+    parser.add_argument('--target', help='压测已启动的应用（不再启动替身服务和应用）')
+    parser.add_argument('--server-pid', type=int, help='配合--target，用于统计内存的应用进程ID')
+    parser.add_argument('--dify-url', help='使用已启动的Dify替身服务或测试环境')
+    parser.add_argument('--json', help='把结果保存为JSON')
+    parser.add_argument('--baseline', help='与之对比的基线JSON')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='允许的退化比例')
+    mock_dify.add_arguments(parser)
+    args = parser.parse_args()
+
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = [name for name in scenarios if name not in RUNNERS]
+    if unknown:
+        parser.error(f'未知场景: {", ".join(unknown)}')
+
+    mock_server = app_process = None
+    try:
+        if args.target:
+            base_url, server_pid = args.target.rstrip('/'), args.server_pid
+        else:
+            dify_url = args.dify_url
+            if not dify_url:
+                mock_server, dify_url = mock_dify.start_server(mock_dify.options_from_args(args))
+            app_process, base_url = start_app(args, dify_url)
+            server_pid = app_process.pid
+
+        print(f"🎯 {base_url}  客户端 {args.clients}  每场景 {args.duration}s  "
+              f"token {args.tokens}帧@{args.token_rate}/s  首字节 {args.latency}s  失败率 {args.failure_rate}")
+        results = {}
+        for name in scenarios:
+            print(f"▶ {name} ...", flush=True)
+            results[name] = run_scenario(name, base_url, args, server_pid)
+    finally:
+        if app_process is not None:
+            app_process.terminate()
+            app_process.wait(timeout=10)
+        if mock_server is not None:
+            mock_server.shutdown()
+
+    print()
+    print_report(results)
+
+    report = {'created_at': time.time(), 'config': vars(args), 'results': results}
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"\n❌ 相对基线退化超过{args.tolerance:.0%}:")
+            for line in regressions:
+                print(f"   {line}")
+            return 1
+        print(f"\n✅ 与基线相比无超过{args.tolerance:.0%}的退化")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
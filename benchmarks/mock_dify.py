@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+压测用的本地Dify替身服务
+按可配置的token速率、首字节延迟和失败率返回与Dify格式一致的SSE流，以及上传、知识库等接口的固定响应
+
+用法:
+    python benchmarks/mock_dify.py --port 18080 --token-rate 50 --tokens 200 --latency 0.3 --failure-rate 0.01
+    DIFY_API_BASE=http://127.0.0.1:18080/v1 python run.py
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+class MockOptions:
+    """替身服务的行为参数"""
+
+    def __init__(self, token_rate=50.0, tokens=100, latency=0.2, jitter=0.1, failure_rate=0.0, stream_failure_rate=0.0,
+                 metadata_bytes=256, request_latency=0.02):
+        self.token_rate = token_rate  # 每秒token帧数，0为不限速
+        self.tokens = tokens  # 每个流式响应的token帧数
+        self.latency = latency  # 流式响应的首字节延迟（秒）
+        self.jitter = jitter  # 延迟的随机抖动比例
+        self.failure_rate = failure_rate  # 返回500的请求比例
+        self.stream_failure_rate = stream_failure_rate  # 流中途发送error事件并结束的比例
+        self.metadata_bytes = metadata_bytes  # 每帧附带的元数据大小，模拟真实帧体积
+        self.request_latency = request_latency  # 非流式接口的响应延迟（秒）
+
+    def delay(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+class MockDifyHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    options = MockOptions()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_body(self):
+        if self.headers.get('Transfer-Encoding') == 'chunked':
+            body = b''
+            while True:
+                size = int(self.rfile.readline().strip(), 16)
+                if size == 0:
+                    self.rfile.readline()
+                    return body
+                body += self.rfile.read(size)
+                self.rfile.readline()
+        return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+    def _send_json(self, data, status=200):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _fail(self):
+        if random.random() < self.options.failure_rate:
+            self._send_json({'code': 'internal_server_error', 'message': 'mock failure'}, 500)
+            return True
+        return False
+
+    def _stream(self, conversation_id):
+        options = self.options
+        options.delay(options.latency)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        def write(data):
+            payload = b'data: ' + json.dumps(data, ensure_ascii=False).encode('utf-8') + b'\n\n'
+            self.wfile.write(b'%x\r\n%s\r\n' % (len(payload), payload))
+            self.wfile.flush()
+
+        task_id, message_id = str(uuid.uuid4()), str(uuid.uuid4())
+        base = {'task_id': task_id, 'id': message_id, 'message_id': message_id, 'conversation_id': conversation_id, 'created_at': int(time.time())}
+        padding = 'x' * options.metadata_bytes
+        fail_at = random.randrange(options.tokens) if random.random() < options.stream_failure_rate else None
+        interval = 1.0 / options.token_rate if options.token_rate else 0
+        try:
+            for i in range(options.tokens):
+                if i == fail_at:
+                    write(dict(base, event='error', status=500, code='mock_error', message='mock stream failure'))
+                    break
+                write(dict(base, event='message', answer=f'词{i} ', metadata={'padding': padding}))
+                if interval:
+                    time.sleep(interval)
+            else:
+                write(dict(base, event='message_end', metadata={'usage': {'total_tokens': options.tokens}}))
+            self.wfile.write(b'0\r\n\r\n')
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端（被测应用）提前关闭了上游连接
+            pass
+
+    def do_POST(self):
+        body = self._read_body()
+        path = urlparse(self.path).path
+        if self._fail():
+            return
+
+        if path.endswith('/chat-messages'):
+            data = json.loads(body or b'{}')
+            self._stream(data.get('conversation_id') or str(uuid.uuid4()))
+            return
+        if path.endswith('/completion-messages'):
+            self._stream('')
+            return
+
+        self.options.delay(self.options.request_latency)
+        if path.endswith('/stop'):
+            self._send_json({'result': 'success'})
+        elif path.endswith('/files/upload'):
+            self._send_json({'id': str(uuid.uuid4()), 'name': 'upload', 'size': len(body), 'extension': 'txt',
+                             'mime_type': 'text/plain', 'created_by': 'bench', 'created_at': int(time.time())})
+        elif path.endswith('/retrieve'):
+            records = [{'segment': {'id': str(uuid.uuid4()), 'position': i + 1, 'content': f'片段{i}',
+                                    'document': {'id': 'doc-1', 'name': 'bench.md', 'data_source_type': 'upload_file'}},
+                        'score': round(0.9 - i * 0.1, 2)} for i in range(3)]
+            self._send_json({'query': {'content': 'q'}, 'records': records})
+        elif re.search(r'/document/create_by_(text|file)$', path) or re.search(r'/update_by_(text|file)$', path):
+            self._send_json({'document': {'id': str(uuid.uuid4()), 'indexing_status': 'waiting'}, 'batch': uuid.uuid4().hex})
+        elif path.endswith('/datasets'):
+            self._send_json({'id': str(uuid.uuid4()), 'name': 'bench'})
+        else:
+            self._send_json({'result': 'success'})
+
+    def do_GET(self):
+        self._read_body()
+        url = urlparse(self.path)
+        if self._fail():
+            return
+
+        self.options.delay(self.options.request_latency)
+        query = parse_qs(url.query)
+        limit = int(query.get('limit', ['20'])[0])
+        if url.path.endswith('/indexing-status'):
+            self._send_json({'data': [{'id': 'doc-1', 'indexing_status': 'completed', 'completed_segments': 1, 'total_segments': 1}]})
+        elif url.path.endswith('/segments'):
+            self._send_json({'data': [{'id': str(i), 'position': i + 1, 'content': f'片段{i}', 'enabled': True} for i in range(3)], 'has_more': False})
+        elif url.path.endswith('/messages'):
+            self._send_json({'data': [{'id': f'm{i}', 'query': 'q', 'answer': 'a', 'created_at': 1000 + i} for i in range(limit)], 'has_more': False, 'limit': limit})
+        elif url.path.endswith('/conversations'):
+            self._send_json({'data': [{'id': f'c{i}', 'name': f'会话{i}', 'created_at': 1000 + i} for i in range(limit)], 'has_more': False, 'limit': limit})
+        elif url.path.endswith('/documents'):
+            self._send_json({'data': [{'id': 'doc-1', 'name': 'bench.md', 'indexing_status': 'completed', 'enabled': True}], 'has_more': False, 'total': 1})
+        elif url.path.endswith('/datasets'):
+            self._send_json({'data': [{'id': f'ds{i}', 'name': f'知识库{i}', 'document_count': 1} for i in range(limit)], 'has_more': False, 'total': limit})
+        else:
+            self._send_json({})
+
+    def do_DELETE(self):
+        self._read_body()
+        if self._fail():
+            return
+        self.send_response(204)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+class MockDifyServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+def start_server(options=None, host='127.0.0.1', port=0):
+    """在后台线程启动替身服务，返回 (server, base_url)"""
+    handler = type('Handler', (MockDifyHandler,), {'options': options or MockOptions()})
+    server = MockDifyServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, name='mock-dify', daemon=True).start()
+    return server, f'http://{host}:{server.server_address[1]}/v1'
+
+def add_arguments(parser):
+    """替身服务的命令行参数（load_test.py复用）"""
+    parser.add_argument('--token-rate', type=float, default=50.0, help='每秒token帧数，0为不限速')
+    parser.add_argument('--tokens', type=int, default=100, help='每个流式响应的token帧数')
+    parser.add_argument('--latency', type=float, default=0.2, help='流式响应的首字节延迟（秒）')
+    parser.add_argument('--jitter', type=float, default=0.1, help='延迟的随机抖动比例')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='返回500的请求比例')
+    parser.add_argument('--stream-failure-rate', type=float, default=0.0, help='流中途失败的比例')
+    parser.add_argument('--metadata-bytes', type=int, default=256, help='每帧附带的元数据大小')
+    parser.add_argument('--request-latency', type=float, default=0.02, help='非流式接口的响应延迟（秒）')
+
+def options_from_args(args):
+    return MockOptions(args.token_rate, args.tokens, args.latency, args.jitter, args.failure_rate,
+                       args.stream_failure_rate, args.metadata_bytes, args.request_latency)
+
+def main():
+    parser = argparse.ArgumentParser(description='压测用的本地Dify替身服务')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=18080)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    server, base_url = start_server(options_from_args(args), args.host, args.port)
+    print(f"🧪 Dify替身服务: {base_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+页面脚本与样式的构建脚本
+压缩 AssetConfig.SOURCE_DIR 下的 .js/.css，按内容哈希命名后写入 AssetConfig.DIST_DIR，
+同时生成gzip（以及安装了brotli时的brotli）预压缩副本和manifest，由 /assets/ 路由以长期缓存返回。
+
+用法:
+    python build_assets.py [--no-minify]
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import sys
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from config import AssetConfig
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 这些字符之后的换行不会影响自动分号插入，可以去掉
+JS_NO_NEWLINE_AFTER = '{;,(['
+# 这些字符（或关键字）之后的 / 是正则表达式的开始而不是除号
+JS_REGEX_AFTER = '(,=:[!&|?{};+-*%<>~^'
+JS_REGEX_KEYWORDS = ('return', 'typeof', 'case', 'do', 'else', 'in', 'of', 'void', 'delete', 'throw', 'new', 'instanceof', 'yield', 'await')
+
+def _is_word(char):
+    return char.isalnum() or char in '_$\\' or ord(char) > 127
+
+def _read_quoted(source, i, quote):
+    """返回从source[i]（引号）开始的字符串字面量结束后的位置"""
+    i += 1
+    while i < len(source):
+        if source[i] == '\\':
+            i += 2
+            continue
+        if source[i] == quote:
+            return i + 1
+        i += 1
+    return i
+
+def _read_regex(source, i):
+    i += 1
+    in_class = False
+    while i < len(source):
+        char = source[i]
+        if char == '\\':
+            i += 2
+            continue
+        if char == '\n':
+            break
+        if char == '[':
+            in_class = True
+        elif char == ']':
+            in_class = False
+        elif char == '/' and not in_class:
+            return i + 1
+        i += 1
+    return i
+
+def minify_js(source):
+    """去掉注释和多余空白
+
+    字符串、模板字符串与正则表达式原样保留；保留必要的换行，不依赖自动分号插入之外的语义，
+    因此不会改变代码行为，只是压缩率低于完整的JS压缩工具。
+    """
+    out = []
+    last = ''  # 最后输出的非空白字符
+    last_word = ''  # 最后输出的标识符或关键字
+    pending = ''  # 待输出的空白：'\n' 或 ' '
+    templates = []  # 嵌套模板字符串中 ${...} 的花括号深度
+    i = 0
+    n = len(source)
+
+    def emit(text):
+        nonlocal last, last_word, pending
+        if pending and last:
+            first = text[0]
+            if pending == '\n' and last not in JS_NO_NEWLINE_AFTER:
+                out.append('\n')
+            elif (_is_word(last) and _is_word(first)) or (last in '+-' and first in '+-') or (last == '/' and first == '/'):
+                out.append(' ')
+        pending = ''
+        out.append(text)
+        last = text[-1]
+        last_word = text if _is_word(text[0]) else ''
+
+    def read_template(i):
+        """从模板字符串内部的位置i读取到结束的反引号或 ${ 为止"""
+        start = i
+        while i < n:
+            if source[i] == '\\':
+                i += 2
+                continue
+            if source[i] == '`':
+                emit(source[start:i + 1])
+                return i + 1, False
+            if source.startswith('${', i):
+                emit(source[start:i + 2])
+                return i + 2, True
+            i += 1
+        emit(source[start:])
+        return n, False
+
+    while i < n:
+        char = source[i]
+        if char in ' \t\r\n':
+            if char == '\n' or pending == '\n':
+                pending = '\n'
+            else:
+                pending = ' '
+            i += 1
+        elif source.startswith('//', i):
+            end = source.find('\n', i)
+            i = n if end == -1 else end
+        elif source.startswith('/*', i):
+            end = source.find('*/', i + 2)
+            end = n if end == -1 else end + 2
+            if '\n' in source[i:end]:
+                pending = '\n'
+            elif not pending:
+                pending = ' '
+            i = end
+        elif char in '\'"':
+            end = _read_quoted(source, i, char)
+            emit(source[i:end])
+            i = end
+        elif char == '`':
+            emit('`')
+            i, opened = read_template(i + 1)
+            if opened:
+                templates.append(0)
+        elif char == '}' and templates and templates[-1] == 0:
+            templates.pop()
+            emit('}')
+            i, opened = read_template(i + 1)
+            if opened:
+                templates.append(0)
+        elif char == '/' and (not last or last in JS_REGEX_AFTER or last_word in JS_REGEX_KEYWORDS):
+            end = _read_regex(source, i)
+            emit(source[i:end])
+            i = end
+        elif _is_word(char):
+            end = i
+            while end < n and _is_word(source[end]):
+                end += 2 if source[end] == '\\' else 1
+            emit(source[i:end])
+            i = end
+        else:
+            if templates:
+                if char == '{':
+                    templates[-1] += 1
+                elif char == '}':
+                    templates[-1] -= 1
+            emit(char)
+            i += 1
+    return ''.join(out) + '\n'
+
+def minify_css(source):
+    """去掉注释和多余空白，字符串原样保留"""
+    out = []
+    last = ''
+    pending = False
+    i = 0
+    n = len(source)
+    while i < n:
+        char = source[i]
+        if char in ' \t\r\n':
+            pending = True
+            i += 1
+            continue
+        if source.startswith('/*', i):
+            end = source.find('*/', i + 2)
+            i = n if end == -1 else end + 2
+            pending = True
+            continue
+
+        if char in '\'"':
+            end = _read_quoted(source, i, char)
+            token = source[i:end]
+            i = end
+        else:
+            token = char
+            i += 1
+        if token == '}' and last == ';':
+            out.pop()
+        elif pending and last and last not in '{};,>:(' and token not in '{};,>)':
+            out.append(' ')
+        pending = False
+        out.append(token)
+        last = token[-1]
+    return ''.join(out) + '\n'
+
+MINIFIERS = {'.js': minify_js, '.css': minify_css}
+
+def build(source_dir=None, dist_dir=None, minify=True):
+    """构建所有资源，返回manifest（源文件名 -> 构建文件名）"""
+    source_dir = os.path.join(ROOT_DIR, source_dir or AssetConfig.SOURCE_DIR)
+    dist_dir = os.path.join(ROOT_DIR, dist_dir or AssetConfig.DIST_DIR)
+    os.makedirs(dist_dir, exist_ok=True)
+
+    manifest = {}
+    for name in sorted(os.listdir(source_dir)):
+        stem, extension = os.path.splitext(name)
+        if extension not in MINIFIERS:
+            continue
+        with open(os.path.join(source_dir, name), encoding='utf-8') as f:
+            text = f.read()
+        data = (MINIFIERS[extension](text) if minify else text).encode('utf-8')
+        built = f'{stem}.{hashlib.sha256(data).hexdigest()[:12]}{extension}'
+        path = os.path.join(dist_dir, built)
+
+        with open(path, 'wb') as f:
+            f.write(data)
+        with open(path + '.gz', 'wb') as f:
+            f.write(gzip.compress(data, 9, mtime=0))
+        if brotli is not None:
+            with open(path + '.br', 'wb') as f:
+                f.write(brotli.compress(data, quality=11))
+        manifest[name] = built
+        print(f"{name:<20} {len(text.encode('utf-8')):>8} -> {len(data):>8} 字节  {built}")
+
+    # 先写入新的manifest，再删除上一次构建的文件；已打开的旧页面仍可能引用旧文件，因此只保留最近一次之前的版本
+    manifest_path = os.path.join(dist_dir, AssetConfig.MANIFEST)
+    previous = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding='utf-8') as f:
+            previous = json.load(f)
+    temp_path = manifest_path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(temp_path, manifest_path)
+
+    keep = set(manifest.values()) | set(previous.values())
+    for name in os.listdir(dist_dir):
+        base = name[:-3] if name.endswith(('.gz', '.br')) else name
+        if name != AssetConfig.MANIFEST and base not in keep:
+            os.remove(os.path.join(dist_dir, name))
+    return manifest
+
+def main():
+    parser = argparse.ArgumentParser(description='构建页面脚本与样式')
+    parser.add_argument('--no-minify', action='store_true', help='不压缩，只生成带哈希的文件名与预压缩副本')
+    args = parser.parse_args()
+
+    manifest = build(minify=not args.no_minify)
+    if brotli is None:
+        print("⚠️ 未安装brotli，只生成gzip副本")
+    print(f"✅ 已构建 {len(manifest)} 个文件")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -22,7 +22,11 @@ class AppConfig:
     # 文件上传配置
     UPLOAD_FOLDER = 'uploads'
     MAX_CONTENT_LENGTH = 50 * 1024 * 1024  # 50MB限制
+    UPLOAD_CHUNK_SIZE = 64 * 1024  # 流式转发上传文件时的分块大小
     ALLOWED_EXTENSIONS = {'txt', 'pdf', 'doc', 'docx', 'xls', 'xlsx', 'csv', 'md', 'html', 'png', 'jpg', 'jpeg', 'gif', 'webp'}
+    
+    # ASGI模式下转交Flask处理的请求在该线程池中运行，相当于WSGI服务器的工作线程数
+    ASGI_WSGI_THREADS = 64
 
 # =============================================================================
 # Dify API配置
@@ -110,6 +114,241 @@ class DifyAPIConfig:
             endpoint = endpoint.format(**kwargs)
         return f"{cls.BASE_URL}{endpoint}"
 
+# =============================================================================
+# 多上游路由配置
+# =============================================================================
+
+class UpstreamConfig:
+    """多个Dify节点的负载均衡与健康检查配置"""
+    
+    # 上游节点列表，为空时只使用DifyAPIConfig.BASE_URL
+    # 各节点须为共享同一数据库的同一Dify部署（API密钥、知识库在各节点通用），例如:
+    # NODES = [
+    #     {'url': 'http://118.196.22.104/v1', 'weight': 2},
+    #     {'url': 'http://118.178.136.53:8080/v1', 'weight': 1},
+    # ]
+    NODES = []
+    
+    # 主动健康检查：定期请求各节点，响应状态码低于500视为健康
+    HEALTH_PATH = '/parameters'
+    HEALTH_INTERVAL = 10  # 检查间隔（秒）
+    HEALTH_TIMEOUT = 3  # 单次检查超时（秒）
+    FAIL_THRESHOLD = 3  # 连续失败（请求异常、5xx或检查失败）多少次后摘除节点
+    RISE_THRESHOLD = 2  # 摘除后连续检查成功多少次重新加入
+    
+    # 会话亲和：会话与生成任务绑定到创建它的节点，后续消息、历史、停止请求都发往该节点
+    AFFINITY_TTL = 86400
+    AFFINITY_MAX_ENTRIES = 100000
+
+# =============================================================================
+# 上游连接池配置
+# =============================================================================
+
+class HTTPPoolConfig:
+    """上游HTTP连接池配置"""
+    
+    # 连接池设置
+    POOL_CONNECTIONS = 10  # 每个API密钥缓存的主机连接池数量
+    POOL_MAXSIZE = 50  # 单个主机连接池保持的最大keep-alive连接数
+    POOL_BLOCK = False  # 连接池耗尽时是否阻塞等待（False则临时新建连接）
+    ASYNC_MAX_CONNECTIONS = 1000  # ASGI模式下异步客户端的最大并发连接数
+    
+    # 重试设置（仅针对连接失败与网关类错误）
+    MAX_RETRIES = 2
+    BACKOFF_FACTOR = 0.3  # 重试间隔: backoff * 2^(n-1) 秒
+    RETRY_STATUS_FORCELIST = (502, 503, 504)
+
+# =============================================================================
+# 上游准入控制配置
+# =============================================================================
+
+class AdmissionConfig:
+    """上游并发准入配置"""
+    
+    # 各类上游调用同时发往Dify的最大请求数（流式请求在整个流期间占用名额）
+    CONCURRENCY_LIMITS = {
+        'chat': 64,
+        'completion': 16,
+        'history': 32,
+        'dataset': 16,
+        'upload': 8,
+    }
+    
+    # 各类调用的等待队列长度，队列已满时直接返回503
+    QUEUE_SIZES = {
+        'chat': 64,
+        'completion': 32,
+        'history': 64,
+        'dataset': 32,
+        'upload': 16,
+    }
+    
+    MAX_WAIT = 5  # 排队最长等待时间（秒），超时返回503
+    RETRY_AFTER = 3  # 503响应的Retry-After（秒）
+
+# =============================================================================
+# 缓存配置
+# =============================================================================
+
+class CacheConfig:
+    """服务端缓存配置"""
+    
+    # 上传文件去重缓存：内容哈希 -> Dify upload_file_id（按API密钥和用户隔离）
+    UPLOAD_CACHE_ENABLED = True
+    UPLOAD_CACHE_TTL = 6 * 60 * 60  # 缓存有效期（秒）
+    UPLOAD_CACHE_MAX_ENTRIES = 2048
+    UPLOAD_CACHE_MAX_BUFFER = 10 * 1024 * 1024  # 超过该大小的文件不做去重，直接流式上传
+    
+    # 会话列表与消息历史缓存（收到message_end时自动失效）
+    HISTORY_CACHE_TTL = 5 * 60
+    HISTORY_CACHE_MAX_ENTRIES = 1024
+    
+    # 知识库检索结果缓存（按知识库隔离，经本应用增删文档或删除知识库时自动失效）
+    # 新文档需等Dify索引完成后才能被检索到，有效期不宜过长
+    RETRIEVAL_CACHE_TTL = 2 * 60
+    RETRIEVAL_CACHE_MAX_ENTRIES = 1024
+    
+    # 文档处理结果缓存：(任务类型, 目标语言, 内容哈希, 应用密钥) -> 完整生成结果，保存在本地SQLite
+    RESULT_CACHE_ENABLED = True
+    RESULT_CACHE_PATH = 'cache/completion_results.sqlite3'
+    RESULT_CACHE_MAX_BYTES = 256 * 1024 * 1024  # 总大小上限，超出后按最近访问时间淘汰
+    RESULT_CACHE_TTL = 7 * 24 * 60 * 60
+    RESULT_CACHE_REPLAY_CHUNK = 2048  # 命中时回放的每帧字符数
+
+# =============================================================================
+# 本地关键词索引配置
+# =============================================================================
+
+class KeywordIndexConfig:
+    """知识库分段的本地BM25镜像索引（需要NumPy）
+    
+    启用后关键词检索（keyword_search）直接在进程内完成，其余检索方式以及索引尚未建好时仍请求Dify。
+    """
+    
+    ENABLED = False
+    K1 = 1.5
+    B = 0.75
+    BUILD_WORKERS = 2  # 拉取分段、构建索引的后台线程数
+    PAGE_SIZE = 100  # 拉取文档列表与分段时的每页条数
+    MAX_AGE = 30 * 60  # 索引建好后超过该时长（秒）在后台全量重建，以同步在Dify中直接做的修改
+
+# =============================================================================
+# 联合检索配置
+# =============================================================================
+
+class FederatedRetrievalConfig:
+    """一次查询并行检索多个知识库"""
+    
+    MAX_DATASETS = 20  # 单次最多检索的知识库数
+    MAX_WORKERS = 8  # 并行检索的线程数（各路由共用）
+    BUDGET = 3.0  # 默认延迟预算（秒），超时的知识库不计入结果
+    MAX_BUDGET = 15.0  # 请求中可指定的最大延迟预算
+
+# =============================================================================
+# 流式转发配置
+# =============================================================================
+
+class StreamConfig:
+    """流式转发配置"""
+    
+    # 聊天流直通模式：只扫描必要字段并直接拼接成帧（不下发上游元数据），仅对message_end做完整解析
+    # 关闭后使用逐帧解析再重新编码的兼容路径
+    CHAT_PASSTHROUGH = True
+    
+    # 文档处理流协议：2为增量协议（只下发新增内容并定期附带校验检查点），1为旧版（每帧携带完整内容）
+    # 请求体中的protocol字段可覆盖该默认值
+    DOCUMENT_PROTOCOL = 2
+    DOCUMENT_CHECKPOINT_INTERVAL = 32  # 每隔多少个增量帧下发一次检查点
+    DOCUMENT_SNAPSHOT_TTL = 600  # 流结束后完整内容保留时长（秒），供校验失败的前端重新同步
+    DOCUMENT_SNAPSHOT_MAX_ENTRIES = 256
+    
+    # 客户端中途断开时关闭上游连接，并在后台调用停止接口结束生成，避免继续消耗token
+    STOP_ON_DISCONNECT = True
+    STOP_WORKERS = 4  # 发送停止请求的后台线程数
+
+# =============================================================================
+# 长文档处理配置
+# =============================================================================
+
+class DocumentConfig:
+    """长文档分块处理配置（map-reduce）"""
+    
+    CHUNK_THRESHOLD = 6000  # 内容超过该字符数时分块处理，否则整篇一次请求
+    CHUNK_SIZE = 3000  # 单个分块的最大字符数，按段落、句子边界切分
+    CHUNK_CONCURRENCY = 4  # 单个文档同时处理的分块数
+    MAX_WORKERS = 16  # 全局分块工作线程数
+    REDUCE_MAX_ROUNDS = 3  # 总结任务的要点过长时最多逐级合并的轮数
+
+# =============================================================================
+# 文本提取配置
+# =============================================================================
+
+class ExtractionConfig:
+    """PDF/Office等文件的本地文本提取配置"""
+    
+    MAX_WORKERS = None  # 解析进程数，None为CPU核数
+    PDF_PAGES_PER_TASK = 8  # PDF按页分成多个任务并行解析，每个任务的页数
+    MAX_PAGES = 2000  # 单个PDF最多提取的页数
+    TASK_TIMEOUT = 120  # 单个解析任务的超时（秒）
+    SPOOL_DIR = None  # 上传文件暂存目录，None为系统临时目录
+    CACHE_PATH = 'cache/extracted_text.sqlite3'  # 提取结果缓存（按文件内容哈希）
+    CACHE_MAX_BYTES = 256 * 1024 * 1024
+    CACHE_TTL = 30 * 24 * 60 * 60
+
+# =============================================================================
+# 知识库批量导入配置
+# =============================================================================
+
+class IngestConfig:
+    """知识库批量导入配置"""
+    
+    MAX_WORKERS = 4  # 全局导入线程数（同时受准入控制中upload/dataset类并发限制）
+    MAX_DOCUMENTS = 1000  # 单个任务最多导入的文档数
+    MAX_REQUEST_SIZE = 1024 * 1024 * 1024  # 批量导入请求体上限，单个文件仍受MAX_CONTENT_LENGTH限制
+    MAX_ATTEMPTS = 4  # 单个文档最多尝试次数（仅对超时、连接失败、429/5xx、服务繁忙重试）
+    BACKOFF_BASE = 2  # 重试退避基数（秒），第n次重试等待约 BACKOFF_BASE * 2^(n-1)
+    BACKOFF_MAX = 60
+    SPOOL_DIR = None  # 接收中的文件暂存目录，默认使用系统临时目录
+    JOB_TTL = 24 * 60 * 60  # 任务进度保留时长（秒）
+    JOB_MAX_ENTRIES = 256
+
+# =============================================================================
+# 目录同步配置
+# =============================================================================
+
+class SyncConfig:
+    """目录到知识库的增量同步配置"""
+    
+    ROOT = None  # 同步API允许访问的根目录，未设置时只能通过命令行（sync_dataset.py）同步
+    MANIFEST_DIR = 'cache/sync'  # 同步清单（文件哈希 -> 文档ID）的保存目录
+    CONCURRENCY = 4  # 同时执行的上传/更新/删除操作数
+    MAX_ATTEMPTS = 3  # 单个操作最多尝试次数（仅对可重试的错误重试）
+    BACKOFF_BASE = 1  # 重试退避基数（秒）
+    JOB_TTL = 24 * 60 * 60  # 同步任务进度保留时长（秒）
+    JOB_MAX_ENTRIES = 64
+
+# =============================================================================
+# 索引状态跟踪配置
+# =============================================================================
+
+class IndexingConfig:
+    """文档索引状态跟踪配置：每个活跃batch只由后台统一轮询一次"""
+    
+    MIN_INTERVAL = 1  # 最短轮询间隔（秒），状态变化后恢复为该值
+    MAX_INTERVAL = 15  # 最长轮询间隔（秒）
+    BACKOFF = 1.5  # 状态无变化时轮询间隔的增长倍数
+    MAX_TRACK_TIME = 2 * 60 * 60  # 单个batch最长跟踪时间（秒）
+    FINISHED_TTL = 10 * 60  # 全部完成后最终状态的保留时长（秒）
+    POLL_WORKERS = 4  # 轮询线程数
+    HEARTBEAT_INTERVAL = 15  # 推送通道的心跳间隔（秒）
+    SUBSCRIBER_QUEUE_SIZE = 100  # 单个订阅者待发送事件上限，超出时丢弃
+    # 推送连接不长期占用工作线程：知识库没有进行中的batch时下发快照后立即结束，
+    # 有进行中的batch时最多保持STREAM_MAX_DURATION秒，之后由浏览器的EventSource自动重连
+    STREAM_MAX_DURATION = 60
+    IDLE_RETRY = 15  # 空闲结束后浏览器的重连间隔（秒）；页面新增文档后会立即重新订阅
+    ACTIVE_RETRY = 1  # 到期结束后浏览器的重连间隔（秒）
+    STATUS_WAIT = 2  # 状态查询接口等待首次轮询结果的最长时间（秒）
+
 # =============================================================================
 # 默认设置
 # =============================================================================
@@ -122,6 +361,8 @@ class DefaultSettings:
     DEFAULT_RESPONSE_MODE = "streaming"
     DEFAULT_CONVERSATION_LIMIT = 20
     DEFAULT_MESSAGE_LIMIT = 20
+    MAX_MESSAGE_LIMIT = 100  # Dify单页最多返回100条消息
+    DEFAULT_HISTORY_DELTA_MAX_PAGES = 5  # 增量加载时最多向前翻页数
     
     # 知识库设置
     DEFAULT_DATASET_PERMISSION = "only_me"
@@ -135,6 +376,35 @@ class DefaultSettings:
     DEFAULT_PAGE_SIZE = 20
     DEFAULT_PAGE = 1
 
+# =============================================================================
+# 静态资源配置
+# =============================================================================
+
+class AssetConfig:
+    """页面脚本与样式的构建和缓存配置"""
+    
+    SOURCE_DIR = 'static/src'  # 页面脚本与样式的源文件
+    DIST_DIR = 'static/dist'  # build_assets.py的输出：压缩后带内容哈希的文件及其gzip/brotli副本
+    MANIFEST = 'manifest.json'  # DIST_DIR中源文件名到构建文件名的映射，不存在时页面直接引用源文件
+    MAX_AGE = 365 * 24 * 60 * 60  # 构建文件名随内容变化，可以长期缓存
+
+# =============================================================================
+# 日志配置
+# =============================================================================
+
+class LogConfig:
+    """日志配置（JSON格式，每条一行）"""
+    
+    LEVEL = "INFO"  # DEBUG时会记录完整的请求与响应内容（已脱敏、截断）
+    QUEUE_SIZE = 10000  # 日志队列容量，队列已满时丢弃新记录而不阻塞请求
+    MAX_FIELD_LENGTH = 2000  # 单个字段的最大字符数
+    MAX_LIST_ITEMS = 50  # 列表字段最多记录的项数
+    # 字段名（小写，'-'视为'_'）等于这些名称或以 _名称 结尾时整体隐藏，如 chat_api_key、x-api-key；
+    # 按完整名称匹配，total_tokens 等用量字段不受影响
+    REDACT_KEYS = ("authorization", "api_key", "apikey", "token", "access_token", "refresh_token", "secret", "client_secret", "secret_key",
+                   "password", "passwd", "cookie", "set_cookie")
+    FILE = None  # 设置后同时写入该文件
+
 # =============================================================================
 # 环境变量支持
 # =============================================================================
@@ -149,15 +419,59 @@ class EnvConfig:
         if os.getenv('DIFY_API_BASE'):
             DifyAPIConfig.BASE_URL = os.getenv('DIFY_API_BASE')
         
+        if os.getenv('DIFY_UPSTREAMS'):
+            # 逗号分隔的节点地址，可用 地址|权重 指定权重
+            UpstreamConfig.NODES = []
+            for item in os.getenv('DIFY_UPSTREAMS').split(','):
+                url, _, weight = item.strip().partition('|')
+                if url:
+                    UpstreamConfig.NODES.append({'url': url, 'weight': float(weight or 1)})
+        
         if os.getenv('DIFY_CHAT_API_KEY'):
             DifyAPIConfig.CHAT_API_KEY = os.getenv('DIFY_CHAT_API_KEY')
         
         if os.getenv('DIFY_DATASET_API_KEY'):
             DifyAPIConfig.DATASET_API_KEY = os.getenv('DIFY_DATASET_API_KEY')
         
+        if os.getenv('DIFY_POOL_MAXSIZE'):
+            HTTPPoolConfig.POOL_MAXSIZE = int(os.getenv('DIFY_POOL_MAXSIZE'))
+        
+        if os.getenv('DIFY_MAX_RETRIES'):
+            HTTPPoolConfig.MAX_RETRIES = int(os.getenv('DIFY_MAX_RETRIES'))
+        
+        if os.getenv('UPLOAD_CACHE_ENABLED'):
+            CacheConfig.UPLOAD_CACHE_ENABLED = os.getenv('UPLOAD_CACHE_ENABLED').lower() == 'true'
+        
+        if os.getenv('RESULT_CACHE_ENABLED'):
+            CacheConfig.RESULT_CACHE_ENABLED = os.getenv('RESULT_CACHE_ENABLED').lower() == 'true'
+        
+        if os.getenv('KEYWORD_INDEX_ENABLED'):
+            KeywordIndexConfig.ENABLED = os.getenv('KEYWORD_INDEX_ENABLED').lower() == 'true'
+        
+        if os.getenv('RESULT_CACHE_PATH'):
+            CacheConfig.RESULT_CACHE_PATH = os.getenv('RESULT_CACHE_PATH')
+        
+        if os.getenv('SYNC_ROOT'):
+            SyncConfig.ROOT = os.getenv('SYNC_ROOT')
+        
+        if os.getenv('CHAT_PASSTHROUGH'):
+            StreamConfig.CHAT_PASSTHROUGH = os.getenv('CHAT_PASSTHROUGH').lower() == 'true'
+        
+        if os.getenv('STOP_ON_DISCONNECT'):
+            StreamConfig.STOP_ON_DISCONNECT = os.getenv('STOP_ON_DISCONNECT').lower() == 'true'
+        
+        if os.getenv('LOG_LEVEL'):
+            LogConfig.LEVEL = os.getenv('LOG_LEVEL')
+        
+        if os.getenv('LOG_FILE'):
+            LogConfig.FILE = os.getenv('LOG_FILE')
+        
         if os.getenv('APP_PORT'):
             AppConfig.PORT = int(os.getenv('APP_PORT'))
         
+        if os.getenv('ASGI_WSGI_THREADS'):
+            AppConfig.ASGI_WSGI_THREADS = int(os.getenv('ASGI_WSGI_THREADS'))
+        
         if os.getenv('APP_DEBUG'):
             AppConfig.DEBUG = os.getenv('APP_DEBUG').lower() == 'true'
 
@@ -212,6 +526,8 @@ def init_config():
     # 打印配置信息
     print("📋 配置信息:")
     print(f"   API地址: {DifyAPIConfig.BASE_URL}")
+    if UpstreamConfig.NODES:
+        print(f"   上游节点: {', '.join(node['url'] for node in UpstreamConfig.NODES)}")
     print(f"   应用端口: {AppConfig.PORT}")
     print(f"   上传目录: {AppConfig.UPLOAD_FOLDER}")
     print(f"   最大文件大小: {AppConfig.MAX_CONTENT_LENGTH // (1024*1024)}MB")
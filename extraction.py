@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Dify智能助手Web应用 文档文本提取
+这些函数在进程池的子进程中运行，因此只依赖标准库和各格式的解析库，不导入app；
+每个函数返回页面（或工作表）文本的列表。
+"""
+
+import importlib
+import io
+from html.parser import HTMLParser
+
+# 解析逻辑变化时递增，使旧的缓存结果失效
+VERSION = 1
+
+class ExtractionError(Exception):
+    """文件无法解析为文本"""
+
+def _require(module):
+    try:
+        return importlib.import_module(module)
+    except ImportError:
+        raise ExtractionError(f'服务器未安装{module}，无法解析该格式')
+
+def _pdf_reader(path):
+    reader = _require('PyPDF2').PdfReader(path)
+    if reader.is_encrypted and not reader.decrypt(''):
+        raise ExtractionError('PDF已加密，无法提取文本')
+    return reader
+
+def pdf_page_count(path):
+    return len(_pdf_reader(path).pages)
+
+def extract_pdf_pages(path, start, end):
+    """提取第start页到第end页（不含）的文本"""
+    reader = _pdf_reader(path)
+    return [(reader.pages[i].extract_text() or '').strip() for i in range(start, end)]
+
+def extract_docx(path, extension=None):
+    document = _require('docx').Document(path)
+    lines = [paragraph.text for paragraph in document.paragraphs]
+    for table in document.tables:
+        for row in table.rows:
+            lines.append('\t'.join(cell.text.strip() for cell in row.cells))
+    return ['\n'.join(lines).strip()]
+
+def extract_spreadsheet(path, extension):
+    """每个工作表一页，按制表符分隔的表格文本输出"""
+    pandas = _require('pandas')
+    if extension == 'csv':
+        sheets = {'': pandas.read_csv(path, dtype=str, keep_default_na=False, encoding_errors='replace')}
+    else:
+        if extension == 'xlsx':
+            _require('openpyxl')
+        sheets = pandas.read_excel(path, sheet_name=None, dtype=str, keep_default_na=False)
+    pages = []
+    for name, frame in sheets.items():
+        buffer = io.StringIO()
+        frame.to_csv(buffer, sep='\t', index=False)
+        text = buffer.getvalue().strip()
+        pages.append(f'## {name}\n{text}' if name else text)
+    return pages
+
+def _read_text(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    for encoding in ('utf-8-sig', 'gb18030'):
+        try:
+            return data.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return data.decode('utf-8', 'replace')
+
+def extract_plain(path, extension=None):
+    return [_read_text(path).strip()]
+
+class _HTMLText(HTMLParser):
+    """去掉标签，只保留正文文本"""
+
+    SKIP = ('script', 'style', 'head', 'noscript')
+    BLOCK = ('p', 'div', 'br', 'li', 'tr', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'section', 'article', 'table')
+
+    def __init__(self):
+        super().__init__()
+        self.parts = []
+        self._skipping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP:
+            self._skipping += 1
+        elif tag in self.BLOCK:
+            self.parts.append('\n')
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP and self._skipping:
+            self._skipping -= 1
+        elif tag in self.BLOCK:
+            self.parts.append('\n')
+
+    def handle_data(self, data):
+        if not self._skipping:
+            self.parts.append(data)
+
+def extract_html(path, extension=None):
+    parser = _HTMLText()
+    parser.feed(_read_text(path))
+    lines = (line.strip() for line in ''.join(parser.parts).splitlines())
+    return ['\n'.join(line for line in lines if line)]
+
+EXTRACTORS = {
+    'docx': extract_docx,
+    'xlsx': extract_spreadsheet,
+    'xls': extract_spreadsheet,
+    'csv': extract_spreadsheet,
+    'txt': extract_plain,
+    'md': extract_plain,
+    'markdown': extract_plain,
+    'html': extract_html,
+    'htm': extract_html
+}
+
+SUPPORTED_EXTENSIONS = frozenset(EXTRACTORS) | {'pdf'}
+
+def extract_document(path, extension):
+    """整体提取非PDF文件的文本"""
+    extractor = EXTRACTORS.get(extension)
+    if extractor is None:
+        raise ExtractionError('不支持从该格式提取文本')
+    return extractor(path, extension)
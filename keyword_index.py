@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Dify智能助手Web应用 本地关键词索引
+知识库分段的进程内倒排索引，用NumPy按BM25打分；未安装NumPy时不可用
+"""
+
+import math
+import re
+import threading
+from collections import Counter
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+AVAILABLE = np is not None
+
+# 英文与数字按词切分，中日韩文字按单字和相邻二字切分
+TOKEN_PATTERN = re.compile(r'[0-9a-z]+|[\u3400-\u4dbf\u4e00-\u9fff\u3040-\u30ff\uac00-\ud7af]+')
+
+def tokenize(text):
+    """把文本切分为索引词"""
+    tokens = []
+    for match in TOKEN_PATTERN.finditer(text.lower()):
+        word = match.group()
+        if word.isascii():
+            tokens.append(word)
+            continue
+        tokens.extend(word)
+        tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+    return tokens
+
+class BM25Index:
+    """单个知识库的分段倒排索引
+
+    每个词的倒排表为 (分段序号数组, 词频数组)，追加时先记在列表中，查询时才转为NumPy数组并缓存。
+    删除文档只把其分段标记为失效，失效分段超过一半时整体压缩重建。
+    分数按查询词的理论上限归一化到0~1，可以和Dify检索的score_threshold一样使用。
+    """
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self._segments = []
+        self._lengths = []
+        self._alive = []
+        self._postings = {}
+        self._frozen = {}
+        self._arrays = None
+        self._documents = {}
+        self._live = 0
+        self._total_length = 0
+        self._lock = threading.Lock()
+
+    def add_document(self, document, segments):
+        """添加（或替换）一个文档的分段，document为 {'id', 'name', ...}"""
+        with self._lock:
+            self._remove(document['id'])
+            positions = []
+            for segment in segments:
+                text = ' '.join(filter(None, (segment.get('content'), segment.get('answer'), ' '.join(segment.get('keywords') or ()))))
+                tokens = tokenize(text)
+                position = len(self._segments)
+                self._segments.append({
+                    'id': segment.get('id'),
+                    'position': segment.get('position'),
+                    'document_id': document['id'],
+                    'content': segment.get('content', ''),
+                    'answer': segment.get('answer'),
+                    'keywords': segment.get('keywords') or [],
+                    'word_count': segment.get('word_count'),
+                    'document': {'id': document['id'], 'name': document.get('name'), 'data_source_type': document.get('data_source_type')}
+                })
+                self._lengths.append(len(tokens))
+                self._alive.append(True)
+                for term, tf in Counter(tokens).items():
+                    ids, tfs = self._postings.setdefault(term, ([], []))
+                    ids.append(position)
+                    tfs.append(tf)
+                    self._frozen.pop(term, None)
+                positions.append(position)
+                self._live += 1
+                self._total_length += len(tokens)
+            self._documents[document['id']] = positions
+            self._arrays = None
+
+    def remove_document(self, document_id):
+        with self._lock:
+            self._remove(document_id)
+            if len(self._segments) > 2 * self._live + 64:
+                self._compact()
+
+    def _remove(self, document_id):
+        for position in self._documents.pop(document_id, ()):
+            self._segments[position] = None
+            self._alive[position] = False
+            self._live -= 1
+            self._total_length -= self._lengths[position]
+        self._arrays = None
+
+    def _compact(self):
+        """丢弃失效分段，重新编号"""
+        remap = {}
+        segments, lengths = [], []
+        for position, segment in enumerate(self._segments):
+            if segment is not None:
+                remap[position] = len(segments)
+                segments.append(segment)
+                lengths.append(self._lengths[position])
+
+        postings = {}
+        for term, (ids, tfs) in self._postings.items():
+            kept = [(remap[i], tf) for i, tf in zip(ids, tfs) if i in remap]
+            if kept:
+                postings[term] = ([i for i, _ in kept], [tf for _, tf in kept])
+
+        self._segments = segments
+        self._lengths = lengths
+        self._alive = [True] * len(segments)
+        self._postings = postings
+        self._frozen = {}
+        self._documents = {document_id: [remap[i] for i in positions] for document_id, positions in self._documents.items()}
+        self._arrays = None
+
+    def _term_arrays(self, term):
+        arrays = self._frozen.get(term)
+        if arrays is None:
+            ids, tfs = self._postings[term]
+            arrays = self._frozen[term] = (np.asarray(ids, dtype=np.int32), np.asarray(tfs, dtype=np.float32))
+        return arrays
+
+    def search(self, query, top_k=3, score_threshold=0.0):
+        """返回 [(分段, 分数), ...]，按分数从高到低"""
+        terms = list(dict.fromkeys(tokenize(query)))
+        with self._lock:
+            terms = [term for term in terms if term in self._postings]
+            if not terms or not self._live:
+                return []
+            if self._arrays is None:
+                self._arrays = (np.asarray(self._lengths, dtype=np.float32), np.asarray(self._alive, dtype=bool))
+            lengths, alive = self._arrays
+
+            avgdl = self._total_length / self._live or 1.0
+            scores = np.zeros(len(self._segments), dtype=np.float32)
+            upper = 0.0
+            for term in terms:
+                ids, tfs = self._term_arrays(term)
+                df = int(alive[ids].sum())
+                if not df:
+                    continue
+                idf = math.log(1 + (self._live - df + 0.5) / (df + 0.5))
+                norm = self.k1 * (1 - self.b + self.b * lengths[ids] / avgdl)
+                scores[ids] += idf * tfs * (self.k1 + 1) / (tfs + norm)
+                upper += idf * (self.k1 + 1)
+            if not upper:
+                return []
+
+            scores /= upper
+            scores[~alive] = 0
+            candidates = np.flatnonzero(scores >= max(score_threshold, 1e-6))
+            if len(candidates) > top_k:
+                candidates = candidates[np.argpartition(-scores[candidates], top_k - 1)[:top_k]]
+            candidates = candidates[np.argsort(-scores[candidates], kind='stable')]
+            return [(self._segments[i], round(float(scores[i]), 4)) for i in candidates]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'documents': len(self._documents),
+                'segments': self._live,
+                'terms': len(self._postings)
+            }
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Dify智能助手Web应用 指标采集
+进程内的Counter/Gauge/Histogram，按Prometheus文本格式输出（/metrics）
+"""
+
+import threading
+import time
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+STREAM_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120)
+RATE_BUCKETS = (1, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.extend(f'{name}="{_escape(value)}"' for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+class Metric:
+    """指标基类：按标签值分组保存数据"""
+
+    type_name = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type_name}']
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}')
+        return lines
+
+class Counter(Metric):
+    """只增计数器"""
+
+    type_name = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(Metric):
+    """可增可减的瞬时值"""
+
+    type_name = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+class Histogram(Metric):
+    """累积分桶直方图"""
+
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state['counts'][i] += 1
+                    break
+            state['sum'] += value
+            state['count'] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type_name}']
+        with self._lock:
+            items = sorted((key, dict(state, counts=list(state['counts']))) for key, state in self._values.items())
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state['counts']):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, [('le', _format_value(float(bound)))])
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(state["sum"])}')
+            lines.append(f'{self.name}_count{labels} {state["count"]}')
+        return lines
+
+class MetricsRegistry:
+    """指标注册表
+
+    除了直接更新的指标外，还可以注册采集函数，在输出时读取连接池、缓存等组件的现有统计。
+    采集函数返回 [(指标名, 类型, 说明, [(标签dict, 值), ...]), ...]。
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def register_collector(self, collector):
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self):
+        """输出Prometheus文本格式"""
+        with self._lock:
+            metrics = list(self._metrics)
+            collectors = list(self._collectors)
+
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        for collector in collectors:
+            for name, type_name, documentation, samples in collector():
+                lines.append(f'# HELP {name} {documentation}')
+                lines.append(f'# TYPE {name} {type_name}')
+                for labels, value in samples:
+                    lines.append(f'{name}{_format_labels(labels.keys(), labels.values())} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = MetricsRegistry()
+
+# 路由指标
+HTTP_REQUESTS = REGISTRY.counter('dify_web_http_requests_total', 'Flask路由请求数', ('route', 'method', 'status'))
+HTTP_LATENCY = REGISTRY.histogram('dify_web_http_request_duration_seconds', 'Flask路由处理耗时（流式响应为返回响应头之前的耗时）', ('route', 'method'))
+
+# 上游指标（按DifyAPIConfig.ENDPOINTS的键区分）
+UPSTREAM_REQUESTS = REGISTRY.counter('dify_web_upstream_requests_total', '发往Dify的请求数', ('endpoint', 'status'))
+UPSTREAM_LATENCY = REGISTRY.histogram('dify_web_upstream_request_duration_seconds', 'Dify请求耗时（流式请求为收到响应头的耗时）', ('endpoint',))
+UPSTREAM_COALESCED = REGISTRY.counter('dify_web_upstream_coalesced_requests_total', '可合并的上游GET请求数（leader为实际发出的请求，follower为共享其结果的请求）', ('endpoint', 'role'))
+
+# 流式响应指标
+STREAMS_IN_FLIGHT = REGISTRY.gauge('dify_web_streams_in_flight', '正在进行的流式响应数', ('route',))
+STREAM_TTFT = REGISTRY.histogram('dify_web_stream_time_to_first_token_seconds', '从收到请求到下发第一帧的耗时', ('route',), STREAM_BUCKETS)
+STREAM_DURATION = REGISTRY.histogram('dify_web_stream_duration_seconds', '流式响应总耗时', ('route',), STREAM_BUCKETS)
+STREAM_TOKENS = REGISTRY.counter('dify_web_stream_tokens_total', '下发的流式帧数', ('route',))
+STREAM_TOKEN_RATE = REGISTRY.histogram('dify_web_stream_tokens_per_second', '单个流从首帧到结束的帧速率', ('route',), RATE_BUCKETS)
+STREAM_DISCONNECTS = REGISTRY.counter('dify_web_stream_client_disconnects_total', '客户端在流结束前断开的次数', ('route',))
+STREAM_WASTED = REGISTRY.histogram('dify_web_stream_abandoned_generation_seconds', '客户端断开时上游已生成的时长（这部分输出无人接收）', ('route',), STREAM_BUCKETS)
+UPSTREAM_STOPS = REGISTRY.counter('dify_web_upstream_stop_requests_total', '客户端断开后发往Dify的停止生成请求（ok/error）', ('status',))
+
+# 联合检索中各知识库的结果
+FEDERATED_RETRIEVALS = REGISTRY.counter('dify_web_federated_retrieval_datasets_total', '联合检索中各知识库的结果（ok/error/busy/timeout）', ('status',))
+FEDERATED_LATENCY = REGISTRY.histogram('dify_web_federated_retrieval_duration_seconds', '联合检索总耗时')
+
+# 文本提取
+EXTRACTION_PAGES = REGISTRY.counter('dify_web_extraction_pages_total', '本地提取的页数（工作表、非PDF文件按整份计）', ('extension',))
+EXTRACTION_DURATION = REGISTRY.histogram('dify_web_extraction_duration_seconds', '单个文件的文本提取耗时', ('extension',), STREAM_BUCKETS)
+
+# 上传与错误
+UPLOAD_BYTES = REGISTRY.counter('dify_web_upload_bytes_total', '上传文件字节数（received为客户端上传，upstream为实际发往Dify）', ('direction',))
+ERRORS = REGISTRY.counter('dify_web_errors_total', '错误数（按类型）', ('type',))
+
+class StreamMeter:
+    """单个流式响应的计量：在途数、首帧耗时、总耗时与帧速率"""
+
+    def __init__(self, route, start=None):
+        self.route = route
+        self.start = start or time.perf_counter()
+        self.first_frame_at = None
+        self.frames = 0
+        self._finished = False
+        STREAMS_IN_FLIGHT.inc(route=route)
+
+    def frame(self):
+        """记录下发的一帧"""
+        now = time.perf_counter()
+        if self.first_frame_at is None:
+            self.first_frame_at = now
+            STREAM_TTFT.observe(now - self.start, route=self.route)
+        self.frames += 1
+
+    def abort(self):
+        """客户端在流结束前断开：记录已生成但无人接收的时长，并结束计量"""
+        if self._finished:
+            return
+        STREAM_DISCONNECTS.inc(route=self.route)
+        STREAM_WASTED.observe(time.perf_counter() - self.start, route=self.route)
+        self.finish()
+
+    def finish(self):
+        """流结束（正常结束或客户端断开），可重复调用"""
+        if self._finished:
+            return
+        self._finished = True
+        now = time.perf_counter()
+        STREAMS_IN_FLIGHT.dec(route=self.route)
+        STREAM_DURATION.observe(now - self.start, route=self.route)
+        if self.frames:
+            STREAM_TOKENS.inc(self.frames, route=self.route)
+            elapsed = now - self.first_frame_at
+            if elapsed > 0:
+                STREAM_TOKEN_RATE.observe(self.frames / elapsed, route=self.route)
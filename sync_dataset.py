@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+目录到知识库的增量同步脚本
+只上传新文件、更新内容变化的文件、删除已移除的文件，同步清单与 /api/datasets/<id>/sync 共用
+
+用法:
+    python sync_dataset.py <dataset_id> <目录> [--dry-run] [--concurrency N] [--checksum] [--manifest PATH]
+"""
+
+import argparse
+import os
+import sys
+
+from app import DatasetSync, dify_client
+from config import SyncConfig
+
+def main():
+    parser = argparse.ArgumentParser(description='把本地目录增量同步到Dify知识库')
+    parser.add_argument('dataset_id', help='知识库ID')
+    parser.add_argument('directory', help='要同步的目录')
+    parser.add_argument('--dry-run', action='store_true', help='只列出将要执行的操作')
+    parser.add_argument('--concurrency', type=int, default=SyncConfig.CONCURRENCY, help='并发操作数')
+    parser.add_argument('--checksum', action='store_true', help='忽略修改时间，重新计算所有文件的哈希')
+    parser.add_argument('--manifest', help='同步清单路径（默认按知识库ID和目录保存在SyncConfig.MANIFEST_DIR下）')
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.directory):
+        print(f"❌ 目录不存在: {args.directory}")
+        return 1
+
+    sync = DatasetSync(dify_client, args.dataset_id, args.directory, manifest_path=args.manifest,
+                       concurrency=args.concurrency, checksum=args.checksum)
+    result = sync.run(dry_run=args.dry_run)
+
+    for action in result['actions']:
+        line = f"{action['op']:<7} {action['status']:<9} {action['path']}"
+        if action['error']:
+            line += f"  ({action['error']})"
+        print(line)
+
+    ops = result['ops']
+    print("=" * 50)
+    print(f"📁 {result['root']} -> 知识库 {args.dataset_id}")
+    print(f"新增 {ops['create']}，更新 {ops['update']}，删除 {ops['delete']}，未变化 {ops['unchanged']}")
+    if result['status'] == 'planned':
+        print("🔍 预演模式，未执行任何操作")
+        return 0
+    if result['status'] == 'completed':
+        print("✅ 同步完成")
+        return 0
+    print(f"⚠️ 同步未全部完成（失败 {result['counts']['failed']} 项），失败的操作会在下次同步时重试")
+    return 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+测试公共夹具
+导入app之前在后台启动Dify替身服务（benchmarks/mock_dify.py），并让应用指向它
+"""
+
+import json
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, os.path.join(ROOT_DIR, 'benchmarks'))
+
+from mock_dify import MockDifyHandler, MockOptions, start_server
+
+class ScriptedOptions(MockOptions):
+    """测试用替身参数：无延迟、少量token，可指定接口返回的错误状态码"""
+
+    def __init__(self):
+        super().__init__(token_rate=0, tokens=5, latency=0, jitter=0, request_latency=0)
+        self.fail_status = None  # 不为None时所有请求返回该状态码
+        self.truncate_streams = False  # 流式响应发送一帧后直接结束，不发送message_end
+
+class ScriptedHandler(MockDifyHandler):
+    def _fail(self):
+        status = self.options.fail_status
+        if status is None:
+            return super()._fail()
+        self._send_json({'code': 'mock_error', 'message': 'mock failure', 'status': status}, status)
+        return True
+
+    def _stream(self, conversation_id):
+        if not self.options.truncate_streams:
+            return super()._stream(conversation_id)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        payload = b'data: ' + json.dumps({'event': 'message', 'answer': '被截断', 'conversation_id': conversation_id}).encode('utf-8') + b'\n\n'
+        self.wfile.write(b'%x\r\n%s\r\n0\r\n\r\n' % (len(payload), payload))
+
+MOCK_OPTIONS = ScriptedOptions()
+MOCK_SERVER, MOCK_URL = start_server(MOCK_OPTIONS)
+MOCK_SERVER.RequestHandlerClass = type('Handler', (ScriptedHandler,), {'options': MOCK_OPTIONS})
+
+os.environ['DIFY_API_BASE'] = MOCK_URL
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+# 处理结果缓存写入临时目录，避免测试之间、测试与本地运行之间互相命中
+os.environ['RESULT_CACHE_PATH'] = os.path.join(tempfile.mkdtemp(prefix='dify-web-test-'), 'completion_results.sqlite3')
+
+@pytest.fixture
+def mock_dify():
+    """替身服务的行为参数，测试结束后恢复默认"""
+    yield MOCK_OPTIONS
+    MOCK_OPTIONS.__init__()
+
+@pytest.fixture
+def client():
+    from app import app
+    app.config['TESTING'] = True
+    return app.test_client()
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""经由ASGI入口的流式路由"""
+
+import asyncio
+import json
+import threading
+import time
+
+import httpx
+import pytest
+
+from app import app as flask_app, dify_client, result_cache
+from asgi import StreamingApplication
+from config import AdmissionConfig, DifyAPIConfig
+import metrics
+
+def post(path, payload):
+    """通过一个全新的ASGI应用发送请求，返回 (状态码, 响应头, 响应体)"""
+    async def run():
+        application = StreamingApplication(flask_app)
+        try:
+            transport = httpx.ASGITransport(app=application)
+            async with httpx.AsyncClient(transport=transport, base_url='http://testserver') as client:
+                response = await client.post(path, json=payload)
+                return response.status_code, response.headers, response.text
+        finally:
+            await application.dify.aclose()
+    return asyncio.run(run())
+
+def test_stream_takes_admission_ticket(mock_dify):
+    gate = dify_client.admission.gates['chat']
+    admitted = gate.admitted
+
+    status, _, body = post('/api/chat/send', {'query': '你好'})
+
+    assert status == 200
+    assert 'message_end' in body
+    assert gate.admitted == admitted + 1
+    assert gate.active == 0
+
+def test_stream_rejected_when_admission_full(mock_dify, monkeypatch):
+    gate = dify_client.admission.gates['completion']
+    monkeypatch.setattr(gate, 'concurrency', 0)
+    monkeypatch.setattr(gate, 'queue_size', 0)
+
+    status, headers, body = post('/api/document/process', {'type': 'translate', 'content': '不在缓存中的内容 503', 'language': 'en'})
+
+    assert status == 503
+    assert headers['retry-after'] == str(AdmissionConfig.RETRY_AFTER)
+    assert '繁忙' in json.loads(body)['error']
+
+def upstream_samples(endpoint, status):
+    """返回 (请求计数, 耗时样本数)"""
+    requests_total = metrics.UPSTREAM_REQUESTS._values.get((endpoint, str(status)), 0)
+    latency = metrics.UPSTREAM_LATENCY._values.get((endpoint,), {'count': 0})['count']
+    return requests_total, latency
+
+@pytest.mark.parametrize('fail_status', [None, 400, 500])
+def test_stream_records_upstream_metrics(mock_dify, fail_status):
+    mock_dify.fail_status = fail_status
+    status = fail_status or 200
+    before = upstream_samples('chat_messages', status)
+
+    post('/api/chat/send', {'query': '你好'})
+
+    assert upstream_samples('chat_messages', status) == (before[0] + 1, before[1] + 1)
+
+def test_stream_records_upstream_timeout(mock_dify, monkeypatch):
+    mock_dify.latency = 1
+    monkeypatch.setattr(DifyAPIConfig, 'TIMEOUT', 0.1)
+    before = upstream_samples('completion_messages', 'error')
+    timeouts = metrics.ERRORS._values.get(('ReadTimeout',), 0)
+
+    _, _, body = post('/api/document/process', {'type': 'translate', 'content': '超时测试的内容', 'language': 'en'})
+
+    assert json.loads(body[len('data: '):]) == {'error': 'API请求失败'}
+    assert upstream_samples('completion_messages', 'error') == (before[0] + 1, before[1] + 1)
+    assert metrics.ERRORS._values.get(('ReadTimeout',), 0) == timeouts + 1
+
+def test_document_result_cache_off_event_loop(mock_dify, monkeypatch):
+    """结果缓存的读写不在事件循环线程中执行"""
+    calls = []
+    stored = threading.Event()
+    get, set_ = result_cache.get, result_cache.set
+
+    def record(name, function, done=None):
+        def wrapper(*args):
+            calls.append((name, threading.current_thread() is threading.main_thread()))
+            try:
+                return function(*args)
+            finally:
+                if done is not None:
+                    done.set()
+        return wrapper
+
+    monkeypatch.setattr(result_cache, 'get', record('get', get))
+    monkeypatch.setattr(result_cache, 'set', record('set', set_, stored))
+    payload = {'type': 'translate', 'content': '缓存线程测试的内容', 'language': 'en'}
+
+    hits = result_cache.hits
+    post('/api/document/process', payload)
+    # 写入在响应结束后于后台完成，等写入落盘后再发第二个请求
+    assert stored.wait(5)
+    post('/api/document/process', payload)
+
+    assert ('get', False) in calls and ('set', False) in calls
+    assert not any(on_loop for _, on_loop in calls)
+    assert result_cache.hits == hits + 1
+
+def request_all(*requests):
+    """通过同一个ASGI应用同时发送多个请求，返回各自的 (状态码, 耗时秒)"""
+    async def run():
+        application = StreamingApplication(flask_app)
+        transport = httpx.ASGITransport(app=application)
+        async with httpx.AsyncClient(transport=transport, base_url='http://testserver', timeout=30) as client:
+            async def one(method, path, payload=None):
+                start = time.perf_counter()
+                response = await client.request(method, path, json=payload)
+                return response.status_code, time.perf_counter() - start
+            try:
+                return await asyncio.gather(*(one(*request) for request in requests))
+            finally:
+                await application.dify.aclose()
+    return asyncio.run(run())
+
+def test_flask_routes_run_concurrently(mock_dify):
+    mock_dify.request_latency = 0.5
+
+    # 参数不同，不会被合并为一次上游请求
+    results = request_all(('GET', '/api/datasets?page=1'), ('GET', '/api/datasets?page=2'), ('GET', '/api/datasets?page=3'))
+
+    assert [status for status, _ in results] == [200, 200, 200]
+    assert max(elapsed for _, elapsed in results) < 1.0
+
+def test_stream_admission_queue_is_bounded(mock_dify, monkeypatch):
+    gate = dify_client.admission.gates['chat']
+    monkeypatch.setattr(gate, 'concurrency', 1)
+    monkeypatch.setattr(gate, 'queue_size', 1)
+    monkeypatch.setattr(gate, 'max_wait', 5)
+    mock_dify.latency = 0.3
+    rejected = gate.rejected
+
+    results = request_all(*[('POST', '/api/chat/send', {'query': f'排队{i}'}) for i in range(3)])
+
+    # 一个立即放行，一个排队等到名额，一个队列已满立即返回503
+    assert sorted(status for status, _ in results) == [200, 200, 503]
+    assert min(elapsed for status, elapsed in results if status == 503) < 0.2
+    assert gate.rejected == rejected + 1
+    assert gate.active == 0 and gate.waiting == 0
+
+def test_stream_admission_wait_times_out(mock_dify, monkeypatch):
+    gate = dify_client.admission.gates['chat']
+    monkeypatch.setattr(gate, 'concurrency', 1)
+    monkeypatch.setattr(gate, 'queue_size', 5)
+    monkeypatch.setattr(gate, 'max_wait', 0.1)
+    mock_dify.latency = 0.5
+    timeouts = gate.timeouts
+
+    results = request_all(*[('POST', '/api/chat/send', {'query': f'超时{i}'}) for i in range(2)])
+
+    assert sorted(status for status, _ in results) == [200, 503]
+    assert gate.timeouts == timeouts + 1
+    assert gate.active == 0 and gate.waiting == 0
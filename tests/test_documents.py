@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""长文档分块处理"""
+
+import asyncio
+
+import httpx
+import pytest
+
+import app as app_module
+from app import app as flask_app, result_cache
+from asgi import StreamingApplication
+from config import DocumentConfig
+
+@pytest.fixture
+def chunked_jobs(monkeypatch):
+    """记录创建的分块任务"""
+    jobs = []
+
+    class RecordingJob(app_module.ChunkedDocumentJob):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            jobs.append(self)
+
+    monkeypatch.setattr(app_module, 'ChunkedDocumentJob', RecordingJob)
+    return jobs
+
+class RecordingApplication(StreamingApplication):
+    """记录转交Flask的请求"""
+
+    def __init__(self, wsgi_app):
+        super().__init__(wsgi_app)
+        self.forwarded = []
+
+    async def _call_wsgi(self, scope, receive, send):
+        self.forwarded.append(scope['path'])
+        await super()._call_wsgi(scope, receive, send)
+
+def process_via_asgi(payload, chunked_transfer=False):
+    """返回 (状态码, 是否转交Flask处理)"""
+    async def run():
+        application = RecordingApplication(flask_app)
+        body = app_module.json.dumps(payload).encode('utf-8')
+
+        async def stream():
+            yield body
+
+        try:
+            transport = httpx.ASGITransport(app=application)
+            async with httpx.AsyncClient(transport=transport, base_url='http://testserver') as client:
+                response = await client.post('/api/document/process', content=stream() if chunked_transfer else body,
+                                             headers={'Content-Type': 'application/json'})
+                return response.status_code, bool(application.forwarded)
+        finally:
+            await application.dify.aclose()
+    return asyncio.run(run())
+
+def test_short_multibyte_document_is_not_chunked(mock_dify, chunked_jobs):
+    content = '中' * (DocumentConfig.CHUNK_THRESHOLD // 2)
+
+    # 字节数超过阈值、字符数未超过，仍在事件循环中直接转发
+    assert process_via_asgi({'type': 'translate', 'content': content, 'language': 'en'}) == (200, False)
+    assert chunked_jobs == []
+
+def test_long_document_without_content_length_is_chunked(mock_dify, chunked_jobs):
+    content = '长文档分块。' * (DocumentConfig.CHUNK_THRESHOLD // 5)
+
+    assert process_via_asgi({'type': 'translate', 'content': content, 'language': 'en'}, chunked_transfer=True) == (200, True)
+    assert len(chunked_jobs) == 1
+
+def test_truncated_chunk_is_an_error_and_not_cached(client, mock_dify):
+    mock_dify.truncate_streams = True
+    content = '截断的分块。' * (DocumentConfig.CHUNK_THRESHOLD // 5)
+    stores = result_cache.stores
+
+    body = client.post('/api/document/process', json={'type': 'translate', 'content': content, 'language': 'en', 'protocol': 1}).get_data(as_text=True)
+
+    assert '文本生成未正常结束' in app_module.json.loads(body.strip().split('\n\n')[-1][len('data: '):]).get('error', '')
+    assert result_cache.stores == stores
+    assert result_cache.get(result_cache.make_key('translate', 'en', content)) is None
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""文本提取不阻塞ASGI模式下的其他路由"""
+
+import asyncio
+import time
+import uuid
+
+import httpx
+
+from app import app as flask_app, text_extractor
+from asgi import StreamingApplication
+
+def test_extraction_does_not_block_other_routes(mock_dify, monkeypatch):
+    def slow_run(path, extension, extract_id):
+        for page in ('第一页', '第二页'):
+            time.sleep(0.5)
+            yield page
+
+    monkeypatch.setattr(text_extractor, 'run', slow_run)
+
+    async def run():
+        application = StreamingApplication(flask_app)
+        transport = httpx.ASGITransport(app=application)
+        async with httpx.AsyncClient(transport=transport, base_url='http://testserver', timeout=30) as client:
+            async def extract():
+                files = {'file': ('doc.txt', f'提取测试 {uuid.uuid4()}'.encode('utf-8'), 'text/plain')}
+                response = await client.post('/api/document/extract', files=files)
+                return response.text, time.perf_counter()
+
+            async def health():
+                await asyncio.sleep(0.2)
+                response = await client.get('/api/health')
+                return response.status_code, time.perf_counter()
+
+            try:
+                return await asyncio.gather(extract(), health())
+            finally:
+                await application.dify.aclose()
+
+    (extracted, extract_done), (status, health_done) = asyncio.run(run())
+
+    assert status == 200
+    assert '"type": "end"' in extracted
+    assert health_done < extract_done - 0.3
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""索引状态推送与查询不长期占用工作线程"""
+
+import threading
+import time
+
+from app import IndexingTracker, SegmentMirror, indexing_tracker
+from config import IndexingConfig
+
+def test_idle_event_stream_ends_with_retry(client):
+    start = time.monotonic()
+
+    body = client.get('/api/datasets/ds-idle/indexing/events').get_data()
+
+    assert time.monotonic() - start < 1
+    assert body.startswith(b'data: {"type": "snapshot"')
+    assert body.endswith(f'retry: {IndexingConfig.IDLE_RETRY * 1000}\n\n'.encode('ascii'))
+
+def test_active_event_stream_ends_after_max_duration(client, monkeypatch):
+    monkeypatch.setattr(IndexingConfig, 'STREAM_MAX_DURATION', 0.3)
+    monkeypatch.setattr(IndexingConfig, 'HEARTBEAT_INTERVAL', 0.1)
+    monkeypatch.setattr(indexing_tracker, 'has_active', lambda dataset_id: True)
+    start = time.monotonic()
+
+    body = client.get('/api/datasets/ds-active/indexing/events').get_data()
+
+    assert 0.3 <= time.monotonic() - start < 1
+    assert b': ping' in body
+    assert body.endswith(f'retry: {IndexingConfig.ACTIVE_RETRY * 1000}\n\n'.encode('ascii'))
+
+def test_status_wait_is_capped(client, mock_dify, monkeypatch):
+    monkeypatch.setattr(IndexingConfig, 'STATUS_WAIT', 0.2)
+    mock_dify.request_latency = 1
+    start = time.monotonic()
+
+    response = client.get('/api/datasets/ds-slow/documents/batch-slow/status')
+
+    assert time.monotonic() - start < 0.8
+    assert response.get_json()['finished'] is False
+
+class DatasetClient:
+    """记录文档列表请求次数的上游替身"""
+
+    def __init__(self, documents):
+        self.documents = documents
+        self.document_pages = 0
+
+    def fetch_documents(self, dataset_id, page=None, limit=None):
+        self.document_pages += 1
+        return {'data': self.documents, 'has_more': False}
+
+    def fetch_segments(self, dataset_id, document_id, page=None, limit=None):
+        return {'data': [{'id': f'{document_id}-seg', 'content': '内容'}], 'has_more': False}
+
+    def fetch_indexing_status(self, dataset_id, batch_id):
+        return {'data': [{'id': document['id'], 'indexing_status': 'completed'} for document in self.documents]}
+
+class RecordingIndex:
+    def __init__(self, expected):
+        self.documents = {}
+        self.expected = expected
+        self.done = threading.Event()
+
+    def add_document(self, document, segments):
+        self.documents[document['id']] = document['name']
+        if len(self.documents) == self.expected:
+            self.done.set()
+
+def mirror_with_index(client, dataset_id, expected):
+    mirror = SegmentMirror(client)
+    index = mirror._indexes[dataset_id] = RecordingIndex(expected)
+    mirror._built_at[dataset_id] = time.time()
+    return mirror, index
+
+def test_batch_names_resolved_with_one_document_listing():
+    documents = [{'id': f'doc-{i}', 'name': f'文档{i}.md'} for i in range(5)]
+    client = DatasetClient(documents)
+    mirror, index = mirror_with_index(client, 'ds-names', len(documents))
+
+    mirror.refresh_documents('ds-names', [{'id': document['id'], 'indexing_status': 'completed'} for document in documents])
+
+    assert index.done.wait(5)
+    assert client.document_pages == 1
+    assert index.documents == {document['id']: document['name'] for document in documents}
+
+def test_tracked_document_names_skip_document_listing():
+    client = DatasetClient([{'id': 'doc-1', 'name': '列表中的名称.md'}])
+    mirror, index = mirror_with_index(client, 'ds-tracked', 1)
+    tracker = IndexingTracker(client, on_batch_done=mirror.refresh_documents)
+
+    tracker.track('ds-tracked', 'batch-1', {'id': 'doc-1', 'name': '提交的名称.md'})
+
+    assert index.done.wait(5)
+    assert client.document_pages == 0
+    assert index.documents == {'doc-1': '提交的名称.md'}
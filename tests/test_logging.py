@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""日志字段脱敏"""
+
+import logging
+
+from app_logging import REDACTED, sanitize
+
+def test_usage_counts_survive_redaction():
+    usage = {'prompt_tokens': 12, 'completion_tokens': 34, 'total_tokens': 46, 'total_price': '0.001'}
+
+    assert sanitize({'metadata': {'usage': usage}}) == {'metadata': {'usage': usage}}
+
+def test_secret_keys_are_redacted():
+    fields = {
+        'Authorization': 'Bearer abc',
+        'X-Api-Key': 'k',
+        'chat_api_key': 'k',
+        'token': 't',
+        'access_token': 't',
+        'password': 'p',
+        'headers': {'Cookie': 'session=1'},
+    }
+
+    result = sanitize(fields)
+
+    assert result == {key: REDACTED for key in fields if key != 'headers'} | {'headers': {'Cookie': REDACTED}}
+
+def test_response_body_not_logged_when_debug_is_off(mock_dify, monkeypatch):
+    from app import dify_client, logger
+
+    debug_calls = []
+    monkeypatch.setattr(logger, 'debug', lambda *args, **kwargs: debug_calls.append(args))
+    assert not logger.isEnabledFor(logging.DEBUG)
+
+    assert dify_client.submit_document_by_text('ds-log', '文档', '内容')['document']['id']
+    assert dify_client.create_dataset('日志测试')['id']
+    # 未开启DEBUG时不应为日志解码响应体
+    assert [args[0] for args in debug_calls if args[0].endswith('响应')] == []
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+"""聊天流转发器"""
+
+import json
+
+import pytest
+
+from app import ChatStreamRelay, PassthroughChatRelay
+
+def upstream_line(data, ensure_ascii):
+    return b'data: ' + json.dumps(data, ensure_ascii=ensure_ascii).encode('utf-8')
+
+@pytest.mark.parametrize('ensure_ascii', [True, False])
+def test_passthrough_frames_match_reencoded_frames(ensure_ascii):
+    base = {'task_id': 't-1', 'id': 'm-1', 'message_id': 'm-1', 'conversation_id': 'c-1', 'created_at': 1}
+    answers = ['你好', ' "引号" ', 'a\\b', '换\n行', '', '{"answer": "x"}']
+    lines = [upstream_line(dict(base, event='message', answer=answer, metadata={'padding': 'x' * 512},
+                                from_variable_selector=['llm', 'text']), ensure_ascii) for answer in answers]
+    lines.append(upstream_line(dict(base, event='message_end', metadata={'usage': {'total_tokens': 6}}), ensure_ascii))
+
+    reencode, passthrough = ChatStreamRelay(), PassthroughChatRelay()
+    for line in lines:
+        expected, frame = reencode.feed(line), passthrough.feed(line)
+        assert frame.startswith(b'data: ') and frame.endswith(b'\n\n')
+        assert json.loads(frame[6:]) == json.loads(expected[6:])
+
+    assert passthrough.task_id == 't-1'
+    assert passthrough.conversation_id == 'c-1'
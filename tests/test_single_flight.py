@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+"""合并的上游读取在写操作之后重新发出"""
+
+import threading
+import time
+
+import pytest
+
+from app import app as flask_app
+import metrics
+
+def leaders(endpoint):
+    return metrics.UPSTREAM_COALESCED._values.get((endpoint, 'leader'), 0)
+
+def get_in_background(path):
+    thread = threading.Thread(target=lambda: flask_app.test_client().get(path))
+    thread.start()
+    return thread
+
+@pytest.mark.parametrize('endpoint, read_path, write_path', [
+    ('datasets', '/api/datasets', '/api/datasets/ds-delete'),
+    ('dataset_documents', '/api/datasets/ds-docs/documents', '/api/datasets/ds-docs/documents/doc-1'),
+    ('dataset_documents', '/api/datasets/ds-gone/documents', '/api/datasets/ds-gone'),
+])
+def test_delete_forgets_in_flight_reads(client, mock_dify, endpoint, read_path, write_path):
+    mock_dify.request_latency = 0.3
+    before = leaders(endpoint)
+
+    # 删除之前发出的读取尚未返回时，删除之后的读取不能合并到它上面
+    first = get_in_background(read_path)
+    time.sleep(0.1)
+    client.delete(write_path)
+    second = get_in_background(read_path)
+    first.join()
+    second.join()
+
+    assert leaders(endpoint) == before + 2
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+"""上游节点租约与连接的释放"""
+
+import json
+
+import pytest
+
+from app import dify_client
+
+@pytest.mark.parametrize('status', [400, 404, 500, 502])
+def test_stream_error_releases_upstream_node(client, mock_dify, status):
+    mock_dify.fail_status = status
+    for _ in range(3):
+        response = client.post('/api/chat/send', json={'query': '你好'})
+        assert json.loads(response.get_data(as_text=True)[len('data: '):]) == {'error': 'API请求失败'}
+
+    assert all(node.outstanding == 0 for node in dify_client.upstreams.nodes)
+    assert dify_client.admission.stats()['chat']['active'] == 0
@@ -133,6 +133,16 @@ else
     log_warn "requirements.txt 不存在，跳过依赖更新"
 fi
 
+# 构建页面脚本与样式
+log_step "构建静态资源..."
+if [ -f "build_assets.py" ]; then
+    if ${PYTHON_PATH:-python3} build_assets.py; then
+        log_info "静态资源构建完成"
+    else
+        log_warn "静态资源构建失败，页面将直接引用未压缩的源文件"
+    fi
+fi
+
 # 验证关键文件
 log_step "验证应用文件..."
 if [ ! -f "run.py" ]; then